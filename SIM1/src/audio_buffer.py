@@ -0,0 +1,99 @@
+import json
+import shutil
+import subprocess
+import tempfile
+import wave
+import numpy as np
+from pathlib import Path
+from feature_cache import get_cached
+from profiling import file_size, stage
+
+audio_cache_path = '../../audio/cache/'
+audio_header_filename = 'header.json'
+audio_samples_filename = 'samples.f32'
+default_sample_rate = 22050
+
+
+def ffmpeg_binary():
+    # moviepy ships the ffmpeg binary it is configured with
+    from moviepy.config import get_setting
+    return get_setting('FFMPEG_BINARY')
+
+
+def decode_audio_track(video_path, samples_file, sample_rate=default_sample_rate, chunk_size=1 << 20):
+    """
+    The aim of this method is to decode the audio track of a video to raw mono float32 samples at the given sample
+    rate. ffmpeg writes the samples to a pipe, which is copied in chunks to the samples file, so neither a wav file
+    nor the whole track in memory is needed.
+    :param video_path: path of the video
+    :param samples_file: path of the raw float32 samples file
+    :param sample_rate: sample rate the audio is resampled to
+    :param chunk_size: number of bytes copied at once
+    :return: number of decoded samples
+    """
+    command = [ffmpeg_binary(), '-v', 'error', '-i', video_path, '-vn', '-ac', '1', '-ar', str(sample_rate),
+               '-f', 'f32le', '-acodec', 'pcm_f32le', '-']
+
+    with stage('decode_audio', items=1, bytes_read=file_size(video_path)) as counters:
+        # stderr goes to a file, a pipe that is only read after stdout blocks ffmpeg once it is full of warnings
+        with open(samples_file, 'wb') as f, tempfile.TemporaryFile() as error_file:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=error_file)
+            shutil.copyfileobj(process.stdout, f, chunk_size)
+            process.stdout.close()
+            if process.wait() != 0:
+                error_file.seek(0)
+                raise IOError('Failed to decode audio of video %r: %s' %
+                              (video_path, error_file.read().decode(errors='replace')))
+        counters['bytes_written'] = file_size(samples_file)
+
+    return file_size(samples_file) // 4
+
+
+def load_audio_samples(entry_path):
+    """
+    :param entry_path: directory holding a decoded audio track
+    :return: tuple of the memory-mapped float32 samples and the sample rate
+    """
+    with open(entry_path + audio_header_filename, 'r') as f:
+        header = json.load(f)
+
+    if header['no_of_samples'] == 0:
+        return np.empty(0, dtype=np.float32), header['sample_rate']
+    return np.memmap(entry_path + audio_samples_filename, dtype=np.float32, mode='r'), header['sample_rate']
+
+
+def load_episode_audio(video_path, sample_rate=default_sample_rate, cache_path=None):
+    """
+    The aim of this method is to return the audio track of a video as float32 samples. The track is decoded once into
+    a cache entry keyed by the video and the sample rate, reruns memory-map the cached samples.
+    :param video_path: path of the video
+    :param sample_rate: sample rate the audio is resampled to
+    :param cache_path: directory of the cache, defaults to audio_cache_path
+    :return: tuple of the memory-mapped mono float32 samples and the sample rate
+    """
+    def create(path):
+        no_of_samples = decode_audio_track(video_path, path + audio_samples_filename, sample_rate)
+        with open(path + audio_header_filename, 'w') as f:
+            json.dump({'sample_rate': sample_rate, 'no_of_samples': no_of_samples}, f, indent=2)
+
+    entry_path = get_cached('audio', [video_path], {'sample_rate': sample_rate, 'channels': 1, 'dtype': 'float32'},
+                            create, cache_path=cache_path or audio_cache_path)
+    return load_audio_samples(entry_path)
+
+
+def write_wav(wav_path, samples, sample_rate):
+    """
+    The aim of this method is to write float32 samples as 16 bit mono wav file.
+    :param wav_path: path of the wav file
+    :param samples: float32 samples in [-1, 1]
+    :param sample_rate: sample rate of the samples
+    :return: number of bytes written
+    """
+    Path(wav_path).parent.mkdir(parents=True, exist_ok=True)
+    with wave.open(wav_path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes((np.clip(samples, -1, 1) * 32767).astype(np.int16).tobytes())
+
+    return 44 + 2 * len(samples)
@@ -1,7 +1,10 @@
-from moviepy.editor import *
 import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from pydub import AudioSegment
+from audio_buffer import load_episode_audio, write_wav
+from profiling import call_profiled, file_size, merge_stage_stats, stage
+from screentime import ScreenTimeIndex
+from timebase import TimeBase
 
 character_map = {0: 'kermit_the_frog',
                  1: 'waldorf_and_statler',
@@ -9,15 +12,31 @@ character_map = {0: 'kermit_the_frog',
                  3: 'swedish_chef',
                  4: 'none'}
 
+video_paths = ['../../videos/Muppets-02-01-01.avi', '../../videos/Muppets-02-04-04.avi',
+               '../../videos/Muppets-03-04-03.avi']
+ground_truth_textfiles = ['../../ground_truth/Muppets-02-01-01/Muppets-02-01-01.txt',
+                          '../../ground_truth/Muppets-02-04-04/Muppets-02-04-04.txt',
+                          '../../ground_truth/Muppets-03-04-03/Muppets-03-04-03.txt']
+audio_snippet_base_path = '../../audio/'
+episode_audio_base_path = '../../audio/episodes/'
+
+
+def episode_audio_path(video_path, audio_base_path=episode_audio_base_path):
+    return audio_base_path + os.path.basename(os.path.normpath(video_path)).split('.')[0] + '.wav'
+
 
 def extract_audio_from_video(video_path, audio_base_path):
+    from moviepy.editor import VideoFileClip
+
     # extract audio from avi video
     print('[INFO] Start extracting wav from avi')
-    filename = audio_base_path + os.path.basename(os.path.normpath(video_path)).split('.')[0] + '.wav'
+    filename = episode_audio_path(video_path, audio_base_path)
     if not os.path.isfile(filename):
-        video = VideoFileClip(video_path)
-        video.audio.write_audiofile(filename)
-        video.close()
+        with stage('extract_wav', items=1, bytes_read=file_size(video_path)) as counters:
+            video = VideoFileClip(video_path)
+            video.audio.write_audiofile(filename)
+            video.close()
+            counters['bytes_written'] = file_size(filename)
         print('[INFO] Finished extracting wav from avi')
     else:
         print('[INFO] Wav File already exists')
@@ -25,72 +44,86 @@ def extract_audio_from_video(video_path, audio_base_path):
 
 def extract_character_screentime(ground_truth_textfile):
     print('[INFO] Start calculating screen times for characters')
+    screentime_index = ScreenTimeIndex.from_file(ground_truth_textfile)
     screen_time_dict = {}
     for key in character_map:
-        screen_time_dict[key] = screentime_per_class(ground_truth_textfile, key)
+        screen_time_dict[key] = screentime_index.intervals(key)
 
     print('[INFO] Finished calculating screen times for characters')
     return screen_time_dict
 
 
 def screentime_per_class(ground_truth_textfile, class_label):
-    with open(ground_truth_textfile) as file:
-        lines = file.readlines()
-
-    intervals = []
-    in_interval = False
-    interval_start_frame_id = -1
-    interval_end_frame_id = -1
-    for line in lines[1:]:
-        splits = line.strip().split(',')
-        frame_id = splits[0]
-        labels = [int(splits[i]) for i in range(1, len(splits))]
-
-        if class_label in labels:
-            if in_interval is False:
-                interval_start_frame_id = frame_id
-                in_interval = True
-        else:
-            if in_interval is True:
-                interval_end_frame_id = frame_id
-                in_interval = False
-                intervals.append((interval_start_frame_id, interval_end_frame_id))
-
-    return intervals
-
-
-def slice_audio_from_video(ground_truth_textfile, audio_path, audio_base_path, video_fps, file_id):
+    return ScreenTimeIndex.from_file(ground_truth_textfile).intervals(class_label)
+
+
+def slice_audio_from_video(ground_truth_textfile, samples, timebase, audio_base_path, file_id):
+    """
+    The aim of this method is to write the screen time intervals of every character as audio snippets. The snippets
+    are sliced by sample index from the decoded audio track of the video.
+    :param ground_truth_textfile: path of the ground truth text file of the video
+    :param samples: float32 samples of the audio track, see audio_buffer.load_episode_audio
+    :param timebase: TimeBase of the video and the samples
+    :param audio_base_path: directory the audio snippets are written to
+    :param file_id: id of the video used in the snippet filenames
+    """
     screen_time_map = extract_character_screentime(ground_truth_textfile)
-    audio = AudioSegment.from_wav(audio_path)
 
     print('[INFO] Start slicing audio files')
     for key, value in screen_time_map.items():
         print('[INFO] Start slicing for label: %d' % key)
-        for i, interval in enumerate(value):
-            start = (float(interval[0]) / video_fps) * 1000
-            end = (float(interval[1]) / video_fps) * 1000
-            audio_chunk = audio[start:end]
-            audio_chunk.export(audio_base_path + str(file_id) + '_' + str(key) + '_' + str(i) + '.wav', format='wav')
+        with stage('slice_audio') as counters:
+            for i, (start, end) in enumerate(timebase.frames_to_samples(value).reshape(-1, 2)):
+                snippet_filename = audio_base_path + str(file_id) + '_' + str(key) + '_' + str(i) + '.wav'
+                counters['bytes_written'] += write_wav(snippet_filename, samples[start:end], timebase.sample_rate)
+                counters['items'] += 1
         print('[INFO] Finished slicing for label: %d' % key)
 
 
-def extract_audio_snippets():
-    video_paths = ['../../videos/Muppets-02-01-01.avi', '../../videos/Muppets-02-04-04.avi',
-                   '../../videos/Muppets-03-04-03.avi']
-    test_audio_base_path = '../../audio/'
-    audio_paths = [test_audio_base_path + 'Muppets-02-01-01.wav', test_audio_base_path + 'Muppets-02-04-04.wav',
-                   test_audio_base_path + 'Muppets-03-04-03.wav']
-    ground_truth_textfiles = ['../../ground_truth/Muppets-02-01-01/Muppets-02-01-01.txt',
-                              '../../ground_truth/Muppets-02-04-04/Muppets-02-04-04.txt',
-                              '../../ground_truth/Muppets-03-04-03/Muppets-03-04-03.txt']
-    fps = 25
-
-    Path(test_audio_base_path).mkdir(parents=True, exist_ok=True)
+def extract_audio_snippets_for_video(video_path, ground_truth_textfile, audio_base_path, file_id):
+    """
+    The aim of this method is to extract the audio snippets of all characters for a single video. The frame rate
+    is read from the video.
+    :param video_path: path of the video
+    :param ground_truth_textfile: path of the ground truth text file of the video
+    :param audio_base_path: directory the audio snippets are written to
+    :param file_id: id of the video used in the snippet filenames
+    """
+    samples, sample_rate = load_episode_audio(video_path)
+    timebase = TimeBase.from_video(video_path, sample_rate)
+    timebase.check_audio_length(len(samples))
+    slice_audio_from_video(ground_truth_textfile=ground_truth_textfile, samples=samples, timebase=timebase,
+                           audio_base_path=audio_base_path, file_id=file_id)
+
+
+def extract_episode_audio():
+    """
+    The aim of this method is to extract the full audio track of all videos, e.g. for computing MFCC features
+    straight from the episodes. The wav files are kept.
+    :return: list of the episode wav file paths in the order of the videos
+    """
+    Path(episode_audio_base_path).mkdir(parents=True, exist_ok=True)
 
     for path in video_paths:
-        extract_audio_from_video(video_path=path, audio_base_path=test_audio_base_path)
+        extract_audio_from_video(video_path=path, audio_base_path=episode_audio_base_path)
 
-    for i in range(0, len(audio_paths)):
-        slice_audio_from_video(ground_truth_textfile=ground_truth_textfiles[i], audio_path=audio_paths[i],
-                               audio_base_path=test_audio_base_path, video_fps=fps, file_id=i + 1)
-        os.remove(audio_paths[i])
+    return [episode_audio_path(path, episode_audio_base_path) for path in video_paths]
+
+
+def extract_audio_snippets(max_workers=1):
+    """
+    The aim of this method is to extract the audio snippets of all characters for all videos.
+    :param max_workers: number of videos processed in parallel, 1 processes all videos in this process
+    """
+    Path(audio_snippet_base_path).mkdir(parents=True, exist_ok=True)
+
+    if max_workers > 1:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(video_paths))) as executor:
+            futures = [executor.submit(call_profiled, extract_audio_snippets_for_video, video_paths[i],
+                                       ground_truth_textfiles[i], audio_snippet_base_path, i + 1)
+                       for i in range(0, len(video_paths))]
+            for future in futures:
+                merge_stage_stats(future.result()[1])
+    else:
+        for i in range(0, len(video_paths)):
+            extract_audio_snippets_for_video(video_paths[i], ground_truth_textfiles[i], audio_snippet_base_path, i + 1)
@@ -0,0 +1,672 @@
+import glob
+import json
+import math
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+import cv2
+import numpy as np
+from contextlib import contextmanager
+from pathlib import Path
+import audio_extractor
+import dataset_generator
+import profiling
+from audio_extractor import extract_audio_snippets
+from dataset_generator import character_map, create_image_dataset_for_character, create_mfcc_audio_dataset, \
+    negative_frame_candidates, parse_ground_truth_txt_files, random_sample_multi_mfcc, sample_frame_ids
+from feature_cache import directory_size
+from frame_extractor import iter_frames, read_frames_with_seeking
+from image_extractor import extract_ground_truth_images
+from inference import load_image_model, pig_model_path, positive_probabilities
+from inference_server import InferenceClient, close_server, create_server
+from mfcc_extractor import extract_mfccs_parallel
+from model_export import TFLiteModel, export_tflite, load_dataset_images, pig_dataset_path, quantization_modes, \
+    tflite_model_filename
+from moviepy.video.io.ffmpeg_tools import ffmpeg_merge_video_audio
+
+benchmark_base_path = '../../benchmark/'
+pipeline_baseline_file = benchmark_base_path + 'pipeline_baseline.json'
+model_export_results_file = benchmark_base_path + 'model_export.json'
+# dependencies the text subcommands of the command line interface must not import, see benchmark_cli_import_time
+cli_heavy_modules = ['cv2', 'librosa', 'moviepy', 'tensorflow', 'skimage', 'matplotlib']
+# the synthetic episodes use the names of the real ones, so the file ids of dataset_generator.file_map apply
+synthetic_episode_names = ['Muppets-02-01-01', 'Muppets-02-04-04', 'Muppets-03-04-03']
+
+
+def generate_test_video(video_path, no_of_frames, frame_size=(320, 240), fps=25):
+    """
+    The aim of this method is to generate a synthetic avi video for benchmarks. Every frame shows its own
+    frame number, so the correctness of extracted frames can be checked visually.
+    :param video_path: path of the generated video
+    :param no_of_frames: number of frames of the video
+    :param frame_size: (width, height) of the frames
+    :param fps: frames per second of the video
+    """
+    Path(video_path).parent.mkdir(parents=True, exist_ok=True)
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'XVID'), fps, frame_size)
+
+    rng = np.random.RandomState(333)
+    background = rng.randint(0, 256, (frame_size[1], frame_size[0], 3), dtype=np.uint8)
+    for frame_id in range(0, no_of_frames):
+        frame = np.roll(background, frame_id, axis=1)
+        cv2.putText(frame, str(frame_id), (10, frame_size[1] // 2), cv2.FONT_HERSHEY_SIMPLEX, 2,
+                    (255, 255, 255), 3)
+        writer.write(frame)
+
+    writer.release()
+
+
+def time_frame_reader(reader, video_path, frame_ids):
+    start = time.perf_counter()
+    no_of_frames = sum(1 for _ in reader(video_path, frame_ids))
+    return no_of_frames, time.perf_counter() - start
+
+
+def benchmark_frame_extraction(no_of_frames=3000, step=12, sample_ratio=0.5):
+    """
+    The aim of this method is to compare the sequential single-pass frame extraction against seeking to
+    every single frame on a generated test video.
+    :param no_of_frames: number of frames of the generated video
+    :param step: step size between labeled frames as used in the ground truth
+    :param sample_ratio: ratio of labeled frames that are requested
+    :return: dict holding the timings of both approaches
+    """
+    video_path = benchmark_base_path + 'frame_extraction.avi'
+    if not Path(video_path).is_file():
+        print('[INFO] Generate test video with %d frames' % no_of_frames)
+        generate_test_video(video_path, no_of_frames)
+
+    random.seed(333)
+    labeled_frame_ids = list(range(1, no_of_frames, step))
+    frame_ids = random.sample(labeled_frame_ids, int(len(labeled_frame_ids) * sample_ratio))
+
+    no_seek_frames, seek_time = time_frame_reader(read_frames_with_seeking, video_path, frame_ids)
+    no_seq_frames, seq_time = time_frame_reader(iter_frames, video_path, frame_ids)
+
+    results = {'requested_frames': len(frame_ids),
+               'seek_seconds': seek_time,
+               'seek_fps': no_seek_frames / seek_time,
+               'sequential_seconds': seq_time,
+               'sequential_fps': no_seq_frames / seq_time,
+               'speedup': seek_time / seq_time}
+
+    print('Frame extraction of %d frames:' % len(frame_ids))
+    print('seek: %.3f s (%.1f frames/s)' % (seek_time, results['seek_fps']))
+    print('sequential: %.3f s (%.1f frames/s)' % (seq_time, results['sequential_fps']))
+    print('speedup: %.2fx' % results['speedup'])
+    return results
+
+
+def generate_label_file(label_path, no_of_frames, step=12, class_probabilities=(0.3, 0.1, 0.15, 0.05, 0.5),
+                        seed=333):
+    """
+    The aim of this method is to generate a synthetic ground truth text file in the format of
+    ground_truth/*/*.txt. Every class is assigned independently, so frames can hold several labels.
+    :param label_path: path of the generated label file
+    :param no_of_frames: number of labeled frames
+    :param step: step size between labeled frames
+    :param class_probabilities: probability of every class in character_map to be present on a frame
+    :param seed: seed of the random label assignment
+    """
+    Path(label_path).parent.mkdir(parents=True, exist_ok=True)
+    rng = np.random.RandomState(seed)
+    labels = rng.random_sample((no_of_frames, len(class_probabilities))) < np.asarray(class_probabilities)
+    # frames without any character are labeled as none
+    labels[~labels[:, :-1].any(axis=1), -1] = True
+
+    with open(label_path, 'w') as f:
+        for i in range(0, no_of_frames):
+            class_ids = ', '.join([str(class_id) for class_id in np.flatnonzero(labels[i])])
+            f.write('%d, %s\n' % (i * step + 1, class_ids))
+
+
+def sample_negative_frame_ids_legacy(data_locations_dict, rest_data_distribution_map, character_id):
+    """
+    The aim of this method is to sample negatives the way it was done before the vectorized sampling existed, i.e.
+    by resampling every positive hit on python lists. It is only kept as reference for benchmarks.
+    """
+    data_locations_lists = {key: {i: list(v) for i, v in data_locations.items()}
+                            for key, data_locations in data_locations_dict.items()}
+    rest_frameid_map = {}
+    random.seed(333)
+    for key, values in rest_data_distribution_map.items():
+        temp = {}
+        for k, v in values.items():
+            temp[k] = random.sample(data_locations_lists[k][key], v)
+            for idx, value in enumerate(temp[k]):
+                if value in data_locations_lists[k][character_id]:
+                    tmp_fnr = random.sample(data_locations_lists[k][key], 1)[0]
+                    while tmp_fnr in data_locations_lists[k][character_id] or tmp_fnr in temp[k]:
+                        tmp_fnr = random.sample(data_locations_lists[k][key], 1)[0]
+                    temp[k][idx] = tmp_fnr
+        rest_frameid_map[key] = temp
+    return rest_frameid_map
+
+
+def rest_distribution(data_locations_dict, character_id):
+    half_length = sum(len(data_locations[character_id]) for data_locations in data_locations_dict.values())
+    total_samples = sum(len(data_locations[i]) for data_locations in data_locations_dict.values()
+                        for i in range(0, len(character_map)) if i != character_id)
+    return {i: {key: math.ceil(len(data_locations[i]) / total_samples * half_length)
+                for key, data_locations in data_locations_dict.items()}
+            for i in range(0, len(character_map)) if i != character_id}
+
+
+def time_negative_sampling(data_locations_dict, character_id):
+    rest_data_distribution_map = rest_distribution(data_locations_dict, character_id)
+    start = time.perf_counter()
+    negative_frame_ids = negative_frame_candidates(data_locations_dict, character_id)
+    for i, values in rest_data_distribution_map.items():
+        for key, no_of_samples in values.items():
+            sample_frame_ids(negative_frame_ids[i][key], no_of_samples, 333, i, key)
+    return time.perf_counter() - start
+
+
+def time_negative_sampling_legacy(data_locations_dict, character_id):
+    rest_data_distribution_map = rest_distribution(data_locations_dict, character_id)
+    start = time.perf_counter()
+    sample_negative_frame_ids_legacy(data_locations_dict, rest_data_distribution_map, character_id)
+    return time.perf_counter() - start
+
+
+def benchmark_negative_sampling(no_of_frames=10 ** 6, no_of_legacy_frames=2 * 10 ** 4, character_id=0):
+    """
+    The aim of this method is to time the negative sampling of create_image_dataset_for_character on synthetic
+    label files. The legacy sampling is quadratic, therefore it is timed on a smaller number of frames.
+    :param no_of_frames: total number of labeled frames over all synthetic label files
+    :param no_of_legacy_frames: total number of labeled frames the legacy sampling is timed on
+    :param character_id: the id of the target character
+    :return: dict holding the timings
+    """
+    results = {}
+    for name, frames in [('vectorized', no_of_frames), ('legacy', no_of_legacy_frames)]:
+        label_files = [benchmark_base_path + 'labels/%s_%d.txt' % (name, i) for i in range(1, 4)]
+        for i, label_file in enumerate(label_files):
+            if not Path(label_file).is_file():
+                generate_label_file(label_file, frames // len(label_files), seed=333 + i)
+
+        start = time.perf_counter()
+        data_locations_dict = parse_ground_truth_txt_files(label_files)
+        parse_time = time.perf_counter() - start
+
+        if name == 'vectorized':
+            sampling_time = time_negative_sampling(data_locations_dict, character_id)
+        else:
+            sampling_time = time_negative_sampling_legacy(data_locations_dict, character_id)
+
+        results[name] = {'frames': frames, 'parse_seconds': parse_time, 'sampling_seconds': sampling_time}
+        print('%s sampling of %d frames: %.3f s (parsing %.3f s)' % (name, frames, sampling_time, parse_time))
+
+    return results
+
+
+def generate_test_wav(wav_path, duration_s, sample_rate=44100, seed=333):
+    """
+    The aim of this method is to generate a synthetic mono wav file holding a mix of tones and noise.
+    :param wav_path: path of the generated wav file
+    :param duration_s: duration in seconds
+    :param sample_rate: sample rate of the wav file
+    :param seed: seed of the noise
+    """
+    Path(wav_path).parent.mkdir(parents=True, exist_ok=True)
+    rng = np.random.RandomState(seed)
+    t = np.arange(int(duration_s * sample_rate)) / sample_rate
+    signal = 0.3 * np.sin(2 * np.pi * rng.uniform(100, 1000) * t) + 0.05 * rng.standard_normal(len(t))
+
+    with wave.open(wav_path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes((np.clip(signal, -1, 1) * 32767).astype(np.int16).tobytes())
+
+
+def benchmark_mfcc_extraction(no_of_snippets=200, max_workers_list=(1, None), sample_rates=(22050, None),
+                              frame_length_ms=20, n_mfcc=20):
+    """
+    The aim of this method is to measure the throughput of the MFCC extraction on synthetic audio snippets for
+    several numbers of worker processes and sample rates.
+    :param no_of_snippets: number of generated audio snippets
+    :param max_workers_list: numbers of worker processes to benchmark, None uses all cpus
+    :param sample_rates: sample rates to benchmark, None keeps the native sample rate
+    :param frame_length_ms: window size of the MFCC frames in milliseconds
+    :param n_mfcc: number of MFCC features
+    :return: list of dicts holding the throughput per configuration
+    """
+    rng = np.random.RandomState(333)
+    audio_files = []
+    for i in range(0, no_of_snippets):
+        audio_file = benchmark_base_path + 'audio/%d_%d_%d.wav' % (i % 3 + 1, i % 5, i)
+        if not Path(audio_file).is_file():
+            generate_test_wav(audio_file, rng.uniform(0.5, 5.0), seed=i)
+        audio_files.append(audio_file)
+
+    results = []
+    for sample_rate in sample_rates:
+        for max_workers in max_workers_list:
+            start = time.perf_counter()
+            mfccs = extract_mfccs_parallel(audio_files, frame_length_ms, n_mfcc, sample_rate, max_workers)
+            seconds = time.perf_counter() - start
+            audio_seconds = sum(result[2] for result in mfccs)
+
+            results.append({'sample_rate': sample_rate,
+                            'max_workers': max_workers,
+                            'seconds': seconds,
+                            'snippets_per_second': len(audio_files) / seconds,
+                            'audio_seconds_per_second': audio_seconds / seconds})
+            print('MFCC extraction (sample rate %s, workers %s): %.1f snippets/s, %.1f audio-s/s' %
+                  (sample_rate or 'native', max_workers or 'all', len(audio_files) / seconds,
+                   audio_seconds / seconds))
+
+    return results
+
+
+def generate_synthetic_episodes(episode_path, no_of_frames, step=12, class_probabilities=(0.3, 0.1, 0.15, 0.05, 0.5),
+                                frame_size=(160, 120), fps=25, sample_rate=22050):
+    """
+    The aim of this method is to generate synthetic episodes in the directory layout of the repository, i.e.
+    videos/<name>.avi with embedded frame numbers and an audio track of the same duration and
+    ground_truth/<name>/<name>.txt labeling every step-th frame. Existing episodes are kept.
+    :param episode_path: base directory of the synthetic episodes
+    :param no_of_frames: number of frames per episode
+    :param step: step size between labeled frames
+    :param class_probabilities: probability of every class in character_map to be present on a labeled frame
+    :param frame_size: (width, height) of the frames
+    :param fps: frames per second of the videos
+    :param sample_rate: sample rate of the audio tracks
+    :return: tuple of the video paths and the ground truth text files
+    """
+    video_paths = []
+    ground_truth_files = []
+    for i, name in enumerate(synthetic_episode_names):
+        video_path = episode_path + 'videos/%s.avi' % name
+        ground_truth_file = episode_path + 'ground_truth/%s/%s.txt' % (name, name)
+        if not Path(video_path).is_file():
+            print('[INFO] Generate synthetic episode %s with %d frames' % (name, no_of_frames))
+            silent_video_path = episode_path + 'tmp/%s.avi' % name
+            audio_track_path = episode_path + 'tmp/%s.wav' % name
+            generate_test_video(silent_video_path, no_of_frames, frame_size, fps)
+            generate_test_wav(audio_track_path, no_of_frames / fps, sample_rate, seed=333 + i)
+            Path(video_path).parent.mkdir(parents=True, exist_ok=True)
+            # the video stream is copied, so the frames and the frame count stay exactly as generated
+            ffmpeg_merge_video_audio(silent_video_path, audio_track_path, video_path, vcodec='copy', acodec='copy',
+                                     logger=None)
+            shutil.rmtree(episode_path + 'tmp/')
+        if not Path(ground_truth_file).is_file():
+            generate_label_file(ground_truth_file, no_of_frames // step, step, class_probabilities, seed=333 + i)
+
+        video_paths.append(video_path)
+        ground_truth_files.append(ground_truth_file)
+
+    return video_paths, ground_truth_files
+
+
+@contextmanager
+def synthetic_episodes(episode_path, video_paths, ground_truth_files):
+    """
+    The aim of this method is to point the path configuration of the extraction modules to synthetic episodes and
+    restore it afterwards, so the pipeline functions run unchanged on the generated data.
+    :param episode_path: base directory of the synthetic episodes
+    :param video_paths: the video paths as returned by generate_synthetic_episodes
+    :param ground_truth_files: the ground truth text files as returned by generate_synthetic_episodes
+    """
+    paths = [(audio_extractor, 'video_paths', video_paths),
+             (audio_extractor, 'ground_truth_textfiles', ground_truth_files),
+             (audio_extractor, 'audio_snippet_base_path', episode_path + 'audio/'),
+             (audio_extractor, 'episode_audio_base_path', episode_path + 'audio/episodes/'),
+             (dataset_generator, 'video_base_path', episode_path + 'videos/'),
+             (dataset_generator, 'ground_truth_files_base_path', episode_path + 'ground_truth/'),
+             (dataset_generator, 'ground_truth_txt_files', ground_truth_files),
+             (dataset_generator, 'audio_snippet_path', episode_path + 'audio/'),
+             (dataset_generator, 'feature_cache_path', episode_path + 'cache/')]
+    original_paths = [(module, name, getattr(module, name)) for module, name, _ in paths]
+    for module, name, value in paths:
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for module, name, value in original_paths:
+            setattr(module, name, value)
+
+
+def time_stage(results, name, function, *args):
+    """
+    The aim of this method is to time a single pipeline function and keep the stages it measured.
+    :param results: dict the timing is added to under the given name
+    :param name: name of the timed function
+    :param function: the function called as function(*args)
+    :return: the result of the function
+    """
+    profiling.reset()
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+    results[name] = {'seconds': seconds, 'stages': profiling.report()['stages']}
+    print('%s: %.3f s' % (name, seconds))
+    return result
+
+
+def benchmark_pipeline_scale(no_of_frames, max_workers=1, frame_length_ms=20, n_mfcc=20, mfcc_sequence_len=50):
+    """
+    The aim of this method is to time the extraction pipeline from the audio snippets to the image datasets on
+    synthetic episodes of the given length. All outputs are written again on every run.
+    :param no_of_frames: number of frames per synthetic episode
+    :param max_workers: number of worker processes of the parallel stages
+    :param frame_length_ms: window size of the MFCC frames in milliseconds
+    :param n_mfcc: number of MFCC features
+    :param mfcc_sequence_len: number of MFCC frames per sequence
+    :return: dict holding the seconds and the measured stages per pipeline function
+    """
+    episode_path = benchmark_base_path + 'episodes_%d/' % no_of_frames
+    video_paths, ground_truth_files = generate_synthetic_episodes(episode_path, no_of_frames)
+    for output_path in ['audio/', 'mfcc/', 'ground_truth/pig/', 'images/']:
+        shutil.rmtree(episode_path + output_path, ignore_errors=True)
+
+    print('Pipeline benchmark with %d episodes of %d frames:' % (len(video_paths), no_of_frames))
+    results = {}
+    with synthetic_episodes(episode_path, video_paths, ground_truth_files):
+        time_stage(results, 'extract_audio_snippets', extract_audio_snippets, max_workers)
+        time_stage(results, 'create_mfcc_audio_dataset', create_mfcc_audio_dataset, episode_path + 'audio/',
+                   frame_length_ms, n_mfcc, episode_path + 'mfcc/', dataset_generator.mfcc_sample_rate, max_workers)
+        time_stage(results, 'random_sample_multi_mfcc', random_sample_multi_mfcc, 3, episode_path + 'mfcc/',
+                   mfcc_sequence_len)
+        data_locations_dict = time_stage(results, 'parse_ground_truth_txt_files', parse_ground_truth_txt_files,
+                                         ground_truth_files)
+        time_stage(results, 'create_image_dataset_for_character', create_image_dataset_for_character, 2,
+                   data_locations_dict, 'pig/', max_workers)
+        time_stage(results, 'extract_ground_truth_images',
+                   lambda: [extract_ground_truth_images(ground_truth_files[i], video_paths[i],
+                                                        episode_path + 'images/%d' % (i + 1))
+                            for i in range(0, len(video_paths))])
+
+    results['no_of_images'] = len(glob.glob(episode_path + 'ground_truth/pig/*.jpg'))
+    return results
+
+
+def find_regressions(results, baseline, tolerance=0.2, min_seconds=0.05):
+    """
+    The aim of this method is to compare pipeline timings against a baseline. A function regressed if it got more
+    than tolerance slower and lost more than min_seconds, so very short timings do not fail because of noise.
+    :param results: dict mapping the scales to the timings as returned by benchmark_pipeline_scale
+    :param baseline: dict of the same layout holding the baseline timings
+    :param tolerance: allowed relative slowdown
+    :param min_seconds: allowed absolute slowdown in seconds
+    :return: list of dicts describing the regressions
+    """
+    regressions = []
+    for scale, timings in results.items():
+        for name, timing in timings.items():
+            try:
+                baseline_seconds = baseline[scale][name]['seconds']
+            except (KeyError, TypeError):
+                continue
+            if timing['seconds'] > baseline_seconds * (1 + tolerance) and \
+                    timing['seconds'] - baseline_seconds > min_seconds:
+                regressions.append({'scale': scale, 'name': name, 'seconds': timing['seconds'],
+                                    'baseline_seconds': baseline_seconds})
+
+    return regressions
+
+
+def check_pipeline_baseline(baseline_file=pipeline_baseline_file, update_baseline=False):
+    if not update_baseline and not Path(baseline_file).is_file():
+        raise IOError('Pipeline baseline %r does not exist, create it with update_baseline=True '
+                      '(python benchmark.py --update-baseline).' % baseline_file)
+
+
+def benchmark_pipeline(scales=(1000, 5000, 25000), max_workers=1, baseline_file=pipeline_baseline_file,
+                       update_baseline=False, tolerance=0.2, min_seconds=0.05):
+    """
+    The aim of this method is to time the extraction pipeline at several scales and compare the timings against a
+    json baseline. A missing baseline is an error, it is only written with update_baseline, so a run never compares
+    against itself.
+    :param scales: numbers of frames per synthetic episode
+    :param max_workers: number of worker processes of the parallel stages
+    :param baseline_file: path of the json baseline
+    :param update_baseline: if True the timings replace the baseline, e.g. on the first run on a machine
+    :param tolerance: allowed relative slowdown, see find_regressions
+    :param min_seconds: allowed absolute slowdown in seconds, see find_regressions
+    :return: dict holding the timings per scale and the regressions against the baseline
+    """
+    check_pipeline_baseline(baseline_file, update_baseline)
+
+    results = {str(no_of_frames): benchmark_pipeline_scale(no_of_frames, max_workers) for no_of_frames in scales}
+    timings = {scale: {name: timing for name, timing in values.items() if isinstance(timing, dict)}
+               for scale, values in results.items()}
+
+    regressions = []
+    if not update_baseline:
+        with open(baseline_file, 'r') as f:
+            baseline = json.load(f)
+        regressions = find_regressions(timings, baseline['results'], tolerance, min_seconds)
+        for scale, values in timings.items():
+            for name, timing in values.items():
+                if name in baseline['results'].get(scale, {}):
+                    print('%s (%s frames): %.3f s, baseline %.3f s' %
+                          (name, scale, timing['seconds'], baseline['results'][scale][name]['seconds']))
+        for regression in regressions:
+            print('[INFO] Regression of %s at %s frames: %.3f s instead of %.3f s' %
+                  (regression['name'], regression['scale'], regression['seconds'], regression['baseline_seconds']))
+    else:
+        Path(baseline_file).parent.mkdir(parents=True, exist_ok=True)
+        with open(baseline_file, 'w') as f:
+            json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'max_workers': max_workers,
+                       'results': results}, f, indent=2)
+        print('[INFO] Wrote pipeline baseline %s' % baseline_file)
+
+    return {'results': results, 'regressions': regressions}
+
+
+def run_cli_command(argv):
+    """
+    The aim of this method is to run a command of the command line interface in a fresh interpreter and measure it
+    from the import of the cli module on.
+    :param argv: list of command line arguments
+    :return: dict holding the seconds of the command and the heavy modules it imported
+    """
+    code = ('import json, sys, time\n'
+            'start = time.perf_counter()\n'
+            'import cli\n'
+            'try:\n'
+            '    cli.main(%r)\n'
+            'except SystemExit:\n'
+            '    pass\n'
+            'print(json.dumps({"seconds": time.perf_counter() - start,\n'
+            '                  "heavy_modules": sorted(set(m.split(".")[0] for m in sys.modules) & set(%r))}))'
+            % (list(argv), cli_heavy_modules))
+    output = subprocess.run([sys.executable, '-c', code], cwd=str(Path(__file__).resolve().parent), check=True,
+                            stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def benchmark_cli_import_time(max_seconds=1.0, labels_csv='../../labels.csv'):
+    """
+    The aim of this method is to guard the startup time of the command line interface. The help of every subcommand
+    and the text subcommands (stats, convert-labels) run in a fresh interpreter each. A command regressed if it
+    imported one of cli_heavy_modules or took longer than max_seconds.
+    :param max_seconds: allowed seconds per command, including the import of the cli module
+    :param labels_csv: labels.csv converted by the convert-labels command
+    :return: dict holding the measurements per command and the list of regressions
+    """
+    output_path = tempfile.mkdtemp()
+    commands = [['--help']]
+    commands += [[command, '--help'] for command in ['extract-audio', 'build-images', 'build-mfcc', 'stats',
+                                                    'convert-labels', 'infer', 'pipeline', 'export-model',
+                                                    'serve']]
+    commands += [['stats'], ['convert-labels', labels_csv, output_path + '/labels.txt'],
+                 ['convert-labels', labels_csv, output_path + '/labels.npz']]
+
+    results = {}
+    regressions = []
+    try:
+        for argv in commands:
+            name = ' '.join(argv)
+            results[name] = run_cli_command(argv)
+            print('cli %s: %.3f s, heavy modules: %s' % (name, results[name]['seconds'],
+                                                          results[name]['heavy_modules'] or 'none'))
+            if results[name]['heavy_modules'] or results[name]['seconds'] > max_seconds:
+                regressions.append(dict(results[name], name=name))
+                print('[INFO] Regression of cli %s' % name)
+    finally:
+        shutil.rmtree(output_path, ignore_errors=True)
+
+    return {'results': results, 'regressions': regressions}
+
+
+def time_model(model, images, batch_size=32, no_of_latency_runs=50):
+    """
+    The aim of this method is to measure the latency of single images and the throughput of batches of a model.
+    :param model: model with the interface of a keras model, see inference.load_image_model
+    :param images: float32 model input images
+    :param batch_size: number of images per model call of the throughput measurement
+    :param no_of_latency_runs: number of single images the latency is measured on
+    :return: tuple of the dict holding the median and 95th percentile latency in ms and the images per second, and
+    the positive probability per image
+    """
+    # the first calls allocate the tensors of the batch sizes
+    model.predict_on_batch(images[:1])
+    model.predict_on_batch(images[:batch_size])
+
+    latencies = []
+    for image in images[:no_of_latency_runs]:
+        start = time.perf_counter()
+        model.predict_on_batch(image[np.newaxis])
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    probabilities = np.concatenate([positive_probabilities(model.predict_on_batch(images[i:i + batch_size]))
+                                    for i in range(0, len(images), batch_size)])
+    seconds = time.perf_counter() - start
+    return {'latency_ms': float(np.median(latencies)) * 1000,
+            'latency_p95_ms': float(np.percentile(latencies, 95)) * 1000,
+            'images_per_second': len(images) / seconds}, probabilities
+
+
+def benchmark_model_export(saved_model_path=pig_model_path, dataset_path=pig_dataset_path,
+                           quantizations=quantization_modes, no_of_images=500, batch_size=32, no_of_latency_runs=50,
+                           n_threads=4, threshold=0.5, seed=334, results_file=model_export_results_file):
+    """
+    The aim of this method is to compare the SavedModel with its quantized TFLite exports in size, latency,
+    throughput and accuracy on images of the dataset. Missing exports are created first.
+    :param saved_model_path: path of the SavedModel
+    :param dataset_path: directory of the image dataset
+    :param quantizations: compared quantization modes, see model_export.export_tflite
+    :param no_of_images: number of evaluated images
+    :param batch_size: number of images per model call of the throughput measurement
+    :param no_of_latency_runs: number of single images the latency is measured on
+    :param n_threads: cpu thread budget of every model
+    :param threshold: minimum probability of a positive prediction
+    :param seed: seed of the random sampling of the images, it differs from the seed of the calibration images
+    :param results_file: path of the json file the results are written to
+    :return: dict holding the results per model
+    """
+    saved_model = load_image_model(saved_model_path, n_threads)
+    images, targets = load_dataset_images(dataset_path, saved_model.input_shape[1:3], max_images=no_of_images,
+                                          seed=seed)
+    if len(images) == 0:
+        raise IOError('No images found in %r.' % dataset_path)
+
+    models = {'saved_model': (saved_model_path, saved_model)}
+    for quantization in quantizations:
+        model_file = tflite_model_filename(saved_model_path, quantization)
+        if not Path(model_file).is_file():
+            export_tflite(saved_model_path, quantization, model_file, dataset_path)
+        models[quantization] = (model_file, TFLiteModel(model_file, n_threads))
+
+    results = {}
+    reference_predictions = None
+    for name, (model_path, model) in models.items():
+        results[name], probabilities = time_model(model, images, batch_size, no_of_latency_runs)
+        predictions = probabilities >= threshold
+        if reference_predictions is None:
+            reference_predictions = predictions
+        size = directory_size(model_path) if Path(model_path).is_dir() else Path(model_path).stat().st_size
+        results[name].update({'size_mb': size / 2 ** 20, 'accuracy': float(np.mean(predictions == targets)),
+                              'agreement': float(np.mean(predictions == reference_predictions))})
+        print('%s: %.1f MB, latency %.1f ms (p95 %.1f ms), %.1f images/s, accuracy %.3f, agreement with the '
+              'SavedModel %.3f' % (name, results[name]['size_mb'], results[name]['latency_ms'],
+                                   results[name]['latency_p95_ms'], results[name]['images_per_second'],
+                                   results[name]['accuracy'], results[name]['agreement']))
+
+    Path(results_file).parent.mkdir(parents=True, exist_ok=True)
+    with open(results_file, 'w') as f:
+        json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'no_of_images': len(images),
+                   'n_threads': n_threads, 'results': results}, f, indent=2)
+    return results
+
+
+def benchmark_inference_server(model_path=pig_model_path, clients_list=(1, 4, 16), requests_per_client=50,
+                               max_batch_size=32, max_wait_ms=5, n_threads=4):
+    """
+    The aim of this method is to measure the throughput and latency of concurrent single-frame requests to the
+    inference server with micro batching compared to one model call per request (max batch size 1). The clients are
+    threads of this process and connect over a unix socket.
+    :param model_path: path of the SavedModel or of a TFLite model
+    :param clients_list: numbers of concurrent clients
+    :param requests_per_client: number of single-frame requests of every client
+    :param max_batch_size: maximum number of images per model call with micro batching
+    :param max_wait_ms: maximum time a request waits for further requests of its batch
+    :param n_threads: cpu thread budget of the model
+    :return: dict holding the results per max batch size and number of clients
+    """
+    model = load_image_model(model_path, n_threads)
+    images = np.random.RandomState(333).randint(0, 256, (16,) + tuple(model.input_shape[1:])) / 255.0
+    socket_path = tempfile.mkdtemp()
+
+    results = {}
+    try:
+        for batch_size in [1, max_batch_size]:
+            for no_of_clients in clients_list:
+                server = create_server(model, 'unix:%s/server.sock' % socket_path, batch_size, max_wait_ms)
+                server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+                server_thread.start()
+                latencies = [[] for _ in range(no_of_clients)]
+
+                def run_client(client_latencies):
+                    client = InferenceClient('unix:%s/server.sock' % socket_path)
+                    for i in range(requests_per_client):
+                        start = time.perf_counter()
+                        client.predict_on_batch(images[i % len(images)][np.newaxis])
+                        client_latencies.append(time.perf_counter() - start)
+                    client.close()
+
+                clients = [threading.Thread(target=run_client, args=(client_latencies,))
+                           for client_latencies in latencies]
+                start = time.perf_counter()
+                for client in clients:
+                    client.start()
+                for client in clients:
+                    client.join()
+                seconds = time.perf_counter() - start
+
+                info = server.batcher.info()
+                server.shutdown()
+                close_server(server)
+                latencies = [latency for client_latencies in latencies for latency in client_latencies]
+                result = {'requests_per_second': len(latencies) / seconds,
+                          'latency_ms': float(np.median(latencies)) * 1000,
+                          'mean_batch_size': info['mean_batch_size']}
+                results['%d_%d' % (batch_size, no_of_clients)] = result
+                print('server with max batch size %d, %d clients: %.1f requests/s, latency %.1f ms, %.1f images '
+                      'per batch' % (batch_size, no_of_clients, result['requests_per_second'], result['latency_ms'],
+                                     result['mean_batch_size']))
+    finally:
+        shutil.rmtree(socket_path, ignore_errors=True)
+
+    return results
+
+
+if __name__ == '__main__':
+    update_pipeline_baseline = '--update-baseline' in sys.argv
+    # fail before the other benchmarks ran instead of after them
+    check_pipeline_baseline(update_baseline=update_pipeline_baseline)
+    benchmark_frame_extraction()
+    benchmark_negative_sampling()
+    benchmark_mfcc_extraction()
+    cli_regressions = benchmark_cli_import_time()['regressions']
+    if benchmark_pipeline(update_baseline=update_pipeline_baseline)['regressions'] or cli_regressions:
+        exit(1)
@@ -0,0 +1,292 @@
+import argparse
+import os
+import sys
+
+# heavy dependencies (cv2, librosa, moviepy, tensorflow) are only imported by the subcommands that need them, so
+# importing this module and running the text subcommands stays fast
+default_ground_truth_files = ['../../ground_truth/Muppets-02-01-01/Muppets-02-01-01.txt',
+                              '../../ground_truth/Muppets-02-04-04/Muppets-02-04-04.txt',
+                              '../../ground_truth/Muppets-03-04-03/Muppets-03-04-03.txt']
+dataset_characters = {'kermit': 0, 'pig': 2, 'swedish_chef': 3}
+
+
+def directory(path):
+    """
+    :return: the directory path with a trailing separator, the modules concatenate file names to it, or None
+    """
+    return path and os.path.join(path, '')
+
+
+def configure_paths(args):
+    """
+    The aim of this method is to point the path configuration of the pipeline modules to the paths given on the
+    command line. Only imported modules are configured, paths that are not given keep their defaults. Every cache
+    gets its own subdirectory of the cache path, so the caches are evicted independently.
+    :param args: the parsed arguments
+    """
+    ground_truth_files = args.ground_truth_files
+    video_path, audio_path = directory(args.video_path), directory(args.audio_path)
+    ground_truth_path, cache_path = directory(args.ground_truth_path), directory(args.cache_path)
+    video_paths, file_map = None, None
+    if ground_truth_files:
+        # the file ids follow the order of the files, like the audio snippet filenames
+        file_map = {os.path.basename(filename): i + 1 for i, filename in enumerate(ground_truth_files)}
+    if video_path:
+        video_paths = [video_path + os.path.basename(filename).split('.')[0] + '.avi'
+                       for filename in ground_truth_files or default_ground_truth_files]
+
+    def cache_directory(name):
+        return cache_path and os.path.join(cache_path, name, '')
+
+    paths = [('audio_extractor', 'video_paths', video_paths),
+             ('audio_extractor', 'ground_truth_textfiles', ground_truth_files),
+             ('audio_extractor', 'audio_snippet_base_path', audio_path),
+             ('audio_extractor', 'episode_audio_base_path', audio_path and os.path.join(audio_path, 'episodes', '')),
+             ('dataset_generator', 'video_base_path', video_path),
+             ('dataset_generator', 'ground_truth_files_base_path', ground_truth_path),
+             ('dataset_generator', 'ground_truth_txt_files', ground_truth_files),
+             ('dataset_generator', 'file_map', file_map),
+             ('dataset_generator', 'audio_snippet_path', audio_path),
+             ('dataset_generator', 'feature_cache_path', cache_directory('features')),
+             ('audio_buffer', 'audio_cache_path', cache_directory('audio')),
+             ('frame_index', 'frame_index_cache_path', cache_directory('frame_index')),
+             ('shot_index', 'shot_index_cache_path', cache_directory('shot_index')),
+             ('label_store', 'label_cache_path', cache_directory('labels'))]
+    for module_name, name, value in paths:
+        if value is not None and module_name in sys.modules:
+            setattr(sys.modules[module_name], name, value)
+
+
+def shot_params(args):
+    """
+    :return: dict of the shot index parameters given on the command line
+    """
+    params = {'duplicate_threshold': args.duplicate_threshold, 'frame_stride': args.shot_frame_stride}
+    return dict((name, value) for name, value in params.items() if value is not None)
+
+
+def add_shot_arguments(command):
+    command.add_argument('--skip-duplicates', action='store_true',
+                         help='only process one representative frame per segment of near duplicate frames')
+    command.add_argument('--duplicate-threshold', type=int,
+                         help='maximum number of differing hash bits (of 64) of near duplicate frames')
+    command.add_argument('--shot-frame-stride', type=int, help='step size between the frames of the shot index')
+
+
+def extract_audio(args):
+    import audio_extractor
+    configure_paths(args)
+
+    if args.episodes:
+        audio_extractor.extract_episode_audio()
+    else:
+        audio_extractor.extract_audio_snippets(max_workers=args.max_workers)
+
+
+def build_images(args):
+    import dataset_generator
+    configure_paths(args)
+
+    character_ids = [dataset_characters[name] for name in args.characters]
+    if args.incremental:
+        for character_id in character_ids:
+            dataset_generator.build_image_dataset_incremental(
+                character_id, dataset_generator.character_dataset_paths[character_id], max_workers=args.max_workers,
+                n_writer_threads=args.writer_threads, seed=args.seed)
+    else:
+        dataset_generator.build_character_image_datasets(character_ids, max_workers=args.max_workers, seed=args.seed,
+                                                         store_path=args.store_path or
+                                                         dataset_generator.frame_store_path,
+                                                         link_images=not args.no_links,
+                                                         skip_duplicates=args.skip_duplicates,
+                                                         shot_params=shot_params(args))
+
+
+def build_mfcc(args):
+    import dataset_generator
+    configure_paths(args)
+
+    store_path = dataset_generator.get_mfcc_feature_store(args.frame_length_ms, args.n_mfcc, args.sample_rate,
+                                                          args.max_workers, args.streaming)
+    print('[INFO] MFCC store: %s' % store_path)
+
+
+def stats(args):
+    from screentime import ground_truth_locations_from_indices, load_screentime_indices, \
+        print_ground_truth_statistics
+    configure_paths(args)
+
+    screentime_indices = load_screentime_indices(args.ground_truth_files or default_ground_truth_files)
+    print_ground_truth_statistics(ground_truth_locations_from_indices(screentime_indices), screentime_indices)
+
+
+def convert_labels(args):
+    import label_store
+
+    if args.input.endswith('.csv'):
+        frame_ids, labels = label_store.parse_labels_csv(args.input, args.step)
+        file_ids = None
+    elif os.path.basename(args.input) == 'labels.txt':
+        frame_ids, labels, file_ids = label_store.parse_dataset_labels_txt(args.input)
+    else:
+        frame_ids, labels = label_store.parse_ground_truth_textfile(args.input)
+        file_ids = None
+
+    if args.output.endswith('.npz'):
+        label_store.save_labels(args.output, frame_ids, labels, file_ids)
+    elif file_ids is not None:
+        raise ValueError('Labels of several files can only be converted to the binary .npz format')
+    else:
+        label_store.write_ground_truth_textfile(args.output, frame_ids, labels)
+    print('[INFO] Converted %d labeled frames to %s' % (len(frame_ids), args.output))
+
+
+def infer(args):
+    import inference
+    configure_paths(args)
+
+    inference.label_episode(args.video, args.output, audio_file=args.audio_file, batch_size=args.batch_size,
+                            frame_stride=args.frame_stride, n_threads=args.threads, threshold=args.threshold,
+                            pig_model=args.pig_model or inference.pig_model_path,
+                            swedish_chef_model=args.swedish_chef_model or inference.swedish_chef_model_path,
+                            audio_from_video=args.audio_from_video, skip_duplicates=args.skip_duplicates,
+                            shot_params=shot_params(args))
+
+
+def export_model(args):
+    from model_export import export_tflite, pig_dataset_path
+
+    for quantization in args.quantization:
+        export_tflite(args.saved_model, quantization, calibration_path=args.calibration_path or pig_dataset_path,
+                      no_of_calibration_images=args.calibration_images)
+    if args.benchmark:
+        from benchmark import benchmark_model_export
+        benchmark_model_export(args.saved_model, args.calibration_path or pig_dataset_path, args.quantization,
+                               n_threads=args.threads)
+
+
+def serve(args):
+    from inference_server import serve as serve_model
+
+    serve_model(args.model, args.address, args.max_batch_size, args.max_wait_ms, args.threads)
+
+
+def run_pipeline(args):
+    import audio_extractor
+    import dataset_generator
+    configure_paths(args)
+    from pipeline import default_pipeline, pipeline_state_path
+
+    pipeline = default_pipeline(args.max_workers, args.frame_length_ms, args.n_mfcc,
+                                args.state_path or pipeline_state_path)
+    results = pipeline.run(force=args.force)
+    print('[INFO] MFCC store: %s' % results['mfcc_store'])
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(description='Muppet show classification pipeline. Relative paths default to '
+                                                 'the layout of the repository seen from SIM1/src.')
+    parser.add_argument('--video-path', help='directory of the episode videos')
+    parser.add_argument('--ground-truth-path', help='directory the image datasets are written to')
+    parser.add_argument('--ground-truth-files', nargs='+', help='ground truth text files of the episodes')
+    parser.add_argument('--audio-path', help='directory of the audio snippets')
+    parser.add_argument('--cache-path', help='directory of the caches (features, episode audio, labels and '
+                                                   'shot and frame indices)')
+    parser.add_argument('--profile', action='store_true', help='write a profiling report of the run')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    command = subparsers.add_parser('extract-audio', help='extract the audio snippets of all characters')
+    command.add_argument('--max-workers', type=int, default=1)
+    command.add_argument('--episodes', action='store_true', help='extract the full audio track of every episode')
+    command.set_defaults(function=extract_audio)
+
+    command = subparsers.add_parser('build-images', help='build the image datasets of the characters')
+    command.add_argument('--characters', nargs='+', choices=sorted(dataset_characters),
+                         default=sorted(dataset_characters))
+    command.add_argument('--max-workers', type=int, default=1)
+    command.add_argument('--writer-threads', type=int, default=0, help='image writer threads of incremental builds')
+    command.add_argument('--seed', type=int, default=333)
+    command.add_argument('--store-path', help='directory of the frame store')
+    command.add_argument('--no-links', action='store_true', help='only write the labels and frame manifests')
+    command.add_argument('--incremental', action='store_true',
+                         help='update every dataset on its own instead of using the frame store')
+    add_shot_arguments(command)
+    command.set_defaults(function=build_images)
+
+    command = subparsers.add_parser('build-mfcc', help='build the MFCC feature store')
+    command.add_argument('--frame-length-ms', type=int, default=20)
+    command.add_argument('--n-mfcc', type=int, default=20)
+    command.add_argument('--sample-rate', type=int, default=22050)
+    command.add_argument('--max-workers', type=int)
+    command.add_argument('--streaming', action='store_true', help='compute the MFCCs from the episode audio')
+    command.set_defaults(function=build_mfcc)
+
+    command = subparsers.add_parser('stats', help='print statistics of the ground truth')
+    command.set_defaults(function=stats)
+
+    command = subparsers.add_parser('convert-labels', help='convert labels.csv, ground truth text files and '
+                                                           'labels.txt files to text or binary (.npz) labels')
+    command.add_argument('input')
+    command.add_argument('output')
+    command.add_argument('--step', type=int, default=12, help='step size between the frames of a labels.csv')
+    command.set_defaults(function=convert_labels)
+
+    command = subparsers.add_parser('infer', help='label an episode with the trained models')
+    command.add_argument('video')
+    command.add_argument('output')
+    command.add_argument('--audio-file')
+    command.add_argument('--audio-from-video', action='store_true')
+    command.add_argument('--batch-size', type=int, default=32)
+    command.add_argument('--frame-stride', type=int, default=12)
+    command.add_argument('--threads', type=int, default=4)
+    command.add_argument('--threshold', type=float, default=0.5)
+    command.add_argument('--pig-model', help='SavedModel, TFLite model (.tflite) or inference server address')
+    command.add_argument('--swedish-chef-model')
+    add_shot_arguments(command)
+    command.set_defaults(function=infer)
+
+    command = subparsers.add_parser('export-model', help='export the pig model as quantized TFLite model')
+    command.add_argument('--saved-model', default='pig-model-1/')
+    command.add_argument('--quantization', nargs='+', choices=['dynamic', 'int8'], default=['dynamic', 'int8'])
+    command.add_argument('--calibration-path', help='image dataset the int8 calibration images are drawn from')
+    command.add_argument('--calibration-images', type=int, default=200)
+    command.add_argument('--threads', type=int, default=4, help='cpu thread budget of the benchmarked models')
+    command.add_argument('--benchmark', action='store_true',
+                         help='compare latency, throughput and accuracy of the exports with the SavedModel')
+    command.set_defaults(function=export_model)
+
+    command = subparsers.add_parser('serve', help='serve the pig model to several processes with micro batching')
+    command.add_argument('--model', default='pig-model-1/', help='SavedModel or TFLite model (.tflite)')
+    command.add_argument('--address', default='http://127.0.0.1:8470',
+                         help='http://<host>:<port> or unix:<socket path>, clients use it as --pig-model of infer')
+    command.add_argument('--max-batch-size', type=int, default=32)
+    command.add_argument('--max-wait-ms', type=float, default=5,
+                         help='maximum time a request waits for further requests of its batch')
+    command.add_argument('--threads', type=int, default=4)
+    command.set_defaults(function=serve)
+
+    command = subparsers.add_parser('pipeline', help='run all extraction stages that are not up to date')
+    command.add_argument('--max-workers', type=int, default=1, help='worker budget shared by concurrent stages')
+    command.add_argument('--frame-length-ms', type=int, default=20)
+    command.add_argument('--n-mfcc', type=int, default=20)
+    command.add_argument('--state-path', help='directory of the pipeline state')
+    command.add_argument('--force', nargs='+', default=[], choices=['audio_snippets', 'mfcc_store', 'image_datasets'],
+                         help='stages that run even if they are up to date')
+    command.set_defaults(function=run_pipeline)
+
+    return parser
+
+
+def main(argv=None):
+    args = argument_parser().parse_args(argv)
+    if not args.profile:
+        args.function(args)
+        return
+
+    from profiling import profile_run
+    with profile_run(args.command.replace('-', '_')):
+        args.function(args)
+
+
+if __name__ == '__main__':
+    main()
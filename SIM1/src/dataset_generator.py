@@ -1,11 +1,25 @@
 import math
 import random
-import cv2
+import zlib
 import glob
-import librosa
+import numpy as np
 import os
 from pathlib import Path
+from audio_buffer import load_episode_audio
 from audio_extractor import extract_audio_snippets
+from dataset_manifest import episode_state, frames_per_class, load_manifest, save_manifest
+from feature_cache import get_cached
+from frame_extractor import add_frame_request, extract_frames_to_files, extract_videos_parallel
+from frame_store import add_frames, frame_store_path, link_image, write_frame_manifest
+from image_tensor_store import create_image_tensor_store, extract_frames_to_tensor_store
+from mfcc_extractor import buffer_mfccs, extract_mfccs_parallel, mfcc_window, parse_snippet_filename
+from mfcc_sequence_dataset import mfcc_sequence_tf_dataset
+from mfcc_store import group_rows, load_mfcc_store, write_mfcc_store
+from profiling import profile_run, stage
+from shot_index import ShotIndex
+from screentime import ScreenTimeIndex, ground_truth_locations_from_indices, load_screentime_indices, \
+    print_ground_truth_statistics
+from timebase import TimeBase
 
 character_map = {0: 'kermit_the_frog',
                  1: 'waldorf_and_statler',
@@ -13,95 +27,123 @@ character_map = {0: 'kermit_the_frog',
                  3: 'swedish_chef',
                  4: 'none'}
 
-file_map = {'Muppets-02-01-01.txt': 1,
-            'Muppets-02-04-04.txt': 2,
-            'Muppets-03-04-03.txt': 3}
-
 video_base_path = '../../videos/'
 ground_truth_files_base_path = '../../ground_truth/'
 audio_snippet_path = '../../audio/'
-mfcc_feature_file = '../../ground_truth/audio/mfcc.txt'
+feature_cache_path = '../../ground_truth/audio/cache/'
+mfcc_sample_rate = 22050
 ground_truth_txt_files = ['../../ground_truth/Muppets-02-01-01/Muppets-02-01-01.txt',
                           '../../ground_truth/Muppets-02-04-04/Muppets-02-04-04.txt',
                           '../../ground_truth/Muppets-03-04-03/Muppets-03-04-03.txt']
+# the file id of a ground truth file is its position in ground_truth_txt_files + 1, like in the audio snippet
+# filenames, cli.configure_paths sets both for other episodes
+file_map = {filename.split('/')[-1]: i + 1 for i, filename in enumerate(ground_truth_txt_files)}
+empty_frame_ids = np.empty(0, dtype=np.int64)
+character_dataset_paths = {0: 'kermit/', 2: 'pig/', 3: 'swedish_chef/'}
 
 
-def print_ground_truth_statistics(data_locations_dict):
+def dataset_samples(character_location_map, rest_location_map, character_id):
     """
-    The aim of this method is to print statistics of the ground truth.
-    :param data_locations_dict: dict holding the ground truth location data
+    The aim of this method is to list the samples of a dataset in the order of its labels file.
+    :param character_location_map: dict holding the frame ids of the target character per ground truth file
+    :param rest_location_map: dict holding the sampled frame ids per class and ground truth file
+    :param character_id: the id of the target character
+    :return: list of (ground truth file, frame id, label) tuples
     """
-    character_location_map = {}
-    total_samples = 0
-    print('Number of samples per character in ground truth:')
-    for i in range(0, len(character_map)):
-        no_of_samples = 0
-        for key, data_locations in data_locations_dict.items():
-            character_location_map[key] = data_locations[i]
-            no_of_samples += len(data_locations[i])
-        total_samples += no_of_samples
-        print('%s: %d' % (character_map[i], no_of_samples))
-    print('total_samples: %d' % total_samples)
+    samples = []
+    print('[INFO] Collect images for target class: %d' % character_id)
+    for key, values in character_location_map.items():
+        for value in values:
+            samples.append((key, int(value), character_id))
+
+    print('[INFO] Collect randomly sampled images')
+    for key, values in rest_location_map.items():
+        for k, vals in values.items():
+            for val in vals:
+                samples.append((k, int(val), key))
+
+    return samples
+
 
+def dataset_image_filename(file_id, frame_id, label):
+    return '%d_%d_%d.jpg' % (file_id, frame_id, label)
 
-def extract_ground_truth(character_location_map, rest_location_map, character_id, output_path):
+
+def extract_ground_truth(character_location_map, rest_location_map, character_id, output_path, max_workers=1,
+                         n_writer_threads=0, output_format='jpeg', image_size=(224, 224), skip_filenames=()):
+    """
+    The aim of this method is to write the images and the labels file of a dataset.
+    :param character_location_map: dict holding the frame ids of the target character per ground truth file
+    :param rest_location_map: dict holding the sampled frame ids per class and ground truth file
+    :param character_id: the id of the target character
+    :param output_path: directory the dataset is written to
+    :param max_workers: number of videos decoded in parallel, 1 decodes all videos in this process
+    :param n_writer_threads: number of threads encoding and writing images per video
+    :param output_format: 'jpeg' writes one image file per sample, 'tensor' writes a single memory-mapped image
+    tensor store with images resized to image_size
+    :param image_size: (height, width) of the images of a tensor store
+    :param skip_filenames: image filenames that already exist and are not extracted again, only used for jpeg
+    :return: list of (ground truth file, frame id, label) tuples of the dataset
+    """
     Path(output_path).mkdir(parents=True, exist_ok=True)
 
     labels_file = open(output_path + 'labels.txt', 'w')
     labels_file.write('txt_file, frame_id, label\n')
 
-    # write images of actual target character
-    print('[INFO] Start extracting images for target class: %d' % character_id)
-    for key, values in character_location_map.items():
-        video_path = video_base_path + key.split('.')[0] + '.avi'
-        cap = cv2.VideoCapture(video_path)
-
-        for value in values:
-            cap.set(cv2.CAP_PROP_POS_FRAMES, value)
-            ret, frame = cap.read()
-            if not ret:
-                print('Failed to read frame %d of video %r.' % (value, video_path))
-                labels_file.close()
-                exit(1)
-
-            filename = '%s/%d_%d_%d.jpg' % (output_path, file_map[key], value, character_id)
-            labels_file.write('%d, %d, %d\n' % (file_map[key], value, character_id))
-            cv2.imwrite(filename, frame)
-
-    print('[INFO] Start extracting randomly sampled images')
-    for key, values in rest_location_map.items():
-        for k, vals in values.items():
-            video_path = video_base_path + k.split('.')[0] + '.avi'
-            cap = cv2.VideoCapture(video_path)
+    # collect the requested frames per video first, so every video is decoded only once
+    samples = dataset_samples(character_location_map, rest_location_map, character_id)
 
-            for val in vals:
-                cap.set(cv2.CAP_PROP_POS_FRAMES, val)
-                ret, frame = cap.read()
-                if not ret:
-                    print('Failed to read frame %d of video %r.' % (val, video_path))
-                    labels_file.close()
-                    exit(1)
+    # images are requested either as files or as rows of the tensor store
+    skip_filenames = set(skip_filenames)
+    frame_requests = {}
+    for row, (key, frame_id, label) in enumerate(samples):
+        video_path = video_base_path + key.split('.')[0] + '.avi'
+        labels_file.write('%d, %d, %d\n' % (file_map[key], frame_id, label))
+        if output_format == 'tensor':
+            add_frame_request(frame_requests, video_path, frame_id, row)
+        elif dataset_image_filename(file_map[key], frame_id, label) not in skip_filenames:
+            filename = '%s/%s' % (output_path, dataset_image_filename(file_map[key], frame_id, label))
+            add_frame_request(frame_requests, video_path, frame_id, filename)
+
+    if output_format == 'tensor':
+        create_image_tensor_store(output_path, [(file_map[key], frame_id, label) for key, frame_id, label in samples],
+                                  image_size)
+        extract, extract_args = extract_frames_to_tensor_store, (output_path,)
+    else:
+        extract, extract_args = extract_frames_to_files, (n_writer_threads,)
 
-                filename = '%s/%d_%d_%d.jpg' % (output_path, file_map[k], val, key)
-                labels_file.write('%d, %d, %d\n' % (file_map[k], val, key))
-                cv2.imwrite(filename, frame)
+    print('[INFO] Start extracting images for target class: %d' % character_id)
+    try:
+        with stage('extract_images', items=sum(len(video_requests) for video_requests in frame_requests.values())):
+            if max_workers > 1:
+                extract_videos_parallel(frame_requests, max_workers, extract, extract_args)
+            else:
+                for video_path, video_requests in frame_requests.items():
+                    extract(video_path, video_requests, *extract_args)
+    except IOError as e:
+        print(e)
+        labels_file.close()
+        exit(1)
 
     labels_file.close()
+    return samples
 
 
-def create_image_dataset_for_character(character_id, data_locations_dict, sub_path):
+def sample_dataset_frames(character_id, data_locations_dict, seed=333):
     """
-    The aim of this method is to generate a dataset for the specified character that consists of
-    50% images labeled with the specified character and 50% randomly sampled of all others
+    The aim of this method is to sample the frames of a dataset for the specified character, i.e. all frames
+    labeled with the character and the same number of negatives sampled according to the data distribution.
     :param character_id: the id of the character
     :param data_locations_dict: dict holding the ground truth location data
-    :return:
+    :param seed: seed of the random sampling of the negative samples
+    :return: tuple of the frame ids of the character per ground truth file and the sampled frame ids per class
+    and ground truth file
     """
     character_location_map = {}
     half_length = 0
     for key, data_locations in data_locations_dict.items():
-        character_location_map[key] = data_locations[character_id]
-        half_length += len(data_locations[character_id])
+        character_location_map[key] = data_locations.get(character_id, empty_frame_ids)
+        half_length += len(character_location_map[key])
 
     # calculate data distribution over ground truth and per video
     data_distribution_map = {}
@@ -110,8 +152,8 @@ def create_image_dataset_for_character(character_id, data_locations_dict, sub_pa
         if i != character_id:
             temp = {}
             for key, data_locations in data_locations_dict.items():
-                total_samples += len(data_locations[i])
-                temp[key] = len(data_locations[i])
+                total_samples += len(data_locations.get(i, empty_frame_ids))
+                temp[key] = len(data_locations.get(i, empty_frame_ids))
             data_distribution_map[i] = temp
 
     # calculate absolute rest distribution map
@@ -122,112 +164,349 @@ def create_image_dataset_for_character(character_id, data_locations_dict, sub_pa
             temp[k] = math.ceil((v / total_samples) * half_length)
         rest_data_distribution_map[key] = temp
 
-    # actually do the random sampling
+    # actually do the random sampling, only true negatives are candidates
+    negative_frame_ids = negative_frame_candidates(data_locations_dict, character_id)
     rest_frameid_map = {}
-    random.seed(333)
     for key, values in rest_data_distribution_map.items():
         temp = {}
         for k, v in values.items():
-            temp[k] = random.sample(data_locations_dict[k][key], v)
-            # check if sample is not a positive sample, if so replace it
-            for idx, value in enumerate(temp[k]):
-                if value in data_locations_dict[k][character_id]:
-                    tmp_fnr = random.sample(data_locations_dict[k][key], 1)[0]
-                    while tmp_fnr in data_locations_dict[k][character_id] or tmp_fnr in temp[k]:
-                        tmp_fnr = random.sample(data_locations_dict[k][key], 1)[0]
-                    temp[k][idx] = tmp_fnr
+            temp[k] = sample_frame_ids(negative_frame_ids[key][k], v, seed, key, k)
         rest_frameid_map[key] = temp
 
+    return character_location_map, rest_frameid_map
+
+
+def create_image_dataset_for_character(character_id, data_locations_dict, sub_path, max_workers=1, n_writer_threads=0,
+                                       seed=333, output_format='jpeg', image_size=(224, 224)):
+    """
+    The aim of this method is to generate a dataset for the specified character that consists of
+    50% images labeled with the specified character and 50% randomly sampled of all others
+    :param character_id: the id of the character
+    :param data_locations_dict: dict holding the ground truth location data
+    :param sub_path: sub directory of the ground truth directory the dataset is written to
+    :param max_workers: number of videos decoded in parallel, 1 decodes all videos in this process
+    :param n_writer_threads: number of threads encoding and writing images per video
+    :param seed: seed of the random sampling of the negative samples
+    :param output_format: 'jpeg' writes one image file per sample, 'tensor' writes a single image tensor store
+    :param image_size: (height, width) of the images of a tensor store
+    :return:
+    """
+    character_location_map, rest_frameid_map = sample_dataset_frames(character_id, data_locations_dict, seed)
     extract_ground_truth(character_location_map, rest_frameid_map, character_id,
-                         ground_truth_files_base_path + sub_path)
+                         ground_truth_files_base_path + sub_path, max_workers, n_writer_threads, output_format,
+                         image_size)
+
+
+def build_image_dataset_incremental(character_id, sub_path, ground_truth_files=None, max_workers=1, n_writer_threads=0,
+                                    seed=333):
+    """
+    The aim of this method is to update a jpeg image dataset incrementally. A build manifest records the label file
+    hash and video of every episode and the frames extracted per class. Only images of new or changed samples are
+    extracted, images that are no longer sampled are deleted. The sampling is seeded per class and episode, so the
+    samples of unchanged episodes stay the same as long as the number of samples per episode does not change.
+    :param character_id: the id of the character
+    :param sub_path: sub directory of the ground truth directory the dataset is written to
+    :param ground_truth_files: list of ground truth text files, defaults to ground_truth_txt_files
+    :param max_workers: number of videos decoded in parallel, 1 decodes all videos in this process
+    :param n_writer_threads: number of threads encoding and writing images per video
+    :param seed: seed of the random sampling of the negative samples
+    """
+    ground_truth_files = ground_truth_files or ground_truth_txt_files
+    output_path = ground_truth_files_base_path + sub_path
+    Path(output_path).mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(output_path)
+
+    screentime_indices = load_screentime_indices(ground_truth_files)
+    ground_truth_locations = ground_truth_locations_from_indices(screentime_indices)
+    print_ground_truth_statistics(ground_truth_locations, screentime_indices)
+    character_location_map, rest_frameid_map = sample_dataset_frames(character_id, ground_truth_locations, seed)
+
+    # images of episodes whose video did not change can be reused
+    episodes = {}
+    reusable_filenames = set(os.listdir(output_path))
+    for ground_truth_file in ground_truth_files:
+        key = ground_truth_file.split('/')[-1]
+        episodes[key] = episode_state(ground_truth_file, video_base_path + key.split('.')[0] + '.avi')
+        previous_state = manifest['episodes'].get(key)
+        if previous_state is None:
+            print('[INFO] New episode: %s' % key)
+        elif previous_state['video'] != episodes[key]['video']:
+            print('[INFO] Video changed, extract all images again: %s' % key)
+            reusable_filenames -= set(dataset_image_filename(file_map[key], frame_id, int(label))
+                                      for label, frame_ids in previous_state['frames'].items()
+                                      for frame_id in frame_ids)
+        elif previous_state['labels_hash'] != episodes[key]['labels_hash']:
+            print('[INFO] Labels changed: %s' % key)
+
+    samples = extract_ground_truth(character_location_map, rest_frameid_map, character_id, output_path, max_workers,
+                                   n_writer_threads, skip_filenames=reusable_filenames)
+
+    # delete the images of samples that are no longer part of the dataset
+    sampled_filenames = set(dataset_image_filename(file_map[key], frame_id, label) for key, frame_id, label in samples)
+    stale_filenames = [filename for filename in os.listdir(output_path)
+                       if filename.endswith('.jpg') and filename not in sampled_filenames]
+    for filename in stale_filenames:
+        os.remove(output_path + filename)
+    print('[INFO] Extracted %d new images, deleted %d stale images' %
+          (len(sampled_filenames - reusable_filenames), len(stale_filenames)))
+
+    for key in episodes:
+        episodes[key]['frames'] = frames_per_class([(frame_id, label) for k, frame_id, label in samples if k == key])
+    save_manifest(output_path, {'character_id': character_id, 'seed': seed, 'episodes': episodes})
+
+
+def build_character_image_datasets(character_ids=(0, 2, 3), ground_truth_files=None, max_workers=1, seed=333,
+                                   store_path=frame_store_path, link_images=True, skip_duplicates=False,
+                                   shot_params=None):
+    """
+    The aim of this method is to build the jpeg image datasets of several characters at once. The ground truth is
+    parsed once and the samples of all datasets are planned first, so a frame sampled by several datasets is decoded
+    at most once into the content-addressed frame store (see frame_store), frames stored by a previous build are not
+    decoded at all. Every dataset is written as labels.txt and a manifest of references into the store (frames.json).
+    :param character_ids: ids of the characters, see character_dataset_paths for their directories
+    :param ground_truth_files: list of ground truth text files, defaults to ground_truth_txt_files
+    :param max_workers: number of videos decoded in parallel, 1 decodes all videos in this process
+    :param seed: seed of the random sampling of the negative samples
+    :param store_path: directory of the frame store
+    :param link_images: if True the images are hard linked into the dataset directories under their usual filenames,
+    so they take no additional disk space, and images that are no longer sampled are deleted
+    :param skip_duplicates: if True every dataset keeps one sample per segment of near duplicate frames (see
+    shot_index) and label, see deduplicate_samples, so fewer frames are decoded
+    :param shot_params: optional dict overriding shot_index.default_shot_params, e.g. the duplicate_threshold
+    """
+    ground_truth_files = ground_truth_files or ground_truth_txt_files
+    screentime_indices = load_screentime_indices(ground_truth_files)
+    ground_truth_locations = ground_truth_locations_from_indices(screentime_indices)
+    print_ground_truth_statistics(ground_truth_locations, screentime_indices)
+
+    datasets = {}
+    frame_ids_per_video = {}
+    for character_id in character_ids:
+        character_location_map, rest_frameid_map = sample_dataset_frames(character_id, ground_truth_locations, seed)
+        datasets[character_id] = dataset_samples(character_location_map, rest_frameid_map, character_id)
+        for key, frame_id, _ in datasets[character_id]:
+            frame_ids_per_video.setdefault(video_base_path + key.split('.')[0] + '.avi', set()).add(frame_id)
+
+    no_of_frames = sum(len(frame_ids) for frame_ids in frame_ids_per_video.values())
+    print('[INFO] %d samples of %d datasets use %d unique frames' %
+          (sum(len(samples) for samples in datasets.values()), len(datasets), no_of_frames))
+    if skip_duplicates:
+        representatives = {}
+        for video_path, frame_ids in frame_ids_per_video.items():
+            frame_ids = np.asarray(sorted(frame_ids), dtype=np.int64)
+            shot_index = ShotIndex.from_video(video_path, shot_params)
+            # frames outside of the index are decoded themselves, so they fail like without the index
+            covered = shot_index.covers(frame_ids)
+            representative_frame_ids, inverse = shot_index.representative_frames(frame_ids[covered])
+            representatives[video_path] = dict(zip(frame_ids[covered].tolist(),
+                                                   representative_frame_ids[inverse].tolist()))
+            representatives[video_path].update((frame_id, frame_id) for frame_id in frame_ids[~covered].tolist())
+        datasets = deduplicate_samples(datasets, representatives)
+        frame_ids_per_video = {}
+        for samples in datasets.values():
+            for key, frame_id, _ in samples:
+                frame_ids_per_video.setdefault(video_base_path + key.split('.')[0] + '.avi', set()).add(frame_id)
+        no_of_unique_frames = no_of_frames
+        no_of_frames = sum(len(frame_ids) for frame_ids in frame_ids_per_video.values())
+        print('[INFO] %d unique frames are reduced to %d frames of one sample per segment and label' %
+              (no_of_unique_frames, no_of_frames))
+
+    try:
+        with stage('extract_images', items=no_of_frames):
+            frame_hashes = add_frames(frame_ids_per_video, store_path, max_workers)
+    except IOError as e:
+        print(e)
+        exit(1)
+
+    for character_id, samples in datasets.items():
+        output_path = ground_truth_files_base_path + character_dataset_paths[character_id]
+        Path(output_path).mkdir(parents=True, exist_ok=True)
+        references = [(file_map[key], frame_id, label,
+                       frame_hashes[video_base_path + key.split('.')[0] + '.avi'][frame_id])
+                      for key, frame_id, label in samples]
+
+        with open(output_path + 'labels.txt', 'w') as labels_file:
+            labels_file.write('txt_file, frame_id, label\n')
+            for file_id, frame_id, label, _ in references:
+                labels_file.write('%d, %d, %d\n' % (file_id, frame_id, label))
+        write_frame_manifest(output_path, references, store_path)
+
+        if link_images:
+            filenames = {dataset_image_filename(file_id, frame_id, label): frame_hash
+                         for file_id, frame_id, label, frame_hash in references}
+            no_of_links = sum(link_image(store_path, frame_hash, output_path + filename)
+                              for filename, frame_hash in filenames.items())
+            stale_filenames = [filename for filename in os.listdir(output_path)
+                               if filename.endswith('.jpg') and filename not in filenames]
+            for filename in stale_filenames:
+                os.remove(output_path + filename)
+            print('[INFO] Linked %d new images, deleted %d stale images of dataset %s' %
+                  (no_of_links, len(stale_filenames), output_path))
+
+
+def deduplicate_samples(datasets, representatives):
+    """
+    The aim of this method is to drop the samples of near duplicate frames. Every dataset keeps one sample per
+    segment of near duplicate frames and label, whose frame is the representative of the segment if the dataset
+    samples it with the label, otherwise the first frame of the segment the dataset samples with the label. Samples
+    keep a frame of their own dataset, so every image is labeled with the ground truth of its own frame and negative
+    samples stay true negatives.
+    :param datasets: dict mapping character ids to lists of (ground truth file, frame id, label) samples
+    :param representatives: dict mapping video paths to dicts of frame ids and the representative frame of their
+    segment, see shot_index.ShotIndex.representative_frames
+    :return: dict mapping character ids to the deduplicated lists of samples
+    """
+    deduplicated = {}
+    for character_id, samples in datasets.items():
+        kept_frame_ids = {}
+        for key, frame_id, label in samples:
+            representative = representatives[video_base_path + key.split('.')[0] + '.avi'][frame_id]
+            segment = (key, representative, label)
+            kept_frame_ids[segment] = min(kept_frame_ids.get(segment, frame_id), frame_id,
+                                          key=lambda candidate: (candidate != representative, candidate))
+
+        deduplicated[character_id] = [(key, frame_id, label) for (key, _, label), frame_id in kept_frame_ids.items()]
+        print('[INFO] Dataset of character %d keeps %d of %d samples' %
+              (character_id, len(deduplicated[character_id]), len(samples)))
+    return deduplicated
+
+
+def negative_frame_candidates(data_locations_dict, character_id):
+    """
+    The aim of this method is to calculate the true negative frame ids per class and ground truth file, i.e.
+    all frame ids of a class that are not labeled with the specified character as well.
+    :param data_locations_dict: dict holding the ground truth location data
+    :param character_id: the id of the character
+    :return: dict mapping class ids to dicts of ground truth files and sorted frame id arrays
+    """
+    candidates = {}
+    for key, data_locations in data_locations_dict.items():
+        positives = data_locations.get(character_id, empty_frame_ids)
+        for i in range(0, len(character_map)):
+            if i != character_id:
+                frame_ids = data_locations.get(i, empty_frame_ids)
+                try:
+                    candidates[i][key] = np.setdiff1d(frame_ids, positives, assume_unique=True)
+                except KeyError:
+                    candidates[i] = {key: np.setdiff1d(frame_ids, positives, assume_unique=True)}
+
+    return candidates
+
+
+def sample_frame_ids(frame_ids, no_of_samples, seed, class_id, ground_truth_file):
+    """
+    The aim of this method is to randomly sample frame ids without replacement. The random generator is seeded per
+    class and ground truth file, so the samples of one file do not depend on the others, and the samples are a prefix
+    of a random permutation of the candidates, so a changed number of samples keeps the earlier picks, e.g. when
+    adding an episode changes the share of every episode.
+    :param frame_ids: array of candidate frame ids
+    :param no_of_samples: number of frame ids to sample, at most all candidates are returned
+    :param seed: the seed of the sampling
+    :param class_id: the class the frame ids belong to
+    :param ground_truth_file: the ground truth file the frame ids belong to
+    :return: sorted array of sampled frame ids
+    """
+    rng = np.random.default_rng([seed, class_id, zlib.crc32(ground_truth_file.encode())])
+    no_of_samples = min(no_of_samples, len(frame_ids))
+    return np.sort(frame_ids[rng.permutation(len(frame_ids))[:no_of_samples]])
 
 
 def parse_ground_truth_txt_files(ground_truth_files):
     """
     The aim of this method is to parse the ground truth from corresponding text files.
     :param ground_truth_files: a list of ground truth text file paths
-    :return: a dictionary representing the ground truth locations
+    :return: a dictionary representing the ground truth locations as sorted frame id arrays per class
+    """
+    return ground_truth_locations_from_indices(load_screentime_indices(ground_truth_files))
+
+
+def create_mfcc_audio_dataset(audio_path, frame_length_ms, n_mfcc, output_path, sample_rate=mfcc_sample_rate,
+                              max_workers=None):
     """
-    parsed_ground_truth = {}
-    for filename in ground_truth_files:
-        gt = {}
-        with open(filename, 'r') as f:
-            for i, line in enumerate(f):
-                str_parts = line.strip().split(', ')
-                parts = [int(p) for p in str_parts]
-                for part in parts[1:]:
-                    try:
-                        gt[part].append(parts[0])
-                    except KeyError:
-                        gt[part] = [parts[0]]
-
-        parsed_ground_truth[filename.split('/')[-1]] = gt
-
-    return parsed_ground_truth
-
-
-def create_mfcc_audio_dataset(audio_path, frame_length_ms, n_mfcc, output_file):
-    # extract counts for snippets with and without given character
-    total_no_audios = len(glob.glob(audio_path + '*.wav'))
-    print('Total number of audio snippets: %d' % total_no_audios)
+    The aim of this method is to extract MFCC features for all audio snippets and write them to a MFCC store.
+    :param audio_path: directory holding the audio snippets
+    :param frame_length_ms: window size of the MFCC frames in milliseconds
+    :param n_mfcc: number of MFCC features
+    :param output_path: directory of the MFCC store
+    :param sample_rate: sample rate the snippets are resampled to, None keeps the native sample rate
+    :param max_workers: number of worker processes, defaults to the number of cpus
+    """
+    # sort the snippets, so the store does not depend on the order of the file system
+    audio_files = sorted(glob.glob(audio_path + '*.wav'))
+    print('Total number of audio snippets: %d' % len(audio_files))
     print('Window size: %d ms' % frame_length_ms)
     print('Number of MFCC features: %d' % n_mfcc)
     print('Extracting MFCC features for audio data...')
 
-    # define fft window and sliding window factors based on given frame length
-    mfcc_n_fft_factor = frame_length_ms / 1000  # window factor
-    mfcc_hop_length_factor = mfcc_n_fft_factor * 0.5  # sliding window factor, note that this must be an int
-
     # extract MFCC features for all audio files
-    mfcc_audio_data = {}
-    for audio_file in glob.glob(audio_path + '*.wav'):
-        # extract file id and character id
-        filename = audio_file.split('/')[-1]
-        file_char_id = filename.split('_')[0][-1] + '_' + filename.split('_')[1]
-
-        raw_data, sample_rate = librosa.load(audio_file)
-        mfccs = librosa.feature.mfcc(y=raw_data, sr=sample_rate, n_mfcc=n_mfcc,
-                                     hop_length=int(mfcc_hop_length_factor * sample_rate),
-                                     n_fft=int(mfcc_n_fft_factor * sample_rate)).T
-
-        try:
-            mfcc_audio_data[file_char_id].append(mfccs)
-        except KeyError:
-            mfcc_audio_data[file_char_id] = [mfccs]
-
-    # write calculated MFCCs to file
-    print('Write extracted MFCCs to file: %s' % output_file)
-    with open(output_file, 'w') as f:
-        for key, values in mfcc_audio_data.items():
-            file_id = key.split('_')[0]
-            char_id = key.split('_')[1]
-            for mfcc_array in values:
-                for mfcc_values in mfcc_array:
-                    list_as_string = ','.join([str(mfcc_values[i]) for i in range(0, mfcc_array.shape[1])])
-                    f.write('%s, %s, %s\n' % (file_id, char_id, list_as_string))
-
-
-def random_sample_mfcc(target_character_id, mfcc_file):
-    # read the mfcc features from file
+    results = extract_mfccs_parallel(audio_files, frame_length_ms, n_mfcc, sample_rate, max_workers)
+    sample_rates = set(result[1] for result in results)
+    if len(sample_rates) > 1:
+        raise ValueError('Audio snippets have different sample rates: %r' % sorted(sample_rates))
+
+    mfcc_arrays = [np.empty((0, n_mfcc), dtype=np.float32)] + [result[0] for result in results]
+    snippet_lengths = [len(result[0]) for result in results]
+    file_char_ids = np.asarray([parse_snippet_filename(audio_file) for audio_file in audio_files],
+                               dtype=np.int64).reshape(-1, 2)
+
+    # write calculated MFCCs to store, every MFCC frame gets the ids of its snippet
+    print('Write extracted MFCCs to store: %s' % output_path)
+    write_mfcc_store(output_path, np.concatenate(mfcc_arrays), np.repeat(file_char_ids[:, 0], snippet_lengths),
+                     np.repeat(file_char_ids[:, 1], snippet_lengths),
+                     np.repeat(np.arange(len(snippet_lengths)), snippet_lengths), n_mfcc, frame_length_ms,
+                     frame_length_ms * 0.5, sample_rates.pop() if sample_rates else sample_rate)
+
+
+def create_mfcc_audio_dataset_from_episodes(episode_video_paths, ground_truth_textfiles, frame_length_ms, n_mfcc,
+                                            output_path, sample_rate=mfcc_sample_rate):
+    """
+    The aim of this method is to write a MFCC store without intermediate audio snippets. One MFCC matrix is
+    computed per episode from its decoded audio track and sliced by the screen time intervals of every character.
+    :param episode_video_paths: list of episode video paths, the file id of an episode is its position + 1
+    :param ground_truth_textfiles: list of ground truth text files in the same order as the episodes
+    :param frame_length_ms: window size of the MFCC frames in milliseconds
+    :param n_mfcc: number of MFCC features
+    :param output_path: directory of the MFCC store
+    :param sample_rate: sample rate the audio tracks are decoded with
+    """
+    print('Total number of episodes: %d' % len(episode_video_paths))
+    print('Window size: %d ms' % frame_length_ms)
+    print('Number of MFCC features: %d' % n_mfcc)
+    print('Streaming MFCC features for episode audio data...')
+
+    mfcc_arrays = [np.empty((0, n_mfcc), dtype=np.float32)]
+    snippet_lengths = []
+    file_ids = []
+    char_ids = []
+    for i, video_path in enumerate(episode_video_paths):
+        samples, sample_rate = load_episode_audio(video_path, sample_rate)
+        timebase = TimeBase.from_video(video_path, sample_rate, frame_length_ms)
+        timebase.check_audio_length(len(samples))
+        mfccs = buffer_mfccs(samples, sample_rate, frame_length_ms, n_mfcc)
+        screentime_index = ScreenTimeIndex.from_file(ground_truth_textfiles[i])
+
+        # every screen time interval becomes a snippet of the store, slices do not copy the episode matrix
+        for char_id in range(0, len(character_map)):
+            for start, end in timebase.interval_mfcc_rows(screentime_index.intervals(char_id), len(mfccs)):
+                mfcc_arrays.append(mfccs[start:end])
+                snippet_lengths.append(end - start)
+                file_ids.append(i + 1)
+                char_ids.append(char_id)
+
+    print('Write extracted MFCCs to store: %s' % output_path)
+    write_mfcc_store(output_path, np.concatenate(mfcc_arrays), np.repeat(file_ids, snippet_lengths),
+                     np.repeat(char_ids, snippet_lengths),
+                     np.repeat(np.arange(len(snippet_lengths)), snippet_lengths), n_mfcc, frame_length_ms,
+                     frame_length_ms * 0.5, sample_rate)
+
+
+def random_sample_mfcc(target_character_id, mfcc_store_path):
+    # read the mfcc features from store
     print('Read MFCC features for random sampling...')
-    mfcc_data_all = {0: {}, 1: {}, 2: {}, 3: {}, 4: {}}
-    total_number_of_samples = 0
-    no_positive_samples = 0
-    with open(mfcc_file, 'r') as f:
-        for i, line in enumerate(f):
-            parts = line.split(',')
-            file_id = int(parts[0].strip())
-            char_id = int(parts[1].strip())
-            mfcc_coeffs = [float(parts[i].strip()) for i in range(2, len(parts))]
-
-            if char_id == target_character_id:
-                no_positive_samples += 1
-
-            try:
-                mfcc_data_all[char_id][file_id].append(mfcc_coeffs)
-            except KeyError:
-                mfcc_data_all[char_id][file_id] = [mfcc_coeffs]
-            total_number_of_samples += 1
+    store = load_mfcc_store(mfcc_store_path)
+    mfcc_data_all = {char_id: group_rows(store, char_id) for char_id in range(0, len(character_map))}
+    total_number_of_samples = len(store['char_ids'])
+    no_positive_samples = sum(len(rows) for rows in mfcc_data_all[target_character_id].values())
 
     # exract the number of sample present for target character
     print('Number of samples for target class %d: %d' % (target_character_id, no_positive_samples))
@@ -238,22 +517,24 @@ def random_sample_mfcc(target_character_id, mfcc_file):
     no_rest_samples = total_number_of_samples - no_positive_samples
     for char_id, value in mfcc_data_all.items():
         if char_id != target_character_id:
-            for file_id, mfccs in value.items():
+            for file_id, rows in value.items():
                 data_distribution_map[char_id][file_id] = math.ceil(
-                    (len(mfccs) / no_rest_samples) * no_positive_samples)
+                    (len(rows) / no_rest_samples) * no_positive_samples)
 
-    # add positive samples to resulting dataset
+    # add positive samples to resulting dataset, rows of the memory-mapped store are not copied
+    features = store['features']
     dataset = []
     for char_id, value in mfcc_data_all.items():
         if char_id == target_character_id:
-            for file_id, mfccs in value.items():
-                dataset += [(1, file_id, mfcc) for mfcc in mfccs]
+            for file_id, rows in value.items():
+                dataset += [(1, file_id, features[row]) for row in rows]
 
     # randomly sample the negative samples according to data distribution
     random.seed(333)
     for char_id, value in data_distribution_map.items():
         for file_id, k in value.items():
-            dataset += [(0, file_id, mfcc) for mfcc in random.sample(mfcc_data_all[char_id][file_id], k)]
+            rows = mfcc_data_all[char_id][file_id]
+            dataset += [(0, file_id, features[rows[i]]) for i in random.sample(range(len(rows)), k)]
 
     print('Successfully extracted MFCC feature dataset for character: %d' % target_character_id)
 
@@ -263,33 +544,35 @@ def chunks(l, n):
     for i in range(0, len(l), n):
         yield l[i:i + n]
 
-def random_sample_multi_mfcc(target_character_id, mfcc_file, audio_path, frame_length_ms, n_mfcc, mfcc_sequence_len):
-    # extract counts for snippets with and without given character
-    total_no_audios = len(glob.glob(audio_path + '*.wav'))
-    print('Total number of audio snippets: %d' % total_no_audios)
-    print('Window size: %d ms' % frame_length_ms)
-    print('Number of MFCC features: %d' % n_mfcc)
-    print('Extracting MFCC features for audio data...')
+def snippet_rows(store):
+    """
+    The aim of this method is to split the rows of a MFCC store into its audio snippets.
+    :param store: a store loaded by load_mfcc_store
+    :return: list of (character id, start row, end row) tuples in store order
+    """
+    snippet_ids = np.asarray(store['snippet_ids'])
+    if len(snippet_ids) == 0:
+        return []
+
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(snippet_ids)) + 1])
+    ends = np.concatenate([starts[1:], [len(snippet_ids)]])
+    char_ids = np.asarray(store['char_ids'])[starts]
+    return list(zip(char_ids.tolist(), starts.tolist(), ends.tolist()))
+
 
-    # define fft window and sliding window factors based on given frame length
-    mfcc_n_fft_factor = frame_length_ms / 1000  # window factor
-    mfcc_hop_length_factor = mfcc_n_fft_factor * 0.5  # sliding window factor, note that this must be an int
+def random_sample_multi_mfcc(target_character_id, mfcc_store_path, mfcc_sequence_len):
+    # read the mfcc features from store
+    print('Read MFCC features for random sampling...')
+    store = load_mfcc_store(mfcc_store_path)
+    features = store['features']
+    print('Window size: %d ms' % store['header']['frame_length_ms'])
+    print('Number of MFCC features: %d' % store['header']['n_mfcc'])
 
     total_number_of_samples = 0
-    # extract MFCC features for all audio files
+    # split the MFCC frames of every snippet into sequences, slices of the memory-mapped store are not copied
     mfcc_audio_data = {}
-    for audio_file in glob.glob(audio_path + '*.wav'):
-        # extract file id and character id
-        filename = audio_file.split('/')[-1]
-        #file_char_id = filename.split('_')[0][-1] + '_' + filename.split('_')[1]
-        character_id = int(filename.split('_')[1])
-
-        raw_data, sample_rate = librosa.load(audio_file)
-        mfccs = librosa.feature.mfcc(y=raw_data, sr=sample_rate, n_mfcc=n_mfcc,
-                                     hop_length=int(mfcc_hop_length_factor * sample_rate),
-                                     n_fft=int(mfcc_n_fft_factor * sample_rate)).T
-
-        for mfcc_sequence in chunks(mfccs, mfcc_sequence_len):
+    for character_id, start, end in snippet_rows(store):
+        for mfcc_sequence in chunks(features[start:end], mfcc_sequence_len):
             total_number_of_samples += 1
             try:
                 mfcc_audio_data[character_id].append(mfcc_sequence)
@@ -328,73 +611,130 @@ def random_sample_multi_mfcc(target_character_id, mfcc_file, audio_path, frame_l
     return dataset
 
 
-def get_waldorf_statler_mfcc_features(frame_length_ms, n_mfcc):
+def get_mfcc_feature_store(frame_length_ms, n_mfcc, sample_rate=mfcc_sample_rate, max_workers=None, streaming=False):
+    """
+    The aim of this method is to return a MFCC store for the given parameters. Stores are cached by the
+    parameters and the state of the audio inputs, so they are only extracted again if one of them changes.
+    :param frame_length_ms: window size of the MFCC frames in milliseconds
+    :param n_mfcc: number of MFCC features
+    :param sample_rate: sample rate the snippets are resampled to, None keeps the native sample rate
+    :param max_workers: number of worker processes used for the extraction, defaults to the number of cpus
+    :param streaming: if True the MFCCs are computed from the decoded audio tracks of the episodes without audio
+    snippets, the tracks are decoded with the given sample rate or mfcc_sample_rate
+    :return: directory of the MFCC store
+    """
     Path('../../ground_truth/audio/').mkdir(parents=True, exist_ok=True)
 
+    if streaming:
+        episode_video_paths = [video_base_path + ground_truth_file.split('/')[-1].split('.')[0] + '.avi'
+                               for ground_truth_file in ground_truth_txt_files]
+        params = {'streaming': True,
+                  'sample_rate': sample_rate or mfcc_sample_rate,
+                  'frame_length_ms': frame_length_ms,
+                  'n_mfcc': n_mfcc}
+        return get_cached('mfcc', episode_video_paths + ground_truth_txt_files, params,
+                          lambda path: create_mfcc_audio_dataset_from_episodes(
+                              episode_video_paths, ground_truth_txt_files, frame_length_ms, n_mfcc, path,
+                              sample_rate or mfcc_sample_rate),
+                          cache_path=feature_cache_path)
+
     # check if audio snippets have alerady been extracted
-    if len(os.listdir('../../audio')) == 0:
+    if len(glob.glob(audio_snippet_path + '*.wav')) == 0:
         extract_audio_snippets()
 
-    # if mfcc data has not been extracted, call the extraction
-    if len(os.listdir('../../ground_truth/audio/')) == 0:
-        create_mfcc_audio_dataset(audio_snippet_path, frame_length_ms, n_mfcc, mfcc_feature_file)
+    # with the native sample rate the window in samples is only known after loading, the frame length defines it
+    n_fft, hop_length = mfcc_window(frame_length_ms, sample_rate) if sample_rate else (None, None)
+    params = {'sample_rate': sample_rate,
+              'frame_length_ms': frame_length_ms,
+              'n_fft': n_fft,
+              'hop_length': hop_length,
+              'n_mfcc': n_mfcc}
+    return get_cached('mfcc', glob.glob(audio_snippet_path + '*.wav'), params,
+                      lambda path: create_mfcc_audio_dataset(audio_snippet_path, frame_length_ms, n_mfcc, path,
+                                                             sample_rate, max_workers),
+                      cache_path=feature_cache_path)
 
-    return random_sample_mfcc(1, mfcc_feature_file)
 
-def get_swedish_chef_mfcc_features(frame_length_ms, n_mfcc):
-    Path('../../ground_truth/audio/').mkdir(parents=True, exist_ok=True)
+def get_waldorf_statler_mfcc_features(frame_length_ms, n_mfcc, streaming=False):
+    return random_sample_mfcc(1, get_mfcc_feature_store(frame_length_ms, n_mfcc, streaming=streaming))
 
-    # check if audio snippets have alerady been extracted
-    if len(os.listdir('../../audio')) == 0:
-        extract_audio_snippets()
+def get_swedish_chef_mfcc_features(frame_length_ms, n_mfcc, streaming=False):
+    return random_sample_mfcc(3, get_mfcc_feature_store(frame_length_ms, n_mfcc, streaming=streaming))
 
-    # if mfcc data has not been extracted, call the extraction
-    if len(os.listdir('../../ground_truth/audio/')) == 0:
-        create_mfcc_audio_dataset(audio_snippet_path, frame_length_ms, n_mfcc, mfcc_feature_file)
+def get_swedish_chef_multi_mfcc_features(frame_length_ms, n_mfcc, seq_len, streaming=False):
+    return random_sample_multi_mfcc(3, get_mfcc_feature_store(frame_length_ms, n_mfcc, streaming=streaming), seq_len)
 
-    return random_sample_mfcc(3, mfcc_feature_file)
 
-def get_swedish_chef_multi_mfcc_features(frame_length_ms, n_mfcc, seq_len):
-    Path('../../ground_truth/audio/').mkdir(parents=True, exist_ok=True)
+def get_swedish_chef_mfcc_sequence_dataset(frame_length_ms, n_mfcc, seq_len, batch_size=32, streaming=False):
+    return mfcc_sequence_tf_dataset(get_mfcc_feature_store(frame_length_ms, n_mfcc, streaming=streaming), 3, seq_len,
+                                    batch_size)
 
-    # check if audio snippets have alerady been extracted
-    if len(os.listdir('../../audio')) == 0:
-        extract_audio_snippets()
 
-    return random_sample_multi_mfcc(3, mfcc_feature_file, audio_snippet_path, frame_length_ms, n_mfcc, seq_len)
+def check_incremental_output_format(output_format):
+    # incremental builds update jpeg datasets file by file, image_size only applies to tensor stores
+    if output_format != 'jpeg':
+        raise ValueError('Incremental builds only support the jpeg output format, not %r.' % output_format)
+
+
+def create_kermit_image_dataset(max_workers=1, n_writer_threads=0, output_format='jpeg', image_size=(224, 224),
+                                incremental=False):
+    if incremental:
+        check_incremental_output_format(output_format)
+        build_image_dataset_incremental(0, 'kermit/', max_workers=max_workers, n_writer_threads=n_writer_threads)
+        return
 
-def create_kermit_image_dataset():
     Path('../../ground_truth/kermit/').mkdir(parents=True, exist_ok=True)
 
     # extract kermit image dataset if not already created
     if len(os.listdir('../../ground_truth/kermit/')) == 0:
-        ground_truth_locations = parse_ground_truth_txt_files(ground_truth_txt_files)
-        print_ground_truth_statistics(ground_truth_locations)
-        create_image_dataset_for_character(0, ground_truth_locations, 'kermit/')
+        screentime_indices = load_screentime_indices(ground_truth_txt_files)
+        ground_truth_locations = ground_truth_locations_from_indices(screentime_indices)
+        print_ground_truth_statistics(ground_truth_locations, screentime_indices)
+        create_image_dataset_for_character(0, ground_truth_locations, 'kermit/', max_workers,
+                                           n_writer_threads, output_format=output_format,
+                                           image_size=image_size)
     else:
         print('Kermit image dataset already created.')
 
 
-def create_pig_image_dataset():
+def create_pig_image_dataset(max_workers=1, n_writer_threads=0, output_format='jpeg', image_size=(224, 224),
+                             incremental=False):
+    if incremental:
+        check_incremental_output_format(output_format)
+        build_image_dataset_incremental(2, 'pig/', max_workers=max_workers, n_writer_threads=n_writer_threads)
+        return
+
     Path('../../ground_truth/pig/').mkdir(parents=True, exist_ok=True)
 
     # extract kermit image dataset if not already created
     if len(os.listdir('../../ground_truth/pig/')) == 0:
-        ground_truth_locations = parse_ground_truth_txt_files(ground_truth_txt_files)
-        print_ground_truth_statistics(ground_truth_locations)
-        create_image_dataset_for_character(2, ground_truth_locations, 'pig/')
+        screentime_indices = load_screentime_indices(ground_truth_txt_files)
+        ground_truth_locations = ground_truth_locations_from_indices(screentime_indices)
+        print_ground_truth_statistics(ground_truth_locations, screentime_indices)
+        create_image_dataset_for_character(2, ground_truth_locations, 'pig/', max_workers,
+                                           n_writer_threads, output_format=output_format,
+                                           image_size=image_size)
     else:
         print('Pigs image dataset already created.')
 
 
-def create_swedish_chef_image_dataset():
+def create_swedish_chef_image_dataset(max_workers=1, n_writer_threads=0, output_format='jpeg', image_size=(224, 224),
+                                      incremental=False):
+    if incremental:
+        check_incremental_output_format(output_format)
+        build_image_dataset_incremental(3, 'swedish_chef/', max_workers=max_workers, n_writer_threads=n_writer_threads)
+        return
+
     Path('../../ground_truth/swedish_chef/').mkdir(parents=True, exist_ok=True)
 
     # extract kermit image dataset if not already created
     if len(os.listdir('../../ground_truth/swedish_chef/')) == 0:
-        ground_truth_locations = parse_ground_truth_txt_files(ground_truth_txt_files)
-        print_ground_truth_statistics(ground_truth_locations)
-        create_image_dataset_for_character(3, ground_truth_locations, 'swedish_chef/')
+        screentime_indices = load_screentime_indices(ground_truth_txt_files)
+        ground_truth_locations = ground_truth_locations_from_indices(screentime_indices)
+        print_ground_truth_statistics(ground_truth_locations, screentime_indices)
+        create_image_dataset_for_character(3, ground_truth_locations, 'swedish_chef/', max_workers,
+                                           n_writer_threads, output_format=output_format,
+                                           image_size=image_size)
     else:
         print('Swedish Chef image dataset already created.')
 
@@ -402,5 +742,6 @@ def create_swedish_chef_image_dataset():
 if __name__ == '__main__':
     #create_pig_image_dataset()
 
-    data = get_swedish_chef_multi_mfcc_features(20, 20, 50)
+    with profile_run('dataset_generator'):
+        data = get_swedish_chef_multi_mfcc_features(20, 20, 50)
     #print(data)
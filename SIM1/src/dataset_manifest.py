@@ -0,0 +1,54 @@
+import json
+import os
+from pathlib import Path
+from feature_cache import file_fingerprint
+
+manifest_filename = 'manifest.json'
+
+
+def load_manifest(output_path):
+    """
+    The aim of this method is to load the build manifest of a dataset.
+    :param output_path: directory of the dataset
+    :return: the manifest, an empty manifest if the dataset has none yet
+    """
+    manifest_file = Path(output_path) / manifest_filename
+    if not manifest_file.is_file():
+        return {'episodes': {}}
+
+    with open(str(manifest_file), 'r') as f:
+        return json.load(f)
+
+
+def save_manifest(output_path, manifest):
+    manifest_file = Path(output_path) / manifest_filename
+    with open(str(manifest_file) + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(str(manifest_file) + '.tmp', str(manifest_file))
+
+
+def episode_state(ground_truth_file, video_path):
+    """
+    The aim of this method is to describe the inputs of an episode, i.e. the hash of its label file and the size and
+    modification time of its video.
+    :param ground_truth_file: path of the ground truth file of the episode
+    :param video_path: path of the video of the episode
+    :return: dict describing the episode
+    """
+    return {'labels_hash': file_fingerprint(ground_truth_file, hash_contents=True)[2],
+            'video': file_fingerprint(video_path) if os.path.isfile(video_path) else None}
+
+
+def frames_per_class(samples):
+    """
+    :param samples: list of (frame id, label) tuples of an episode
+    :return: dict mapping the labels to sorted lists of frame ids, keys are strings as in json
+    """
+    frames = {}
+    for frame_id, label in samples:
+        try:
+            frames[str(label)].append(int(frame_id))
+        except KeyError:
+            frames[str(label)] = [int(frame_id)]
+
+    return {label: sorted(frame_ids) for label, frame_ids in frames.items()}
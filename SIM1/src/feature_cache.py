@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+feature_cache_path = '../../ground_truth/audio/cache/'
+max_cache_bytes = 4 * 1024 ** 3
+complete_marker_filename = 'complete.json'
+temporary_entry_prefix = '.tmp-'
+# entries are built in temporary directories, those older than this are left over by crashed runs
+temporary_entry_max_age_s = 24 * 60 * 60
+
+
+def file_fingerprint(filename, hash_contents=False):
+    """
+    The aim of this method is to describe the state of an input file for cache keys.
+    :param filename: path of the file
+    :param hash_contents: if True the content is hashed, otherwise size and modification time are used
+    :return: list describing the file
+    """
+    stat = os.stat(filename)
+    if hash_contents:
+        sha1 = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                sha1.update(block)
+        return [os.path.basename(filename), stat.st_size, sha1.hexdigest()]
+
+    return [os.path.basename(filename), stat.st_size, stat.st_mtime_ns]
+
+
+def cache_key(name, input_files, params, hash_contents=False):
+    """
+    The aim of this method is to calculate the key of a cache entry from its input files and parameters.
+    :param name: name of the cached artifact
+    :param input_files: list of input file paths
+    :param params: dict of json serializable parameters the artifact depends on
+    :param hash_contents: if True the input files are hashed, otherwise size and modification time are used
+    :return: hex digest identifying the cache entry
+    """
+    description = {'name': name,
+                   'inputs': [file_fingerprint(filename, hash_contents) for filename in sorted(input_files)],
+                   'params': params}
+    return hashlib.sha1(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+def directory_size(path):
+    return sum(f.stat().st_size for f in Path(path).rglob('*') if f.is_file())
+
+
+def evict_least_recently_used(cache_path, max_bytes, keep=None):
+    """
+    The aim of this method is to delete the least recently used cache entries until the cache fits into max_bytes.
+    Temporary directories of entries that are still being created are kept, unless they are older than
+    temporary_entry_max_age_s, i.e. left over by a crashed run.
+    :param cache_path: directory of the cache
+    :param max_bytes: maximum total size of the cache in bytes
+    :param keep: path of an entry that is never deleted
+    """
+    entries = []
+    for entry_path in Path(cache_path).iterdir():
+        if not entry_path.is_dir():
+            continue
+        if entry_path.name.startswith(temporary_entry_prefix):
+            try:
+                if time.time() - entry_path.stat().st_mtime > temporary_entry_max_age_s:
+                    shutil.rmtree(str(entry_path), ignore_errors=True)
+            except OSError:
+                # the entry was completed or removed by its creator in the meantime
+                pass
+            continue
+        marker = entry_path / complete_marker_filename
+        try:
+            entries.append((marker.stat().st_mtime, directory_size(entry_path), entry_path))
+        except OSError:
+            # entries are renamed into place complete, so a directory without marker is never written anymore, it
+            # is being evicted concurrently or left over by a crashed run of an older version
+            shutil.rmtree(str(entry_path), ignore_errors=True)
+
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, entry_path in sorted(entries, key=lambda entry: entry[0]):
+        if total_bytes <= max_bytes:
+            break
+        if keep is not None and entry_path == Path(keep):
+            continue
+        print('[INFO] Evict cache entry %s (%d bytes)' % (entry_path.name, size))
+        shutil.rmtree(str(entry_path), ignore_errors=True)
+        total_bytes -= size
+
+
+def get_cached(name, input_files, params, create, cache_path=feature_cache_path, max_bytes=max_cache_bytes,
+               hash_contents=False):
+    """
+    The aim of this method is to return the cache entry for the given inputs and parameters. If the entry does not
+    exist yet, create is called with a temporary directory that is renamed to the entry directory once complete, so
+    concurrent processes can create entries in the same cache. Afterwards least recently used entries are evicted
+    until the cache fits into max_bytes.
+    :param name: name of the cached artifact
+    :param input_files: list of input file paths
+    :param params: dict of json serializable parameters the artifact depends on
+    :param create: callable writing the artifact into the directory passed as only argument, files must be
+    referenced relative to it
+    :param cache_path: directory of the cache
+    :param max_bytes: maximum total size of the cache in bytes
+    :param hash_contents: if True the input files are hashed, otherwise size and modification time are used
+    :return: directory of the cache entry
+    """
+    key = cache_key(name, input_files, params, hash_contents)
+    entry_path = Path(cache_path) / ('%s-%s' % (name, key))
+    marker = entry_path / complete_marker_filename
+
+    if marker.is_file():
+        print('[INFO] Use cached %s: %s' % (name, entry_path))
+        os.utime(str(marker))
+        return str(entry_path) + '/'
+
+    print('[INFO] Create cache entry for %s: %s' % (name, entry_path))
+    Path(cache_path).mkdir(parents=True, exist_ok=True)
+    # the entry is built in a temporary directory and renamed into place once complete, so concurrent creators of
+    # the same or other entries never see or delete a partially written entry
+    temporary_path = tempfile.mkdtemp(prefix='%s%s-%s-' % (temporary_entry_prefix, name, key), dir=cache_path)
+    try:
+        create(temporary_path + '/')
+        with open(os.path.join(temporary_path, complete_marker_filename), 'w') as f:
+            json.dump({'name': name, 'params': params, 'no_of_inputs': len(input_files)}, f, indent=2)
+        if entry_path.is_dir() and not marker.is_file():
+            shutil.rmtree(str(entry_path), ignore_errors=True)
+        try:
+            os.replace(temporary_path, str(entry_path))
+        except OSError:
+            if not marker.is_file():
+                raise
+            # another process created the same entry first
+            print('[INFO] Use cached %s created concurrently: %s' % (name, entry_path))
+    finally:
+        shutil.rmtree(temporary_path, ignore_errors=True)
+
+    evict_least_recently_used(cache_path, max_bytes, keep=entry_path)
+    return str(entry_path) + '/'
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import cv2
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from skimage.feature import hog
+from skimage.transform import resize
+from profiling import call_profiled, file_size, merge_stage_stats, stage
+
+image_feature_cache_path = '../../ground_truth/features/cache/'
+default_feature_params = {'raw_pixels': {'size': (128, 128)},
+                          'color_hist': {'bins': (32, 32, 32)},
+                          'hog': {'size': (256, 128), 'orientations': 9, 'pixels_per_cell': (8, 8),
+                                  'cells_per_block': (2, 2)}}
+
+
+# method for image resizing and extracting vector of raw values
+def extract_value_vector(image, size=(128, 128)):
+    return cv2.resize(image, size).flatten()
+
+
+def extract_colour_histogram(image, bins=(32, 32, 32)):
+    # convert image to hsv space
+    hsv_image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+
+    # extract color histogram from image and take all 3 channels into account
+    color_hist = cv2.calcHist([hsv_image], [0, 1, 2], None, bins, [0, 180, 0, 256, 0, 256])
+
+    # normalize resulting histogram
+    cv2.normalize(color_hist, color_hist)
+
+    # return histogram as feature vector
+    return color_hist.flatten()
+
+
+def extract_hog_features(image, size=(256, 128), orientations=9, pixels_per_cell=(8, 8), cells_per_block=(2, 2)):
+    resized_image = resize(image, size)
+    return hog(resized_image, orientations=orientations, pixels_per_cell=pixels_per_cell,
+               cells_per_block=cells_per_block, visualize=False, multichannel=True)
+
+
+feature_extractors = {'raw_pixels': extract_value_vector,
+                      'color_hist': extract_colour_histogram,
+                      'hog': extract_hog_features}
+
+
+def feature_params(feature_types, params=None):
+    """
+    :param feature_types: list of feature type names, see feature_extractors
+    :param params: optional dict overriding the default parameters per feature type
+    :return: dict holding the complete parameters per feature type
+    """
+    params = params or {}
+    return {feature_type: dict(default_feature_params[feature_type], **params.get(feature_type, {}))
+            for feature_type in feature_types}
+
+
+def extract_features_batch(images, feature_types=('color_hist', 'raw_pixels', 'hog'), params=None):
+    """
+    The aim of this method is to extract features for a batch of images into contiguous float32 matrices.
+    :param images: list of bgr images
+    :param feature_types: list of feature type names, see feature_extractors
+    :param params: optional dict overriding the default parameters per feature type
+    :return: dict mapping the feature types to matrices of shape (no_of_images, feature_dim)
+    """
+    params = feature_params(feature_types, params)
+    features = {}
+    for feature_type in feature_types:
+        extractor = feature_extractors[feature_type]
+        matrix = None
+        with stage('features_' + feature_type, items=len(images)):
+            for i, image in enumerate(images):
+                vector = extractor(image, **params[feature_type])
+                if matrix is None:
+                    matrix = np.empty((len(images), len(vector)), dtype=np.float32)
+                matrix[i] = vector
+        features[feature_type] = matrix if matrix is not None else np.empty((0, 0), dtype=np.float32)
+
+    return features
+
+
+def extract_file_features(filenames, feature_types, params):
+    images = []
+    with stage('read_images', items=len(filenames)) as counters:
+        for filename in filenames:
+            image = cv2.imread(filename)
+            if image is None:
+                raise IOError('Failed to read image %r.' % filename)
+            images.append(image)
+            counters['bytes_read'] += file_size(filename)
+
+    return extract_features_batch(images, feature_types, params)
+
+
+def extract_image_features_parallel(filenames, feature_types=('color_hist', 'raw_pixels', 'hog'), params=None,
+                                    max_workers=None, batch_size=64):
+    """
+    The aim of this method is to extract features for image files with a process pool. Every worker reads and
+    processes a batch of files, the results keep the order of the given files.
+    :param filenames: list of image file paths
+    :param feature_types: list of feature type names, see feature_extractors
+    :param params: optional dict overriding the default parameters per feature type
+    :param max_workers: number of worker processes, defaults to the number of cpus, 1 extracts in this process
+    :param batch_size: number of images per worker task
+    :return: dict mapping the feature types to matrices of shape (no_of_images, feature_dim)
+    """
+    max_workers = max_workers or os.cpu_count()
+    batches = [filenames[i:i + batch_size] for i in range(0, len(filenames), batch_size)]
+
+    if max_workers <= 1 or len(batches) <= 1:
+        results = [extract_file_features(batch, feature_types, params) for batch in batches]
+    else:
+        results = []
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for result, stats in executor.map(call_profiled, [extract_file_features] * len(batches), batches,
+                                              [feature_types] * len(batches), [params] * len(batches)):
+                merge_stage_stats(stats)
+                results.append(result)
+
+    features = {}
+    for feature_type in feature_types:
+        matrices = [result[feature_type] for result in results]
+        features[feature_type] = np.concatenate(matrices) if matrices else np.empty((0, 0), dtype=np.float32)
+
+    return features
+
+
+def image_hash(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def image_features_filename(cache_path, params_key, frame_hash):
+    return '%s%s/%s/%s.npz' % (cache_path, params_key, frame_hash[:2], frame_hash)
+
+
+def extract_image_features(filenames, feature_types=('color_hist', 'raw_pixels', 'hog'), params=None,
+                           max_workers=None, cache_path=image_feature_cache_path):
+    """
+    The aim of this method is to return features for image files. The features are cached per image, keyed by the
+    sha1 hash of the image and the feature parameters, so only images that are new or changed are extracted, and
+    identical images, e.g. the frames shared by several datasets (see frame_store), are extracted once. Cached
+    features of images that are no longer used are kept until the cache directory is deleted.
+    :param filenames: list of image file paths, the rows of the result have the same order
+    :param feature_types: list of feature type names, see feature_extractors
+    :param params: optional dict overriding the default parameters per feature type
+    :param max_workers: number of worker processes, defaults to the number of cpus
+    :param cache_path: directory of the cache, None disables caching
+    :return: dict mapping the feature types to matrices of shape (no_of_images, feature_dim)
+    """
+    if cache_path is None:
+        return extract_image_features_parallel(filenames, feature_types, params, max_workers)
+
+    params = feature_params(feature_types, params)
+    params_key = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+    with stage('hash_images', items=len(filenames)) as counters:
+        frame_hashes = [image_hash(filename) for filename in filenames]
+        counters['bytes_read'] = sum(file_size(filename) for filename in filenames)
+
+    missing = {}
+    for filename, frame_hash in zip(filenames, frame_hashes):
+        if not os.path.isfile(image_features_filename(cache_path, params_key, frame_hash)):
+            missing.setdefault(frame_hash, filename)
+    print('[INFO] Extract features of %d of %d images, the others are cached' % (len(missing), len(filenames)))
+
+    if missing:
+        features = extract_image_features_parallel(list(missing.values()), feature_types, params, max_workers)
+        with stage('write_image_features', items=len(missing)):
+            for i, frame_hash in enumerate(missing):
+                features_file = image_features_filename(cache_path, params_key, frame_hash)
+                Path(features_file).parent.mkdir(parents=True, exist_ok=True)
+                # concurrent processes can extract the same image, the rename keeps the entry complete
+                with open(features_file + '.%d.tmp' % os.getpid(), 'wb') as f:
+                    np.savez(f, **{feature_type: features[feature_type][i] for feature_type in feature_types})
+                os.replace(features_file + '.%d.tmp' % os.getpid(), features_file)
+
+    matrices = {feature_type: None for feature_type in feature_types}
+    with stage('load_image_features', items=len(filenames)):
+        for i, frame_hash in enumerate(frame_hashes):
+            with np.load(image_features_filename(cache_path, params_key, frame_hash)) as data:
+                for feature_type in feature_types:
+                    if matrices[feature_type] is None:
+                        matrices[feature_type] = np.empty((len(filenames), len(data[feature_type])),
+                                                          dtype=np.float32)
+                    matrices[feature_type][i] = data[feature_type]
+
+    return {feature_type: matrix if matrix is not None else np.empty((0, 0), dtype=np.float32)
+            for feature_type, matrix in matrices.items()}
@@ -0,0 +1,164 @@
+import cv2
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from profiling import call_profiled, merge_stage_stats, stage
+
+
+def add_frame_request(frame_requests, video_path, frame_id, consumer):
+    """
+    The aim of this method is to register a consumer for a single frame of a video. Requests are collected
+    first and decoded afterwards, so a frame needed by several consumers is only decoded once.
+    :param frame_requests: dict mapping video paths to dicts of frame ids and their consumers
+    :param video_path: path of the video the frame belongs to
+    :param frame_id: the id of the requested frame
+    :param consumer: a callable that gets the decoded frame (see run_frame_requests) or an image filename the
+    frame is written to (see extract_frames_to_files)
+    """
+    try:
+        video_requests = frame_requests[video_path]
+    except KeyError:
+        video_requests = {}
+        frame_requests[video_path] = video_requests
+
+    try:
+        video_requests[int(frame_id)].append(consumer)
+    except KeyError:
+        video_requests[int(frame_id)] = [consumer]
+
+
+def iter_frames(video_path, frame_ids):
+    """
+    The aim of this method is to decode the requested frames of a video in a single sequential pass.
+    Frames nobody asked for are only grabbed and never retrieved, so no seeking is necessary.
+    :param video_path: path of the video
+    :param frame_ids: iterable of frame ids, duplicates and order do not matter
+    :return: generator yielding (frame_id, frame) tuples in ascending frame order
+    """
+    wanted_frame_ids = sorted(set(int(frame_id) for frame_id in frame_ids))
+    cap = cv2.VideoCapture(video_path)
+    position = 0
+
+    try:
+        for frame_id in wanted_frame_ids:
+            with stage('decode_frames', items=1):
+                while position < frame_id:
+                    if not cap.grab():
+                        raise IOError('Failed to read frame %d of video %r.' % (frame_id, video_path))
+                    position += 1
+
+                ret, frame = cap.read()
+                if not ret:
+                    raise IOError('Failed to read frame %d of video %r.' % (frame_id, video_path))
+                position += 1
+
+            yield frame_id, frame
+    finally:
+        cap.release()
+
+
+def run_frame_requests(frame_requests):
+    """
+    The aim of this method is to decode every video of the given requests once and hand each requested
+    frame to all consumers registered for it.
+    :param frame_requests: dict mapping video paths to dicts of frame ids and their consumers
+    """
+    for video_path, video_requests in frame_requests.items():
+        print('[INFO] Start decoding %d frames of video %s' % (len(video_requests), video_path))
+        for frame_id, frame in iter_frames(video_path, video_requests.keys()):
+            for consumer in video_requests[frame_id]:
+                consumer(frame)
+
+
+def write_image(filename, image):
+    """
+    The aim of this method is to encode an image in the format given by the file extension and write it.
+    :param filename: path of the image file
+    :param image: the bgr image
+    """
+    with stage('write_images', items=1) as counters:
+        ret, buffer = cv2.imencode(os.path.splitext(filename)[1], image)
+        if not ret:
+            raise IOError('Failed to encode image %r.' % filename)
+        with open(filename, 'wb') as f:
+            f.write(buffer.tobytes())
+        counters['bytes_written'] = len(buffer)
+
+
+def extract_frames_to_files(video_path, frame_files, n_writer_threads=0):
+    """
+    The aim of this method is to write the requested frames of a single video to image files.
+    :param video_path: path of the video
+    :param frame_files: dict mapping frame ids to lists of output image filenames
+    :param n_writer_threads: number of threads encoding and writing images, 0 writes inline with decoding
+    """
+    print('[INFO] Start decoding %d frames of video %s' % (len(frame_files), video_path))
+    if n_writer_threads <= 0:
+        for frame_id, frame in iter_frames(video_path, frame_files.keys()):
+            for filename in frame_files[frame_id]:
+                write_image(filename, frame)
+        return
+
+    # bound the number of pending frames, so decoding can not run away from the writers and fill the memory
+    pending_frames = threading.BoundedSemaphore(4 * n_writer_threads)
+    futures = []
+    with ThreadPoolExecutor(max_workers=n_writer_threads) as executor:
+        for frame_id, frame in iter_frames(video_path, frame_files.keys()):
+            for filename in frame_files[frame_id]:
+                pending_frames.acquire()
+                future = executor.submit(write_image, filename, frame)
+                future.add_done_callback(lambda f: pending_frames.release())
+                futures.append(future)
+
+    for future in futures:
+        future.result()
+
+
+def extract_videos_parallel(frame_requests, max_workers=None, extract=extract_frames_to_files, extract_args=()):
+    """
+    The aim of this method is to extract the requested frames of several videos in parallel, using one
+    worker process per video.
+    :param frame_requests: dict mapping video paths to dicts of frame ids and their consumers
+    :param max_workers: maximum number of worker processes, defaults to the number of cpus
+    :param extract: function called as extract(video_path, video_requests, *extract_args) per video, defaults to
+    writing image files
+    :param extract_args: further arguments of extract, e.g. the number of image writer threads
+    :return: dict mapping the video paths to the results of extract
+    """
+    if len(frame_requests) == 0:
+        return {}
+
+    # the workers return their stage stats, which are merged into the stats of this process
+    max_workers = min(max_workers or os.cpu_count(), len(frame_requests))
+    results = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {video_path: executor.submit(call_profiled, extract, video_path, video_requests, *extract_args)
+                   for video_path, video_requests in frame_requests.items()}
+        for video_path, future in futures.items():
+            results[video_path], stats = future.result()
+            merge_stage_stats(stats)
+
+    return results
+
+
+def read_frames_with_seeking(video_path, frame_ids):
+    """
+    The aim of this method is to read frames the way it was done before the sequential engine existed, i.e.
+    seeking to every single frame. It is only kept as reference for benchmarks.
+    :param video_path: path of the video
+    :param frame_ids: iterable of frame ids
+    :return: generator yielding (frame_id, frame) tuples in the given order
+    """
+    cap = cv2.VideoCapture(video_path)
+
+    try:
+        for frame_id in frame_ids:
+            with stage('seek_frames', items=1):
+                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_id)
+                ret, frame = cap.read()
+                if not ret:
+                    raise IOError('Failed to read frame %d of video %r.' % (frame_id, video_path))
+
+            yield frame_id, frame
+    finally:
+        cap.release()
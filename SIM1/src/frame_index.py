@@ -0,0 +1,330 @@
+import json
+import os
+import cv2
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from feature_cache import get_cached
+from feature_extractor import extract_colour_histogram
+from frame_extractor import iter_frames
+from profiling import call_profiled, merge_stage_stats, stage
+from timebase import read_video_properties
+
+frame_index_cache_path = '../../ground_truth/frame_index/'
+default_descriptor_params = {'bins': (8, 8, 8), 'size': (160, 120), 'dtype': 'float16'}
+
+
+def frame_descriptor(frame, bins=(8, 8, 8), size=(160, 120)):
+    """
+    The aim of this method is to compute the compact descriptor of a frame, i.e. the L2 normalized hsv colour
+    histogram of the downscaled frame.
+    :param frame: the bgr frame
+    :param bins: number of histogram bins per hsv channel
+    :param size: (width, height) the frame is downscaled to
+    :return: float32 vector of length prod(bins)
+    """
+    small_frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    return extract_colour_histogram(small_frame, bins)
+
+
+def quantize_descriptors(descriptors, dtype):
+    # descriptors are unit vectors, so uint8 can cover [0, 1] with a fixed scale
+    if dtype == 'uint8':
+        return np.round(np.clip(descriptors, 0, 1) * 255).astype(np.uint8)
+    return descriptors.astype(dtype)
+
+
+def dequantize_descriptors(descriptors):
+    if descriptors.dtype == np.uint8:
+        return descriptors.astype(np.float32) / 255
+    return descriptors.astype(np.float32)
+
+
+def build_episode_index(video_path, output_path, frame_stride=1, bins=(8, 8, 8), size=(160, 120), dtype='float16'):
+    """
+    The aim of this method is to decode a video once and write the descriptor of every frame_stride-th frame.
+    :param video_path: path of the video
+    :param output_path: directory the index files are written to
+    :param frame_stride: step size between the indexed frames
+    :param bins: number of histogram bins per hsv channel
+    :param size: (width, height) the frames are downscaled to
+    :param dtype: 'float16' or 'uint8' storage type of the descriptors
+    """
+    _, no_of_frames = read_video_properties(video_path)
+    descriptors = []
+    frame_ids = []
+    with stage('frame_index', items=0) as counters:
+        try:
+            for frame_id, frame in iter_frames(video_path, range(0, no_of_frames, frame_stride)):
+                descriptors.append(frame_descriptor(frame, bins, size))
+                frame_ids.append(frame_id)
+        except IOError as e:
+            # the frame count of a container is only an estimate, the index ends at the last decodable frame
+            print('[INFO] %s, the index ends at frame %d' % (e, frame_ids[-1] if frame_ids else -1))
+        counters['items'] = len(frame_ids)
+
+    descriptors = np.asarray(descriptors, dtype=np.float32).reshape(-1, int(np.prod(bins)))
+    np.save(output_path + 'descriptors.npy', quantize_descriptors(descriptors, dtype))
+    np.save(output_path + 'frame_ids.npy', np.asarray(frame_ids, dtype=np.int32))
+    with open(output_path + 'header.json', 'w') as f:
+        json.dump({'video': os.path.basename(video_path), 'frame_stride': frame_stride, 'bins': list(bins),
+                   'size': list(size), 'dtype': dtype, 'no_of_frames': len(frame_ids)}, f, indent=2)
+
+
+def get_episode_index(video_path, frame_stride=1, params=None, cache_path=None):
+    """
+    The aim of this method is to return the index of an episode, which is built once and cached by the video and
+    the descriptor parameters.
+    :param video_path: path of the video
+    :param frame_stride: step size between the indexed frames
+    :param params: optional dict overriding default_descriptor_params
+    :param cache_path: directory of the cache, defaults to frame_index_cache_path
+    :return: directory of the episode index
+    """
+    params = dict(default_descriptor_params, **(params or {}))
+    return get_cached('frame_index', [video_path], dict(params, frame_stride=frame_stride),
+                      lambda path: build_episode_index(video_path, path, frame_stride, params['bins'], params['size'],
+                                                       params['dtype']),
+                      cache_path=cache_path or frame_index_cache_path)
+
+
+def top_k(similarities, rows, k):
+    """
+    :param similarities: matrix of shape (no_of_queries, no_of_candidates)
+    :param rows: index rows of the candidates, same shape as similarities
+    :param k: number of neighbours
+    :return: tuple of the rows and similarities of the k most similar candidates per query, most similar first
+    """
+    k = min(k, similarities.shape[1])
+    best = np.argpartition(-similarities, k - 1, axis=1)[:, :k] if k > 0 else np.empty((len(similarities), 0), int)
+    best_similarities = np.take_along_axis(similarities, best, axis=1)
+    order = np.argsort(-best_similarities, axis=1, kind='stable')
+    return np.take_along_axis(rows, np.take_along_axis(best, order, axis=1), axis=1), \
+        np.take_along_axis(best_similarities, order, axis=1)
+
+
+class FrameIndex:
+    """
+    Nearest neighbour index over the frame descriptors of one or several episodes. Descriptors are unit vectors,
+    neighbours are ranked by cosine similarity. Queries are answered exactly by chunked matrix products or
+    approximately by an inverted file, i.e. only the rows of the clusters closest to a query are searched.
+    """
+
+    def __init__(self, descriptors, file_ids, frame_ids, chunk_size=65536):
+        """
+        :param descriptors: matrix of shape (no_of_frames, descriptor_dim) as stored, e.g. memory-mapped float16
+        :param file_ids: file id per row
+        :param frame_ids: frame id per row
+        :param chunk_size: number of rows compared at once
+        """
+        self.descriptors = descriptors
+        self.file_ids = np.asarray(file_ids, dtype=np.int64)
+        self.frame_ids = np.asarray(frame_ids, dtype=np.int64)
+        self.chunk_size = chunk_size
+        self.centroids = None
+        self.list_rows = None
+        self.list_offsets = None
+
+    @classmethod
+    def from_videos(cls, video_paths, file_ids=None, frame_stride=1, params=None, max_workers=1,
+                    cache_path=None):
+        """
+        The aim of this method is to load the index of several episodes, building missing episode indices in
+        parallel.
+        :param video_paths: list of video paths
+        :param file_ids: file id per video, defaults to the position of the video + 1
+        :param max_workers: number of episodes indexed in parallel
+        :return: the FrameIndex of all episodes, see get_episode_index for the other parameters
+        """
+        file_ids = file_ids or list(range(1, len(video_paths) + 1))
+        if max_workers > 1:
+            with ProcessPoolExecutor(max_workers=min(max_workers, len(video_paths))) as executor:
+                futures = [executor.submit(call_profiled, get_episode_index, video_path, frame_stride, params,
+                                           cache_path) for video_path in video_paths]
+                entry_paths = []
+                for future in futures:
+                    entry_path, stats = future.result()
+                    merge_stage_stats(stats)
+                    entry_paths.append(entry_path)
+        else:
+            entry_paths = [get_episode_index(video_path, frame_stride, params, cache_path)
+                           for video_path in video_paths]
+
+        descriptors = [np.load(entry_path + 'descriptors.npy', mmap_mode='r') for entry_path in entry_paths]
+        frame_ids = [np.load(entry_path + 'frame_ids.npy') for entry_path in entry_paths]
+        # a single episode stays memory-mapped, several episodes are concatenated into memory
+        return cls(descriptors[0] if len(descriptors) == 1 else np.concatenate(descriptors),
+                   np.repeat(file_ids, [len(ids) for ids in frame_ids]), np.concatenate(frame_ids))
+
+    def __len__(self):
+        return len(self.frame_ids)
+
+    def dense(self, rows):
+        return dequantize_descriptors(self.descriptors[rows])
+
+    def rows_of(self, file_id, frame_ids):
+        """
+        :param file_id: the file id of the episode
+        :param frame_ids: array of frame ids
+        :return: index row per frame, -1 for frames that are not indexed
+        """
+        episode_rows = np.flatnonzero(self.file_ids == file_id)
+        frame_ids = np.asarray(frame_ids, dtype=np.int64)
+        rows = np.full(len(frame_ids), -1, dtype=np.int64)
+        if len(episode_rows) == 0:
+            return rows
+
+        positions = np.minimum(np.searchsorted(self.frame_ids[episode_rows], frame_ids), len(episode_rows) - 1)
+        found = self.frame_ids[episode_rows[positions]] == frame_ids
+        rows[found] = episode_rows[positions[found]]
+        return rows
+
+    def exact_search(self, queries, k, rows=None):
+        """
+        The aim of this method is to find the k most similar rows per query by comparing against all candidates.
+        :param queries: float32 matrix of shape (no_of_queries, descriptor_dim)
+        :param k: number of neighbours
+        :param rows: optional sorted array of the candidate rows, defaults to all rows
+        :return: tuple of the neighbour rows and similarities of shape (no_of_queries, k)
+        """
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows, dtype=np.int64)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_similarities = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(rows), self.chunk_size):
+            chunk_rows = rows[start:start + self.chunk_size]
+            similarities = queries @ self.dense(chunk_rows).T
+            best_rows, best_similarities = top_k(
+                np.concatenate([best_similarities, similarities], axis=1),
+                np.concatenate([best_rows, np.broadcast_to(chunk_rows, similarities.shape)], axis=1), k)
+
+        return best_rows, best_similarities
+
+    def build_ivf(self, nlist=None, iterations=10, sample_size=50000, seed=333):
+        """
+        The aim of this method is to cluster the descriptors with spherical k-means for approximate search. Every
+        row is assigned to its most similar centroid, the rows are grouped by cluster.
+        :param nlist: number of clusters, defaults to the square root of the number of rows
+        :param iterations: number of k-means iterations
+        :param sample_size: number of rows the centroids are trained on
+        :param seed: seed of the sampling and the initial centroids
+        """
+        rng = np.random.RandomState(seed)
+        nlist = min(nlist or max(1, int(np.sqrt(len(self)))), len(self))
+        sample = self.dense(np.sort(rng.choice(len(self), min(len(self), sample_size), replace=False)))
+
+        with stage('build_ivf', items=len(self)):
+            centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+            for _ in range(0, iterations):
+                assignment = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignment, sample)
+                norms = np.linalg.norm(sums, axis=1)
+                # empty clusters keep their centroid
+                centroids[norms > 0] = sums[norms > 0] / norms[norms > 0, None]
+
+            list_ids = np.empty(len(self), dtype=np.int64)
+            for start in range(0, len(self), self.chunk_size):
+                chunk_rows = np.arange(start, min(start + self.chunk_size, len(self)))
+                list_ids[chunk_rows] = np.argmax(self.dense(chunk_rows) @ centroids.T, axis=1)
+
+        self.centroids = centroids
+        self.list_rows = np.argsort(list_ids, kind='stable')
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(list_ids, minlength=nlist))])
+
+    def approximate_search(self, queries, k, nprobe=8, mask=None):
+        """
+        The aim of this method is to find the k most similar rows per query within the nprobe clusters closest to
+        the query. The inverted file is built on first use.
+        :param queries: float32 matrix of shape (no_of_queries, descriptor_dim)
+        :param k: number of neighbours
+        :param nprobe: number of searched clusters per query
+        :param mask: optional bool array selecting the candidate rows
+        :return: tuple of the neighbour rows and similarities of shape (no_of_queries, k), missing neighbours have
+        row -1
+        """
+        if self.centroids is None:
+            self.build_ivf()
+
+        nprobe = min(nprobe, len(self.centroids))
+        probes = top_k(queries @ self.centroids.T, np.broadcast_to(np.arange(len(self.centroids)),
+                                                                   (len(queries), len(self.centroids))), nprobe)[0]
+        best_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        best_similarities = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        # the queries are grouped by probed cluster, so every cluster is compared with all of its queries at once
+        probed_lists = probes.ravel()
+        order = np.argsort(probed_lists, kind='stable')
+        list_ids, first_positions = np.unique(probed_lists[order], return_index=True)
+        query_ids_per_list = np.split(np.repeat(np.arange(len(queries)), probes.shape[1])[order], first_positions[1:])
+        for list_id, query_ids in zip(list_ids, query_ids_per_list):
+            rows = self.list_rows[self.list_offsets[list_id]:self.list_offsets[list_id + 1]]
+            if mask is not None:
+                rows = rows[mask[rows]]
+            for start in range(0, len(rows), self.chunk_size):
+                chunk_rows = rows[start:start + self.chunk_size]
+                similarities = queries[query_ids] @ self.dense(chunk_rows).T
+                best_rows[query_ids], best_similarities[query_ids] = top_k(
+                    np.concatenate([best_similarities[query_ids], similarities], axis=1),
+                    np.concatenate([best_rows[query_ids], np.broadcast_to(chunk_rows, similarities.shape)], axis=1),
+                    k)
+
+        return best_rows, best_similarities
+
+    def query(self, queries, k=10, exact=True, nprobe=8, mask=None):
+        """
+        The aim of this method is to answer a batch of top-k queries.
+        :param queries: descriptors of shape (no_of_queries, descriptor_dim), see frame_descriptor
+        :param k: number of neighbours
+        :param exact: if True all candidates are compared, otherwise the inverted file is used
+        :param nprobe: number of searched clusters per query of the approximate search
+        :param mask: optional bool array selecting the candidate rows
+        :return: tuple of the neighbour rows and similarities of shape (no_of_queries, k), most similar first
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.descriptors.shape[1])
+        with stage('frame_index_query', items=len(queries)):
+            if exact:
+                return self.exact_search(queries, k, None if mask is None else np.flatnonzero(mask))
+            return self.approximate_search(queries, k, nprobe, mask)
+
+
+def ground_truth_labels(index, screentime_indices):
+    """
+    The aim of this method is to look up the ground truth labels of the indexed frames.
+    :param index: the FrameIndex
+    :param screentime_indices: dict mapping the file ids to the ScreenTimeIndex of the episode
+    :return: tuple of a bool array marking the labeled rows and a bool label matrix of shape (no_of_rows,
+    no_of_classes)
+    """
+    no_of_classes = next(iter(screentime_indices.values())).labels.shape[1]
+    labeled = np.zeros(len(index), dtype=bool)
+    labels = np.zeros((len(index), no_of_classes), dtype=bool)
+    for file_id, screentime_index in screentime_indices.items():
+        rows = index.rows_of(file_id, screentime_index.frame_ids)
+        labeled[rows[rows >= 0]] = True
+        labels[rows[rows >= 0]] = screentime_index.labels[rows >= 0]
+
+    return labeled, labels
+
+
+def propagate_labels(index, labeled, labels, k=10, exact=False, nprobe=8, batch_size=1024):
+    """
+    The aim of this method is to propagate labels to all indexed frames by a vote of their k most similar labeled
+    frames. The votes can be used as soft labels or classified with a threshold.
+    :param index: the FrameIndex
+    :param labeled: bool array marking the labeled rows
+    :param labels: bool label matrix of shape (no_of_rows, no_of_classes)
+    :param k: number of voting neighbours
+    :param exact: if True all labeled frames are compared, otherwise the inverted file is used
+    :param nprobe: number of searched clusters per query of the approximate search
+    :param batch_size: number of frames queried at once
+    :return: float32 matrix of shape (no_of_rows, no_of_classes) holding the ratio of neighbours per class,
+    labeled frames keep their labels
+    """
+    votes = labels.astype(np.float32)
+    unlabeled_rows = np.flatnonzero(~labeled)
+    for start in range(0, len(unlabeled_rows), batch_size):
+        rows = unlabeled_rows[start:start + batch_size]
+        neighbours, _ = index.query(index.dense(rows), k, exact, nprobe, mask=labeled)
+        found = neighbours >= 0
+        votes[rows] = (labels[np.maximum(neighbours, 0)] * found[:, :, None]).sum(axis=1) / \
+            np.maximum(found.sum(axis=1), 1)[:, None]
+
+    return votes
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import shutil
+import cv2
+from pathlib import Path
+from feature_cache import file_fingerprint
+from frame_extractor import extract_videos_parallel, iter_frames
+from profiling import stage
+
+frame_store_path = '../../ground_truth/frames/'
+frame_manifest_filename = 'frames.json'
+frame_manifest_columns = ['file_id', 'frame_id', 'label', 'frame']
+
+
+def object_filename(store_path, frame_hash):
+    return '%sobjects/%s/%s.jpg' % (store_path, frame_hash[:2], frame_hash)
+
+
+def refs_filename(store_path, video_path):
+    return '%srefs/%s.json' % (store_path, os.path.basename(video_path))
+
+
+def load_refs(store_path, video_path):
+    """
+    The aim of this method is to load the stored frames of a video. The references are discarded if the video
+    changed, and references whose image was deleted from the store are dropped.
+    :param store_path: directory of the frame store
+    :param video_path: path of the video
+    :return: dict mapping frame ids to the hashes of their images
+    """
+    try:
+        with open(refs_filename(store_path, video_path), 'r') as f:
+            refs = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if refs['video'] != file_fingerprint(video_path):
+        print('[INFO] Video changed, decode all frames again: %s' % video_path)
+        return {}
+    return {int(frame_id): frame_hash for frame_id, frame_hash in refs['frames'].items()
+            if os.path.isfile(object_filename(store_path, frame_hash))}
+
+
+def save_refs(store_path, video_path, frames):
+    refs_file = refs_filename(store_path, video_path)
+    Path(refs_file).parent.mkdir(parents=True, exist_ok=True)
+    with open(refs_file + '.tmp', 'w') as f:
+        json.dump({'video': file_fingerprint(video_path),
+                   'frames': {str(frame_id): frames[frame_id] for frame_id in sorted(frames)}}, f)
+    os.replace(refs_file + '.tmp', refs_file)
+
+
+def store_frames(video_path, frame_ids, store_path):
+    """
+    The aim of this method is to decode the given frames of a single video once and add them to the frame store.
+    Every frame is encoded as jpeg and stored under the sha1 hash of the encoded image, so identical images are
+    stored only once.
+    :param video_path: path of the video
+    :param frame_ids: iterable of frame ids
+    :param store_path: directory of the frame store
+    :return: dict mapping the frame ids to the hashes of their images
+    """
+    frames = {}
+    print('[INFO] Start decoding %d frames of video %s' % (len(frame_ids), video_path))
+    for frame_id, frame in iter_frames(video_path, frame_ids):
+        with stage('store_frames', items=1) as counters:
+            ret, buffer = cv2.imencode('.jpg', frame)
+            if not ret:
+                raise IOError('Failed to encode frame %d of video %r.' % (frame_id, video_path))
+            image = buffer.tobytes()
+            frame_hash = hashlib.sha1(image).hexdigest()
+
+            filename = object_filename(store_path, frame_hash)
+            if not os.path.isfile(filename):
+                Path(filename).parent.mkdir(parents=True, exist_ok=True)
+                # workers of different videos can store the same image, the rename keeps the object complete
+                with open(filename + '.%d.tmp' % os.getpid(), 'wb') as f:
+                    f.write(image)
+                os.replace(filename + '.%d.tmp' % os.getpid(), filename)
+                counters['bytes_written'] = len(image)
+            frames[frame_id] = frame_hash
+
+    return frames
+
+
+def add_frames(frame_ids_per_video, store_path=frame_store_path, max_workers=1):
+    """
+    The aim of this method is to make sure the requested frames are in the frame store. Only frames that are not
+    stored yet are decoded, every video at most once.
+    :param frame_ids_per_video: dict mapping video paths to iterables of frame ids
+    :param store_path: directory of the frame store
+    :param max_workers: number of videos decoded in parallel, 1 decodes all videos in this process
+    :return: dict mapping the video paths to dicts of the requested frame ids and the hashes of their images
+    """
+    refs = {video_path: load_refs(store_path, video_path) for video_path in frame_ids_per_video}
+    missing_frame_ids = {}
+    for video_path, frame_ids in frame_ids_per_video.items():
+        missing = sorted(set(int(frame_id) for frame_id in frame_ids) - set(refs[video_path]))
+        if len(missing) > 0:
+            missing_frame_ids[video_path] = missing
+    print('[INFO] %d of %d requested frames are not stored yet' %
+          (sum(len(frame_ids) for frame_ids in missing_frame_ids.values()),
+           sum(len(set(frame_ids)) for frame_ids in frame_ids_per_video.values())))
+
+    if max_workers > 1:
+        stored = extract_videos_parallel(missing_frame_ids, max_workers, store_frames, (store_path,))
+    else:
+        stored = {video_path: store_frames(video_path, frame_ids, store_path)
+                  for video_path, frame_ids in missing_frame_ids.items()}
+
+    for video_path, frames in stored.items():
+        refs[video_path].update(frames)
+        save_refs(store_path, video_path, refs[video_path])
+
+    return {video_path: {int(frame_id): refs[video_path][int(frame_id)] for frame_id in frame_ids}
+            for video_path, frame_ids in frame_ids_per_video.items()}
+
+
+def write_frame_manifest(output_path, samples, store_path=frame_store_path):
+    """
+    The aim of this method is to write the manifest of a dataset that references the images in the frame store.
+    :param output_path: directory of the dataset
+    :param samples: list of (file id, frame id, label, frame hash) tuples
+    :param store_path: directory of the frame store
+    """
+    manifest_file = Path(output_path) / frame_manifest_filename
+    with open(str(manifest_file) + '.tmp', 'w') as f:
+        json.dump({'store': os.path.relpath(store_path, output_path), 'columns': frame_manifest_columns,
+                   'samples': [list(sample) for sample in samples]}, f)
+    os.replace(str(manifest_file) + '.tmp', str(manifest_file))
+
+
+def load_frame_manifest(output_path):
+    """
+    :param output_path: directory of the dataset
+    :return: tuple of the list of (file id, frame id, label, image filename in the store) tuples and the store path
+    """
+    with open(str(Path(output_path) / frame_manifest_filename), 'r') as f:
+        manifest = json.load(f)
+
+    store_path = os.path.join(output_path, manifest['store'], '')
+    return [(file_id, frame_id, label, object_filename(store_path, frame_hash))
+            for file_id, frame_id, label, frame_hash in manifest['samples']], store_path
+
+
+def link_image(store_path, frame_hash, filename):
+    """
+    The aim of this method is to make an image of the frame store available under a dataset filename. A hard link is
+    used, so the image is stored once on disk, the image is copied if the file system does not support it.
+    :return: True if the file was created, False if it already referenced the image
+    """
+    source = object_filename(store_path, frame_hash)
+    if os.path.isfile(filename):
+        if os.path.samefile(source, filename):
+            return False
+        os.remove(filename)
+
+    try:
+        os.link(source, filename)
+    except OSError:
+        shutil.copyfile(source, filename)
+    return True
@@ -1,23 +1,24 @@
-import cv2
 from pathlib import Path
+from frame_extractor import add_frame_request, extract_frames_to_files
 
 
 def extract_ground_truth_images(ground_truth_textfile, video_path, image_path):
-    cap = cv2.VideoCapture(video_path)
     Path(image_path).mkdir(parents=True, exist_ok=True)
 
+    # collect all labeled frames first, so the video is decoded in a single pass
+    frame_files = {}
     with open(ground_truth_textfile, 'r') as f:
         for line in f:
             entries = line.split(', ')
-            cap.set(cv2.CAP_PROP_POS_FRAMES, int(entries[0]))
-            ret, frame = cap.read()
-            if not ret:
-                print('Failed to read frame %d of video %r.', entries[0], movie_path)
-                exit(1)
-
             filename = image_path + '/' + str(entries[0]) + '_' + \
                        '_'.join([str(label).rstrip() for label in entries[1:]]) + '.jpg'
-            cv2.imwrite(filename, frame)
+            add_frame_request(frame_files, video_path, int(entries[0]), filename)
+
+    try:
+        extract_frames_to_files(video_path, frame_files.get(video_path, {}))
+    except IOError as e:
+        print(e)
+        exit(1)
 
 
 if __name__ == '__main__':
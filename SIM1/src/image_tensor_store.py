@@ -0,0 +1,97 @@
+import json
+import cv2
+import numpy as np
+from pathlib import Path
+from frame_extractor import iter_frames
+from profiling import stage
+
+header_filename = 'header.json'
+images_filename = 'images.npy'
+metadata_filename = 'metadata.npy'
+metadata_columns = ['file_id', 'frame_id', 'label']
+
+
+def create_image_tensor_store(store_path, metadata, image_size=(224, 224)):
+    """
+    The aim of this method is to create an image tensor store, i.e. one uint8 tensor file of shape
+    (no_of_images, height, width, 3) holding resized frames and a parallel int32 metadata array with one
+    (file_id, frame_id, label) row per image. The images are filled in afterwards, see extract_frames_to_tensor_store.
+    :param store_path: directory of the store
+    :param metadata: array of shape (no_of_images, 3) holding file id, frame id and label per image
+    :param image_size: (height, width) of the stored images
+    """
+    Path(store_path).mkdir(parents=True, exist_ok=True)
+    metadata = np.asarray(metadata, dtype=np.int32).reshape(-1, len(metadata_columns))
+
+    images = np.lib.format.open_memmap(str(Path(store_path) / images_filename), mode='w+', dtype=np.uint8,
+                                       shape=(len(metadata), image_size[0], image_size[1], 3))
+    del images
+    np.save(str(Path(store_path) / metadata_filename), metadata)
+    with open(str(Path(store_path) / header_filename), 'w') as f:
+        json.dump({'no_of_images': len(metadata),
+                   'image_size': list(image_size),
+                   'metadata_columns': metadata_columns,
+                   'color_order': 'bgr'}, f, indent=2)
+
+
+def extract_frames_to_tensor_store(video_path, frame_rows, store_path):
+    """
+    The aim of this method is to decode the requested frames of a single video once and write them resized into
+    the rows of an image tensor store. Workers of different videos can fill the same store, since the rows do not
+    overlap.
+    :param video_path: path of the video
+    :param frame_rows: dict mapping frame ids to lists of store rows
+    :param store_path: directory of the store
+    """
+    images = np.load(str(Path(store_path) / images_filename), mmap_mode='r+')
+    height, width = images.shape[1:3]
+
+    print('[INFO] Start decoding %d frames of video %s' % (len(frame_rows), video_path))
+    for frame_id, frame in iter_frames(video_path, frame_rows.keys()):
+        with stage('write_tensor_rows', items=len(frame_rows[frame_id])) as counters:
+            resized_frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+            for row in frame_rows[frame_id]:
+                images[row] = resized_frame
+            counters['bytes_written'] = resized_frame.nbytes * len(frame_rows[frame_id])
+
+    images.flush()
+    del images
+
+
+def load_image_tensor_store(store_path, mmap_mode='r'):
+    """
+    The aim of this method is to load an image tensor store memory-mapped.
+    :param store_path: directory of the store
+    :param mmap_mode: mmap_mode passed to np.load, None reads the images into memory
+    :return: dict holding the header, the images and the metadata
+    """
+    with open(str(Path(store_path) / header_filename), 'r') as f:
+        store = {'header': json.load(f)}
+
+    store['images'] = np.load(str(Path(store_path) / images_filename), mmap_mode=mmap_mode)
+    store['metadata'] = np.load(str(Path(store_path) / metadata_filename))
+    return store
+
+
+def iter_image_batches(store_path, batch_size=32, rows=None):
+    """
+    The aim of this method is to iterate over batches of an image tensor store. Without rows the batches are slices
+    of the memory-mapped tensor, so nothing is copied until the images are accessed. Selected rows are gathered
+    per batch in ascending order, so the tensor file is read sequentially.
+    :param store_path: directory of the store
+    :param batch_size: number of images per batch
+    :param rows: optional array of rows, e.g. of a train split
+    :return: generator yielding (images, metadata) tuples
+    """
+    store = load_image_tensor_store(store_path)
+    images = store['images']
+    metadata = store['metadata']
+
+    if rows is None:
+        for start in range(0, len(images), batch_size):
+            yield images[start:start + batch_size], metadata[start:start + batch_size]
+    else:
+        rows = np.asarray(rows)
+        for start in range(0, len(rows), batch_size):
+            batch_rows = np.sort(rows[start:start + batch_size])
+            yield images[batch_rows], metadata[batch_rows]
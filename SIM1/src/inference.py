@@ -0,0 +1,299 @@
+import os
+import time
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from audio_buffer import load_episode_audio
+from frame_extractor import iter_frames
+from mfcc_extractor import samples_mfccs
+from profiling import stage
+from shot_index import ShotIndex
+from timebase import TimeBase
+
+# inference runs on cpu only, this has to be set before tensorflow is imported
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+
+pig_model_path = 'pig-model-1/'
+swedish_chef_model_path = 'swedish-chef-model-1/'
+inference_output_path = '../../ground_truth/inference/'
+pig_class_id = 2
+swedish_chef_class_id = 3
+none_class_id = 4
+mfcc_frame_length_ms = 20
+mfcc_sequence_length = 50
+
+
+def load_tensorflow(n_threads):
+    """
+    The aim of this method is to import tensorflow restricted to the cpu and the given thread budget.
+    :param n_threads: number of threads tensorflow may use within and across operations
+    :return: the tensorflow module
+    """
+    import tensorflow as tf
+
+    try:
+        tf.config.set_visible_devices([], 'GPU')
+        tf.config.threading.set_intra_op_parallelism_threads(n_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(max(1, n_threads // 2))
+    except RuntimeError:
+        # tensorflow is initialized already, e.g. by a model loaded before, and keeps its configuration
+        pass
+    return tf
+
+
+def load_image_model(model_path, n_threads=4):
+    """
+    The aim of this method is to load a CNN for predict_video_frames, which only uses input_shape and predict_on_batch
+    of the model.
+    :param model_path: path of a keras SavedModel, of a TFLite model (.tflite, see model_export) or address of an
+    inference server (http://<host>:<port> or unix:<socket path>, see inference_server)
+    :param n_threads: cpu thread budget of the model
+    :return: the loaded model
+    """
+    if model_path.startswith(('http://', 'unix:')):
+        from inference_server import InferenceClient
+        return InferenceClient(model_path)
+    if model_path.endswith('.tflite'):
+        from model_export import TFLiteModel
+        return TFLiteModel(model_path, n_threads)
+    return load_tensorflow(n_threads).keras.models.load_model(model_path)
+
+
+def positive_probabilities(predictions):
+    """
+    :param predictions: model output of shape (batch,) or (batch, 1) for sigmoid or (batch, 2) for softmax outputs
+    :return: probability of the positive class per sample
+    """
+    predictions = np.asarray(predictions).reshape(len(predictions), -1)
+    return predictions[:, 0] if predictions.shape[1] == 1 else predictions[:, 1]
+
+
+def batched(iterable, batch_size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def preprocess_frame(frame, image_size):
+    """
+    The aim of this method is to convert a decoded bgr frame to the input of the CNN, i.e. a rgb image of the model
+    input size scaled to [0, 1].
+    :param frame: the decoded frame
+    :param image_size: (height, width) of the model input
+    :return: float32 array of shape (height, width, 3)
+    """
+    resized_frame = cv2.resize(frame, (image_size[1], image_size[0]), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(resized_frame, cv2.COLOR_BGR2RGB).astype(np.float32) / 255.0
+
+
+def iter_decodable_frames(video_path, frame_ids):
+    """
+    The aim of this method is to decode the given frames like iter_frames, but to end at the last decodable frame
+    instead of failing, since the frame count of a container is only an estimate.
+    :param video_path: path of the video
+    :param frame_ids: the frame ids to decode
+    :return: generator of (frame id, frame) tuples
+    """
+    last_frame_id = -1
+    try:
+        for last_frame_id, frame in iter_frames(video_path, frame_ids):
+            yield last_frame_id, frame
+    except IOError as e:
+        print('[INFO] %s, the prediction ends at frame %d' % (e, last_frame_id))
+
+
+def predict_video_frames(model, video_path, frame_ids, batch_size=32):
+    """
+    The aim of this method is to run the CNN over the given frames of a video, which is decoded only once. Frames
+    after the last decodable frame are not predicted.
+    :param model: the loaded keras model
+    :param video_path: path of the video
+    :param frame_ids: the frame ids to predict
+    :param batch_size: number of frames per model call
+    :return: tuple of the predicted frame ids and the positive probability per frame
+    """
+    image_size = model.input_shape[1:3]
+    predicted_frame_ids = []
+    probabilities = []
+    for batch in batched(iter_decodable_frames(video_path, frame_ids), batch_size):
+        with stage('preprocess_frames', items=len(batch)):
+            images = np.stack([preprocess_frame(frame, image_size) for _, frame in batch])
+        with stage('predict_frames', items=len(batch)):
+            probabilities.append(positive_probabilities(model.predict_on_batch(images)))
+        predicted_frame_ids.extend([frame_id for frame_id, _ in batch])
+
+    return np.asarray(predicted_frame_ids, dtype=np.int64), np.concatenate(probabilities + [np.empty(0)])
+
+
+def predict_representative_frames(model, video_path, frame_ids, shot_index, batch_size=32):
+    """
+    The aim of this method is to run the CNN only over the representative frames of the segments of near duplicate
+    frames the given frames belong to and to propagate the probabilities to all frames of a segment.
+    :param model: the loaded keras model
+    :param video_path: path of the video
+    :param frame_ids: the frame ids to predict
+    :param shot_index: the ShotIndex of the video
+    :param batch_size: number of frames per model call
+    :return: tuple of the predicted frame ids, the positive probability per frame and the number of CNN predictions
+    """
+    frame_ids = np.asarray(frame_ids, dtype=np.int64)
+    frame_ids = frame_ids[shot_index.covers(frame_ids)]
+    representative_frame_ids, inverse = shot_index.representative_frames(frame_ids)
+    predicted_representatives, probabilities = predict_video_frames(model, video_path, representative_frame_ids,
+                                                                    batch_size)
+
+    # representatives that could not be decoded are missing in the predictions
+    positions = np.minimum(np.searchsorted(predicted_representatives, representative_frame_ids[inverse]),
+                           max(len(predicted_representatives) - 1, 0))
+    predicted = predicted_representatives[positions] == representative_frame_ids[inverse] \
+        if len(predicted_representatives) else np.zeros(len(frame_ids), dtype=bool)
+    return frame_ids[predicted], probabilities[positions[predicted]], len(predicted_representatives)
+
+
+def predict_audio_sequences(model, samples, sample_rate, frame_length_ms=mfcc_frame_length_ms, n_mfcc=20,
+                            mfcc_sequence_len=mfcc_sequence_length, batch_size=256):
+    """
+    The aim of this method is to run the RNN over windowed MFCC sequences of a whole episode. The features are
+    extracted the same way as for the training data (see random_sample_multi_mfcc), the last incomplete sequence
+    is dropped.
+    :param model: the loaded keras model
+    :param samples: float32 samples of the episode audio
+    :param sample_rate: sample rate of the samples, the models are trained on 22050 Hz
+    :param frame_length_ms: window size of the MFCC frames in milliseconds
+    :param n_mfcc: number of MFCC features
+    :param mfcc_sequence_len: number of MFCC frames per sequence
+    :param batch_size: number of sequences per model call
+    :return: positive probability per sequence, sequence i covers the MFCC rows [i * mfcc_sequence_len,
+    (i + 1) * mfcc_sequence_len)
+    """
+    mfccs = samples_mfccs(samples, sample_rate, frame_length_ms, n_mfcc)
+
+    no_of_sequences = len(mfccs) // mfcc_sequence_len
+    sequences = mfccs[:no_of_sequences * mfcc_sequence_len].reshape(no_of_sequences, mfcc_sequence_len, n_mfcc)
+    with stage('predict_audio_sequences', items=no_of_sequences):
+        probabilities = [positive_probabilities(model.predict_on_batch(sequences[i:i + batch_size]))
+                         for i in range(0, no_of_sequences, batch_size)]
+
+    return np.concatenate(probabilities + [np.empty(0)])
+
+
+def load_audio(video_path, audio_file=None, sample_rate=22050):
+    """
+    :param video_path: path of the video
+    :param audio_file: path of an audio file of the video, if None the audio track of the video is decoded
+    :param sample_rate: sample rate the audio is resampled to
+    :return: tuple of the float32 samples and the sample rate
+    """
+    if audio_file is not None:
+        import librosa
+        return librosa.load(audio_file, sr=sample_rate)
+    return load_episode_audio(video_path, sample_rate)
+
+
+def sequence_probabilities_per_frame(frame_ids, timebase, probabilities, mfcc_sequence_len=mfcc_sequence_length):
+    """
+    The aim of this method is to assign every video frame the probability of the audio sequence its first sample
+    lies in. Frames after the last sequence get a probability of 0.
+    :param frame_ids: the predicted frame ids
+    :param timebase: TimeBase of the video and the audio the MFCCs were computed from
+    :param probabilities: positive probability per sequence, see predict_audio_sequences
+    :param mfcc_sequence_len: number of MFCC frames per sequence
+    :return: probability per frame
+    """
+    idx = timebase.frames_to_mfcc_rows(frame_ids) // mfcc_sequence_len
+    valid = idx < len(probabilities)
+    frame_probabilities = np.zeros(len(frame_ids))
+    frame_probabilities[valid] = probabilities[idx[valid]]
+    return frame_probabilities
+
+
+def write_predictions(output_file, frame_ids, class_probabilities, threshold=0.5):
+    """
+    The aim of this method is to write per-frame predictions in the layout of the ground truth text files.
+    Frames without any predicted character are labeled as none.
+    :param output_file: path of the output text file
+    :param frame_ids: the predicted frame ids
+    :param class_probabilities: dict mapping class ids to the probability per frame
+    :param threshold: minimum probability of a predicted class
+    """
+    Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+    class_ids = sorted(class_probabilities.keys())
+    predictions = np.stack([class_probabilities[class_id] >= threshold for class_id in class_ids], axis=1) \
+        if class_ids else np.zeros((len(frame_ids), 0), dtype=bool)
+
+    with open(output_file, 'w') as f:
+        for frame_id, prediction in zip(frame_ids, predictions):
+            labels = [str(class_ids[i]) for i in np.flatnonzero(prediction)] or [str(none_class_id)]
+            f.write('%d, %s\n' % (frame_id, ', '.join(labels)))
+
+
+def label_episode(video_path, output_file, audio_file=None, batch_size=32, frame_stride=12, first_frame_id=1,
+                  n_threads=4, threshold=0.5, pig_model=pig_model_path, swedish_chef_model=swedish_chef_model_path,
+                  audio_from_video=False, sample_rate=22050, skip_duplicates=False, shot_params=None):
+    """
+    The aim of this method is to label a whole episode with the trained models. The video is decoded once and
+    batched into the pig CNN, while the swedish chef RNN runs on the episode audio in parallel.
+    :param video_path: path of the video
+    :param output_file: path of the text file the predictions are written to
+    :param audio_file: path of the episode audio, if None and audio_from_video is False the swedish chef is not
+    predicted
+    :param batch_size: number of frames per CNN call
+    :param frame_stride: step size between the predicted frames
+    :param first_frame_id: the first predicted frame, 1 matches the ground truth files
+    :param n_threads: cpu thread budget of tensorflow
+    :param threshold: minimum probability of a predicted class
+    :param pig_model: path of the pig model, a TFLite model or an inference server address, see load_image_model
+    :param swedish_chef_model: path of the swedish chef model
+    :param audio_from_video: if True the audio track of the video is decoded into the audio cache and used instead
+    of an audio file
+    :param sample_rate: sample rate the audio is resampled to
+    :param skip_duplicates: if True only the representative frame of every segment of near duplicate frames (see
+    shot_index) is predicted by the CNN and its probability is used for all frames of the segment
+    :param shot_params: optional dict overriding shot_index.default_shot_params, e.g. the duplicate_threshold
+    :return: dict holding the number of predicted frames, the number of CNN predictions, the runtime and the frames
+    per second
+    """
+    start = time.perf_counter()
+
+    timebase = TimeBase.from_video(video_path, sample_rate, mfcc_frame_length_ms)
+    frame_ids = list(range(first_frame_id, timebase.no_of_frames, frame_stride))
+    print('[INFO] Start labeling %d frames of video %s' % (len(frame_ids), video_path))
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        audio_future = None
+        if audio_file is not None or audio_from_video:
+            audio_model = load_tensorflow(n_threads).keras.models.load_model(swedish_chef_model)
+            audio_future = executor.submit(lambda: predict_audio_sequences(
+                audio_model, *load_audio(video_path, audio_file, sample_rate)))
+        if skip_duplicates:
+            predicted_frame_ids, pig_probabilities, no_of_predictions = predict_representative_frames(
+                load_image_model(pig_model, n_threads), video_path, frame_ids,
+                ShotIndex.from_video(video_path, shot_params), batch_size)
+        else:
+            predicted_frame_ids, pig_probabilities = predict_video_frames(load_image_model(pig_model, n_threads),
+                                                                          video_path, frame_ids, batch_size)
+            no_of_predictions = len(predicted_frame_ids)
+        class_probabilities = {pig_class_id: pig_probabilities}
+        if audio_future is not None:
+            class_probabilities[swedish_chef_class_id] = sequence_probabilities_per_frame(
+                predicted_frame_ids, timebase, audio_future.result())
+
+    write_predictions(output_file, predicted_frame_ids, class_probabilities, threshold)
+
+    seconds = time.perf_counter() - start
+    print('[INFO] Labeled %d frames with %d CNN predictions in %.1f s (%.1f frames/s)' %
+          (len(predicted_frame_ids), no_of_predictions, seconds, len(predicted_frame_ids) / seconds))
+    return {'frames': len(predicted_frame_ids), 'predictions': no_of_predictions, 'seconds': seconds,
+            'fps': len(predicted_frame_ids) / seconds}
+
+
+if __name__ == '__main__':
+    test_video_path = '../../videos/Muppets-02-01-01.avi'
+    test_output_file = inference_output_path + 'Muppets-02-01-01.txt'
+    label_episode(test_video_path, test_output_file, audio_from_video=True)
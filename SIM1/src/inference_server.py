@@ -0,0 +1,322 @@
+import http.client
+import json
+import os
+import socket
+import stat
+import threading
+import time
+import cv2
+import numpy as np
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty, Queue
+from socketserver import ThreadingMixIn, UnixStreamServer
+from inference import load_image_model, pig_model_path, positive_probabilities, preprocess_frame
+from profiling import stage
+
+default_server_address = 'http://127.0.0.1:8470'
+# pending connections of the listening socket, the socketserver default of 5 refuses bursts of unix socket clients
+server_backlog = 128
+
+
+def parse_address(address):
+    """
+    :param address: http://<host>:<port> or unix:<socket path>
+    :return: tuple of 'unix' and the socket path or 'tcp' and the (host, port) tuple
+    """
+    if address.startswith('unix:'):
+        return 'unix', address[len('unix:'):]
+    if address.startswith('http://'):
+        host, _, port = address[len('http://'):].rstrip('/').rpartition(':')
+        return 'tcp', (host, int(port))
+    raise ValueError('Unknown server address %r, use http://<host>:<port> or unix:<socket path>' % address)
+
+
+class MicroBatcher:
+    """
+    Combines concurrent prediction requests into batches of the model. A batch is predicted as soon as it is full or
+    its oldest request waited max_wait_ms, all predictions run in a single model thread.
+    """
+
+    def __init__(self, model, max_batch_size=32, max_wait_ms=5):
+        """
+        :param model: model with the interface of a keras model, see inference.load_image_model
+        :param max_batch_size: maximum number of images per model call, larger requests are predicted on their own
+        :param max_wait_ms: maximum time a request waits for further requests of its batch
+        """
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.requests = Queue()
+        self.stopped = False
+        self.no_of_batches = 0
+        self.no_of_images = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, images):
+        """
+        :param images: float32 array of shape (no_of_images, height, width, 3), see inference.preprocess_frame
+        :return: Future of the positive probabilities of the images
+        """
+        future = Future()
+        if self.stopped:
+            future.set_exception(RuntimeError('The micro batcher is stopped.'))
+        else:
+            self.requests.put((np.asarray(images, dtype=np.float32), future, time.perf_counter()))
+        return future
+
+    def predict(self, images, timeout=None):
+        return self.submit(images).result(timeout)
+
+    def run(self):
+        request = self.requests.get()
+        while request is not None:
+            batch = [request]
+            size = len(request[0])
+            deadline = request[2] + self.max_wait
+            carried = False
+            while size < self.max_batch_size:
+                try:
+                    request = self.requests.get(timeout=max(0.0, deadline - time.perf_counter()))
+                except Empty:
+                    break
+                if request is None or size + len(request[0]) > self.max_batch_size:
+                    # the request starts the next batch, the stop request stops after this batch
+                    carried = True
+                    break
+                batch.append(request)
+                size += len(request[0])
+
+            self.predict_batch(batch)
+            if not carried:
+                request = self.requests.get()
+
+    def predict_batch(self, batch):
+        images = np.concatenate([images for images, _, _ in batch])
+        try:
+            with stage('serve_batch', items=len(images)):
+                probabilities = positive_probabilities(self.model.predict_on_batch(images))
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        self.no_of_batches += 1
+        self.no_of_images += len(images)
+        start = 0
+        for request_images, future, _ in batch:
+            future.set_result(probabilities[start:start + len(request_images)])
+            start += len(request_images)
+
+    def info(self):
+        return {'input_shape': list(self.model.input_shape[1:]), 'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000, 'batches': self.no_of_batches, 'images': self.no_of_images,
+                'mean_batch_size': self.no_of_images / max(1, self.no_of_batches)}
+
+    def stop(self):
+        self.stopped = True
+        self.requests.put(None)
+        self.thread.join()
+        # requests submitted while stopping are not predicted anymore
+        while not self.requests.empty():
+            request = self.requests.get()
+            if request is not None:
+                request[1].set_exception(RuntimeError('The micro batcher is stopped.'))
+
+
+class InferenceRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET /info returns the model input shape and the batching statistics. POST /predict returns the positive
+    probabilities of the images in the body, which is either an encoded image (Content-Type image/...) or the raw
+    uint8 rgb pixels of one or several images of the model input shape (Content-Type application/octet-stream).
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path != '/info':
+            self.send_json(404, {'error': 'Unknown path %s' % self.path})
+            return
+        self.send_json(200, self.server.batcher.info())
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path != '/predict':
+            self.send_json(404, {'error': 'Unknown path %s' % self.path})
+            return
+
+        try:
+            images = self.decode_images(body)
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        try:
+            probabilities = self.server.batcher.predict(images)
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+            return
+        self.send_json(200, {'probabilities': probabilities.tolist()})
+
+    def decode_images(self, body):
+        image_shape = tuple(self.server.batcher.model.input_shape[1:])
+        if self.headers.get('Content-Type', '').startswith('image/'):
+            frame = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if frame is None:
+                raise ValueError('The image can not be decoded.')
+            return preprocess_frame(frame, image_shape[:2])[np.newaxis]
+
+        image_bytes = int(np.prod(image_shape))
+        if len(body) == 0 or len(body) % image_bytes != 0:
+            raise ValueError('The body of %d bytes is no batch of uint8 images of shape %s.' % (len(body),
+                                                                                                 image_shape))
+        pixels = np.frombuffer(body, dtype=np.uint8).reshape((-1,) + image_shape)
+        return pixels.astype(np.float32) / 255.0
+
+    def send_json(self, status, content):
+        data = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # a line per frame would flood the output, the batcher counts the requests
+        pass
+
+
+class UnixInferenceServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = server_backlog
+
+
+class TCPInferenceServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = server_backlog
+
+
+def create_server(model, address=default_server_address, max_batch_size=32, max_wait_ms=5):
+    """
+    The aim of this method is to create an inference server for a loaded model, the caller runs serve_forever.
+    :param model: the loaded model, see inference.load_image_model
+    :param address: http://<host>:<port> or unix:<socket path>
+    :param max_batch_size: maximum number of images per model call
+    :param max_wait_ms: maximum time a request waits for further requests of its batch
+    :return: the server, its micro batcher is the attribute batcher
+    """
+    kind, location = parse_address(address)
+    if kind == 'unix':
+        if os.path.exists(location):
+            if not stat.S_ISSOCK(os.stat(location).st_mode):
+                raise IOError('%r exists and is no socket.' % location)
+            # socket of a server that was not shut down cleanly
+            os.remove(location)
+        server = UnixInferenceServer(location, InferenceRequestHandler)
+    else:
+        server = TCPInferenceServer(location, InferenceRequestHandler)
+    server.batcher = MicroBatcher(model, max_batch_size, max_wait_ms)
+    return server
+
+
+def close_server(server):
+    server.server_close()
+    server.batcher.stop()
+    if isinstance(server, UnixInferenceServer) and os.path.exists(server.server_address):
+        os.remove(server.server_address)
+
+
+def serve(model_path=pig_model_path, address=default_server_address, max_batch_size=32, max_wait_ms=5, n_threads=4):
+    """
+    The aim of this method is to load a model once and serve it to several labeling and extraction processes until
+    the process is interrupted.
+    :param model_path: path of the SavedModel or of a TFLite model
+    :param address: http://<host>:<port> or unix:<socket path>
+    :param max_batch_size: maximum number of images per model call
+    :param max_wait_ms: maximum time a request waits for further requests of its batch
+    :param n_threads: cpu thread budget of the model
+    """
+    server = create_server(load_image_model(model_path, n_threads), address, max_batch_size, max_wait_ms)
+    print('[INFO] Serving %s on %s with batches of up to %d images' % (model_path, address, max_batch_size))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print('[INFO] Predicted %(images)d images in %(batches)d batches (%(mean_batch_size).1f images per batch)' %
+              server.batcher.info())
+        close_server(server)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, socket_path, timeout):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        # a unix socket with a full backlog refuses connections with EAGAIN instead of waiting like tcp
+        deadline = time.perf_counter() + (self.timeout if self.timeout is not None else 60)
+        while True:
+            try:
+                self.sock.connect(self.socket_path)
+                return
+            except BlockingIOError:
+                if time.perf_counter() > deadline:
+                    self.sock.close()
+                    raise
+                time.sleep(0.01)
+
+
+class InferenceClient:
+    """
+    Client of the inference server with the interface of a keras model used by inference, i.e. input_shape and
+    predict_on_batch, so a process uses the shared model instead of loading its own. A client keeps its connection
+    open and is not thread safe, every thread uses its own client.
+    """
+
+    def __init__(self, address=default_server_address, timeout=60):
+        kind, location = parse_address(address)
+        if kind == 'unix':
+            self.connection = UnixHTTPConnection(location, timeout)
+        else:
+            self.connection = http.client.HTTPConnection(*location, timeout=timeout)
+        self.input_shape = (None,) + tuple(self.request('GET', '/info')['input_shape'])
+
+    def request(self, method, path, body=None, headers=None):
+        self.connection.request(method, path, body, headers or {})
+        response = self.connection.getresponse()
+        content = json.loads(response.read())
+        if response.status != 200:
+            raise IOError('Inference server error %d: %s' % (response.status, content.get('error')))
+        return content
+
+    def predict_on_batch(self, images):
+        """
+        :param images: float32 array of shape (batch, height, width, 3) scaled to [0, 1], see
+        inference.preprocess_frame, it is sent as uint8 pixels
+        :return: float32 positive probability per image
+        """
+        pixels = np.clip(np.rint(np.asarray(images) * 255.0), 0, 255).astype(np.uint8)
+        content = self.request('POST', '/predict', pixels.tobytes(), {'Content-Type': 'application/octet-stream'})
+        return np.asarray(content['probabilities'], dtype=np.float32)
+
+    def predict_frame(self, frame):
+        """
+        :param frame: a decoded bgr frame of any size
+        :return: positive probability of the frame
+        """
+        return self.predict_on_batch(preprocess_frame(frame, self.input_shape[1:3])[np.newaxis])[0]
+
+    def predict_image_file(self, image_file):
+        with open(image_file, 'rb') as f:
+            content = self.request('POST', '/predict', f.read(), {'Content-Type': 'image/jpeg'})
+        return content['probabilities'][0]
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == '__main__':
+    serve(pig_model_path)
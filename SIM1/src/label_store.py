@@ -0,0 +1,199 @@
+import os
+import re
+import numpy as np
+from feature_cache import get_cached
+from profiling import file_size, stage
+
+character_map = {0: 'kermit_the_frog',
+                 1: 'waldorf_and_statler',
+                 2: 'pig',
+                 3: 'swedish_chef',
+                 4: 'none'}
+
+conversion_map = {'k': 0,
+                  'w': 1,
+                  'p': 2,
+                  's': 3,
+                  'n': 4}
+
+csv_label_pattern = re.compile(r"'(\w)':\s*(\d)")
+label_cache_path = '../../ground_truth/cache/labels/'
+
+
+def labels_to_bitmask(labels):
+    """
+    :param labels: bool matrix of shape (no_of_frames, no_of_classes)
+    :return: uint8 array holding bit i for class i
+    """
+    weights = (1 << np.arange(labels.shape[1])).astype(np.uint8)
+    return (labels.astype(np.uint8) * weights).sum(axis=1).astype(np.uint8)
+
+
+def bitmask_to_labels(bitmask, no_of_classes=len(character_map)):
+    """
+    :param bitmask: uint8 array holding bit i for class i
+    :param no_of_classes: number of classes
+    :return: bool matrix of shape (no_of_frames, no_of_classes)
+    """
+    return (np.asarray(bitmask, dtype=np.uint8)[:, None] >> np.arange(no_of_classes, dtype=np.uint8)) & 1 == 1
+
+
+def save_labels(label_file, frame_ids, labels, file_ids=None):
+    """
+    The aim of this method is to write labels in the compact binary format: a uint32 frame id array and a uint8
+    bitmask over the classes of character_map, optionally with a uint8 file id array for labels of several videos.
+    :param label_file: path of the .npz file
+    :param frame_ids: array of frame ids
+    :param labels: bool matrix of shape (no_of_frames, no_of_classes)
+    :param file_ids: optional array of file ids
+    """
+    columns = {'frame_ids': np.asarray(frame_ids, dtype=np.uint32),
+               'labels': labels_to_bitmask(np.asarray(labels, dtype=bool).reshape(len(frame_ids), -1))}
+    if file_ids is not None:
+        columns['file_ids'] = np.asarray(file_ids, dtype=np.uint8)
+
+    with open(label_file, 'wb') as f:
+        np.savez(f, **columns)
+
+
+def load_labels(label_file):
+    """
+    The aim of this method is to load labels written by save_labels.
+    :param label_file: path of the .npz file
+    :return: tuple of int64 frame ids, bool label matrix and the file ids or None
+    """
+    with np.load(label_file) as data:
+        file_ids = data['file_ids'].astype(np.int64) if 'file_ids' in data.files else None
+        return data['frame_ids'].astype(np.int64), bitmask_to_labels(data['labels']), file_ids
+
+
+def parse_ground_truth_textfile(ground_truth_textfile):
+    """
+    The aim of this method is to parse a ground truth text file (<frame_id>, <label>, ...) in a single pass. Lines
+    that do not start with a frame id, e.g. headers, are skipped. The ground truth text files have no header, so
+    their first line is a labeled frame, which the former screentime_per_class of audio_extractor dropped.
+    :param ground_truth_textfile: path of the ground truth text file
+    :return: tuple of the sorted frame ids and a bool matrix of shape (no_of_frames, no_of_classes) holding the labels
+    """
+    frame_ids = []
+    label_rows = []
+    label_ids = []
+    with stage('parse_labels', bytes_read=file_size(ground_truth_textfile)) as counters, \
+            open(ground_truth_textfile, 'r') as f:
+        for line in f:
+            parts = line.split(',')
+            if not parts[0].strip().isdigit():
+                continue
+            row = len(frame_ids)
+            frame_ids.append(int(parts[0]))
+            for part in parts[1:]:
+                label_rows.append(row)
+                label_ids.append(int(part))
+        counters['items'] = len(frame_ids)
+
+    labels = np.zeros((len(frame_ids), len(character_map)), dtype=bool)
+    labels[np.asarray(label_rows, dtype=np.int64), np.asarray(label_ids, dtype=np.int64)] = True
+    frame_ids = np.asarray(frame_ids, dtype=np.int64)
+
+    order = np.argsort(frame_ids, kind='stable')
+    return frame_ids[order], labels[order]
+
+
+def parse_labels_csv(csv_filename, step):
+    """
+    The aim of this method is to parse the labels.csv export of the labeling tool without evaluating the label dicts.
+    Image ids are mapped to frame ids as in the ground truth text files, csvToText converts with this method.
+    :param csv_filename: path of the csv file
+    :param step: step size between the labeled frames
+    :return: tuple of the frame ids and a bool matrix of shape (no_of_frames, no_of_classes) holding the labels
+    """
+    frame_ids = []
+    label_rows = []
+    with open(csv_filename, 'r') as f:
+        for i, line in enumerate(f):
+            if i == 0:
+                continue
+
+            id = int(line.split("\"")[0].split(',')[0])
+            if id == 0:
+                id = 1
+            elif id == 1:
+                id = id + step
+            else:
+                id = step * id + 1
+
+            label_row = np.zeros(len(character_map), dtype=bool)
+            for key, value in csv_label_pattern.findall(line.split('\"')[1]):
+                label_row[conversion_map[key]] = value == '1'
+            frame_ids.append(id)
+            label_rows.append(label_row)
+
+    labels = np.asarray(label_rows, dtype=bool).reshape(-1, len(character_map))
+    return np.asarray(frame_ids, dtype=np.int64), labels
+
+
+def parse_dataset_labels_txt(labels_filename):
+    """
+    The aim of this method is to parse a labels.txt file of an image dataset (<txt_file>, <frame_id>, <label>). Rows of
+    the same frame are merged.
+    :param labels_filename: path of the labels.txt file
+    :return: tuple of the frame ids, a bool matrix of shape (no_of_frames, no_of_classes) and the file ids
+    """
+    rows = []
+    with open(labels_filename, 'r') as f:
+        for i, line in enumerate(f):
+            if i == 0:
+                continue
+            rows.append([int(part) for part in line.split(',')])
+
+    rows = np.asarray(rows, dtype=np.int64).reshape(-1, 3)
+    keys, inverse = np.unique(rows[:, :2], axis=0, return_inverse=True)
+    labels = np.zeros((len(keys), len(character_map)), dtype=bool)
+    labels[inverse.reshape(-1), rows[:, 2]] = True
+    return keys[:, 1], labels, keys[:, 0]
+
+
+def write_ground_truth_textfile(ground_truth_textfile, frame_ids, labels):
+    """
+    The aim of this method is to write labels as ground truth text file (<frame_id>, <label>, ...), e.g. to convert
+    the labels.csv export of the labeling tool the same way as csvToText.
+    :param ground_truth_textfile: path of the ground truth text file
+    :param frame_ids: array of frame ids
+    :param labels: bool matrix of shape (no_of_frames, no_of_classes)
+    """
+    with open(ground_truth_textfile, 'w') as f:
+        for frame_id, label_row in zip(frame_ids, np.asarray(labels, dtype=bool)):
+            f.write('%d%s\n' % (frame_id, ''.join(', %d' % class_id for class_id in np.flatnonzero(label_row))))
+
+
+def convert_ground_truth_txt(ground_truth_textfile, label_file):
+    save_labels(label_file, *parse_ground_truth_textfile(ground_truth_textfile))
+
+
+def convert_labels_csv(csv_filename, label_file, step):
+    save_labels(label_file, *parse_labels_csv(csv_filename, step))
+
+
+def convert_dataset_labels_txt(labels_filename, label_file):
+    save_labels(label_file, *parse_dataset_labels_txt(labels_filename))
+
+
+def load_ground_truth(ground_truth_file, use_cache=True, cache_path=None):
+    """
+    The aim of this method is to load the ground truth of a video from a .npz file or a ground truth text file. Text
+    files are parsed once into the binary format in the feature cache, the entry is used as long as the text file
+    is unchanged.
+    :param ground_truth_file: path of the .npz or .txt file
+    :param use_cache: if False text files are always parsed and nothing is written
+    :param cache_path: directory of the cache, defaults to label_cache_path
+    :return: tuple of the sorted frame ids and a bool matrix of shape (no_of_frames, no_of_classes) holding the labels
+    """
+    if ground_truth_file.endswith('.npz'):
+        return load_labels(ground_truth_file)[:2]
+    if not use_cache:
+        return parse_ground_truth_textfile(ground_truth_file)
+
+    entry_path = get_cached('labels', [ground_truth_file], {'format': 'bitmask'},
+                            lambda path: convert_ground_truth_txt(ground_truth_file, path + 'labels.npz'),
+                            cache_path=cache_path or label_cache_path)
+    return load_labels(entry_path + 'labels.npz')[:2]
@@ -1,7 +1,13 @@
 import cv2
 import matplotlib.pyplot as plt
 import os
+import queue
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from frame_extractor import iter_frames, write_image
+from timebase import read_video_properties
 
 character_map = {0: 'kermit_the_frog',
                  1: 'waldorf_and_statler',
@@ -9,6 +15,13 @@ character_map = {0: 'kermit_the_frog',
                  3: 'swedish_chef',
                  4: 'none'}
 
+label_keys = {'k': 0, 'w': 1, 'p': 2, 's': 3}
+label_prompt = '[k] kermit, [w] waldorf & statler, [p] pig, [s] swedish chef, [n] none: '
+
+# sidecar progress record: magic, last labeled frame id, step size and size of the label file in bytes
+progress_format = '<4sIIQ'
+progress_magic = b'LBP1'
+
 
 def labelize_data(movie_path, output_path, image_path, step_size=1):
     cap = cv2.VideoCapture(movie_path)
@@ -114,9 +127,232 @@ def labelize_data(movie_path, output_path, image_path, step_size=1):
     plt.close()
 
 
+def parse_label_key(label_key):
+    """
+    :param label_key: the keys typed by the annotator, e.g. 'kp'
+    :return: sorted list of the labeled class ids, only the none class if 'n' was typed
+    """
+    label_key = label_key.lower()
+    if 'n' in label_key:
+        return [4]
+    return sorted(class_id for key, class_id in label_keys.items() if key in label_key)
+
+
+def progress_filename(output_path):
+    return output_path + '.progress'
+
+
+def save_progress(output_path, last_frame_id, step_size, labels_size):
+    """
+    The aim of this method is to atomically replace the sidecar progress record of a label file.
+    :param output_path: path of the label file
+    :param last_frame_id: id of the last labeled frame
+    :param step_size: step size between the labeled frames
+    :param labels_size: size of the label file in bytes after the last label was written
+    """
+    progress_file = progress_filename(output_path)
+    with open(progress_file + '.tmp', 'wb') as f:
+        f.write(struct.pack(progress_format, progress_magic, last_frame_id, step_size, labels_size))
+    os.replace(progress_file + '.tmp', progress_file)
+
+
+def read_last_frame_id(output_path, block_size=4096):
+    """
+    The aim of this method is to read the frame id of the last line of a label file from its end, so the file is
+    not read completely.
+    :param output_path: path of the label file
+    :return: id of the last labeled frame or None if the file holds no labels
+    """
+    with open(output_path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        tail = b''
+        while position > 0 and tail.strip().count(b'\n') < 1:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            tail = f.read(read_size) + tail
+
+    lines = tail.strip().splitlines()
+    return int(lines[-1].split(b',')[0]) if lines else None
+
+
+def load_progress(output_path):
+    """
+    The aim of this method is to find the last labeled frame of a label file in constant time. The sidecar progress
+    record is used if it matches the size of the label file, otherwise the last line of the label file is read,
+    e.g. if the file was labeled with labelize_data or the labeling was interrupted before the record was updated.
+    :param output_path: path of the label file
+    :return: id of the last labeled frame or None if nothing was labeled yet
+    """
+    if not os.path.isfile(output_path):
+        return None
+
+    try:
+        with open(progress_filename(output_path), 'rb') as f:
+            magic, last_frame_id, _, labels_size = struct.unpack(progress_format,
+                                                                 f.read(struct.calcsize(progress_format)))
+        if magic == progress_magic and labels_size == os.path.getsize(output_path):
+            return last_frame_id
+    except (OSError, struct.error):
+        pass
+
+    return read_last_frame_id(output_path)
+
+
+def labeling_frame_ids(no_of_frames, step_size, last_frame_id=None):
+    """
+    The aim of this method is to list the ids of the frames left to label. Like labelize_data the id of a frame is
+    its position after reading it, i.e. id 1 is the first frame of the video, and a new label file starts with the
+    frame ids 1, step_size + 2, 2 * step_size + 2, ... A resumed label file continues with the step size after its
+    last frame id.
+    :param no_of_frames: number of frames of the video
+    :param step_size: step size between the labeled frames
+    :param last_frame_id: id of the last labeled frame or None for a new label file
+    :return: range or list of the frame ids
+    """
+    if last_frame_id is None:
+        return [1] + list(range(step_size + 2, no_of_frames + 1, step_size))
+    return range(last_frame_id + step_size, no_of_frames + 1, step_size)
+
+
+def put_until_stopped(frames, item, stop):
+    """
+    The aim of this method is to put an item into the bounded queue without blocking forever if the consumer stopped.
+    :return: True if the item was put, False if stop was set before
+    """
+    while not stop.is_set():
+        try:
+            frames.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def prefetch_frames(movie_path, frame_ids, frames, stop):
+    """
+    The aim of this method is to decode the frames to label in a single sequential pass and put them into a bounded
+    queue, so the next frames are ready while the annotator labels the current one. None marks the end.
+    :param movie_path: path of the video
+    :param frame_ids: ids of the frames to label, see labeling_frame_ids
+    :param frames: queue the (frame id, frame) tuples are put into
+    :param stop: event that ends the decoding early
+    """
+    try:
+        for position, frame in iter_frames(movie_path, [frame_id - 1 for frame_id in frame_ids]):
+            if not put_until_stopped(frames, (position + 1, frame), stop):
+                return
+    except IOError as e:
+        print('[INFO] %s' % e)
+    # the end marker must not block either, the queue is full if the annotator stops within the last frames
+    put_until_stopped(frames, None, stop)
+
+
+def fast_labelize_data(movie_path, output_path, image_path, step_size=1, prefetch=32, n_writer_threads=2,
+                       flush_every=10):
+    """
+    The aim of this method is to label a video like labelize_data without waiting for decoding or the disk. The
+    frames are decoded sequentially in a background thread that prefetches the next frames, images and labels are
+    written by background threads. A label line is written only after its image, and the sidecar progress record
+    (<output_path>.progress) is updated every flush_every labels, so resuming reads a few bytes instead of the whole
+    label file. The label file and the images have the same format as the ones of labelize_data.
+    :param movie_path: path of the video
+    :param output_path: path of the label file, an existing file is resumed
+    :param image_path: directory of the labeled images
+    :param step_size: step size between the labeled frames
+    :param prefetch: number of frames decoded ahead
+    :param n_writer_threads: number of threads encoding and writing images
+    :param flush_every: number of labels after which the label file is flushed and the progress is saved
+    """
+    Path(image_path).mkdir(parents=True, exist_ok=True)
+    last_frame_id = load_progress(output_path)
+    _, no_of_frames = read_video_properties(movie_path)
+    frame_ids = labeling_frame_ids(no_of_frames, step_size, last_frame_id)
+    if last_frame_id is not None:
+        print('[INFO] Resume labeling after frame %d' % last_frame_id)
+
+    frames = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    decoder = threading.Thread(target=prefetch_frames, args=(movie_path, frame_ids, frames, stop), daemon=True)
+
+    output_file = open(output_path, 'a')
+    progress = {'unsaved': 0}
+
+    def write_label(image_future, frame_id, output_line):
+        # runs in the single label writer thread, so the lines keep their order. No label is written after a failed
+        # image, so resuming continues at the frame whose image failed
+        if 'error' in progress:
+            raise IOError('Label of frame %d not written after a failed image.' % frame_id)
+        try:
+            image_future.result()
+        except Exception as e:
+            progress['error'] = e
+            raise
+        output_file.write(output_line + '\n')
+        progress['last_frame_id'] = frame_id
+        progress['unsaved'] += 1
+        if progress['unsaved'] >= flush_every:
+            output_file.flush()
+            save_progress(output_path, frame_id, step_size, output_file.tell())
+            progress['unsaved'] = 0
+
+    image_writer = ThreadPoolExecutor(max_workers=max(1, n_writer_threads))
+    label_writer = ThreadPoolExecutor(max_workers=1)
+    label_futures = []
+    im = None
+    plt.ion()
+    decoder.start()
+    try:
+        while True:
+            item = frames.get()
+            if item is None:
+                break
+            frame_id, frame = item
+
+            # matplotlib shows rgb, the bgr frame is only viewed in reversed channel order
+            if im is None:
+                im = plt.imshow(frame[:, :, ::-1])
+            else:
+                im.set_data(frame[:, :, ::-1])
+            plt.draw()
+            label_key = input(label_prompt)
+            if 'stop' in label_key.lower():
+                break
+
+            class_ids = parse_label_key(label_key)
+            image_filename = image_path + str(frame_id) + ''.join('_%d' % class_id for class_id in class_ids) + '.jpg'
+            output_line = str(frame_id) + ''.join(', %d' % class_id for class_id in class_ids)
+            image_future = image_writer.submit(write_image, image_filename, frame)
+            label_futures.append(label_writer.submit(write_label, image_future, frame_id, output_line))
+            # a failed write ends the labeling instead of silently dropping labels
+            while label_futures and label_futures[0].done():
+                label_futures.pop(0).result()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        decoder.join()
+        image_writer.shutdown(wait=True)
+        label_writer.shutdown(wait=True)
+        output_file.close()
+        if 'last_frame_id' in progress:
+            save_progress(output_path, progress['last_frame_id'], step_size, os.path.getsize(output_path))
+        plt.close()
+
+    for label_future in label_futures:
+        label_future.result()
+
+
 if __name__ == '__main__':
     test_movie_path = '../../videos/Muppets-03-04-03.avi'
     test_ouput_path = '../../ground_truth/labeled/Muppets-03-04-03.txt'
     test_image_path = '../../ground_truth/labeled/'
     step = 12
-    labelize_data(movie_path=test_movie_path, output_path=test_ouput_path, image_path=test_image_path, step_size=step)
+    fast_mode = True
+    if fast_mode:
+        fast_labelize_data(movie_path=test_movie_path, output_path=test_ouput_path, image_path=test_image_path,
+                           step_size=step)
+    else:
+        labelize_data(movie_path=test_movie_path, output_path=test_ouput_path, image_path=test_image_path,
+                      step_size=step)
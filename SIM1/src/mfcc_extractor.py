@@ -0,0 +1,124 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from profiling import call_profiled, file_size, merge_stage_stats, stage
+from timebase import mfcc_window
+
+# dynamic range of the log-mel spectrogram below its maximum, the default of librosa.feature.mfcc
+mfcc_top_db = 80.0
+
+
+def parse_snippet_filename(audio_file):
+    """
+    The aim of this method is to extract the file id and character id from the filename of an audio snippet,
+    which is written as <file_id>_<char_id>_<snippet_no>.wav by the audio extractor.
+    :param audio_file: path of the audio snippet
+    :return: tuple of file id and character id
+    """
+    filename = audio_file.split('/')[-1]
+    return int(filename.split('_')[0][-1]), int(filename.split('_')[1])
+
+
+def samples_mfccs(samples, sample_rate, frame_length_ms, n_mfcc):
+    """
+    The aim of this method is to extract the MFCC features of audio samples, e.g. of a slice of a decoded audio track.
+    :param samples: float32 audio samples
+    :param sample_rate: sample rate of the samples
+    :param frame_length_ms: window size of the MFCC frames in milliseconds
+    :param n_mfcc: number of MFCC features
+    :return: float32 MFCC matrix of shape (no_of_frames, n_mfcc)
+    """
+    import librosa
+
+    n_fft, hop_length = mfcc_window(frame_length_ms, sample_rate)
+    with stage('mfcc') as counters:
+        mfccs = librosa.feature.mfcc(y=np.asarray(samples, dtype=np.float32), sr=sample_rate, n_mfcc=n_mfcc,
+                                     hop_length=hop_length, n_fft=n_fft).T
+        counters['items'] = len(mfccs)
+
+    return mfccs.astype(np.float32)
+
+
+def extract_snippet_mfccs(audio_file, frame_length_ms, n_mfcc, sample_rate=22050):
+    """
+    The aim of this method is to extract the MFCC features of a single audio file.
+    :param audio_file: path of the audio file
+    :param frame_length_ms: window size of the MFCC frames in milliseconds
+    :param n_mfcc: number of MFCC features
+    :param sample_rate: sample rate the audio is resampled to, None keeps the native sample rate
+    :return: tuple of the float32 MFCC matrix of shape (no_of_frames, n_mfcc), the sample rate and the duration
+    in seconds
+    """
+    import librosa
+
+    # loading includes decoding and resampling
+    with stage('load_audio', items=1, bytes_read=file_size(audio_file)):
+        raw_data, sample_rate = librosa.load(audio_file, sr=sample_rate)
+
+    return samples_mfccs(raw_data, sample_rate, frame_length_ms, n_mfcc), sample_rate, len(raw_data) / sample_rate
+
+
+def extract_mfccs_parallel(audio_files, frame_length_ms, n_mfcc, sample_rate=22050, max_workers=None, chunksize=8):
+    """
+    The aim of this method is to extract the MFCC features of several audio files with a process pool. The results
+    are returned in the order of the given files, independent of the order the workers finish in.
+    :param audio_files: list of audio file paths
+    :param frame_length_ms: window size of the MFCC frames in milliseconds
+    :param n_mfcc: number of MFCC features
+    :param sample_rate: sample rate the audio is resampled to, None keeps the native sample rate
+    :param max_workers: number of worker processes, defaults to the number of cpus, 1 extracts in this process
+    :param chunksize: number of files handed to a worker at once
+    :return: list of (mfccs, sample rate, duration) tuples as returned by extract_snippet_mfccs
+    """
+    max_workers = max_workers or os.cpu_count()
+    args = [(audio_file, frame_length_ms, n_mfcc, sample_rate) for audio_file in audio_files]
+    if max_workers <= 1 or len(audio_files) <= 1:
+        return [extract_snippet_mfccs(*arg) for arg in args]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for result, stats in executor.map(call_profiled, [extract_snippet_mfccs] * len(args), *zip(*args),
+                                          chunksize=chunksize):
+            merge_stage_stats(stats)
+            results.append(result)
+
+    return results
+
+
+def buffer_mfccs(samples, sample_rate, frame_length_ms, n_mfcc, block_length=1024):
+    """
+    The aim of this method is to compute the frame-level MFCC matrix of a decoded audio track in fixed-size blocks,
+    so a memory-mapped track is only paged in block by block. Blocks overlap by the window size, so frame i of the
+    result covers the samples [i * hop_length, i * hop_length + n_fft), only frames lying completely inside the track
+    are computed. librosa clips the log-mel spectrogram top_db below its maximum, the clipping uses the maximum of the
+    whole track, so the result equals a single librosa.feature.mfcc(center=False) call on the track and does not
+    depend on the block length. The log-mel spectrogram of the track is kept in memory for that.
+    :param samples: float32 samples of the track, see audio_buffer.load_episode_audio
+    :param sample_rate: sample rate of the samples
+    :param frame_length_ms: window size of the MFCC frames in milliseconds
+    :param n_mfcc: number of MFCC features
+    :param block_length: number of MFCC frames computed per block
+    :return: float32 MFCC matrix of shape (no_of_frames, n_mfcc)
+    """
+    import librosa
+
+    n_fft, hop_length = mfcc_window(frame_length_ms, sample_rate)
+    no_of_frames = max(0, (len(samples) - n_fft) // hop_length + 1)
+
+    mfcc_blocks = [np.empty((0, n_mfcc), dtype=np.float32)]
+    with stage('buffer_mfcc', items=no_of_frames, bytes_read=len(samples) * 4):
+        log_mel_blocks = []
+        for first_frame in range(0, no_of_frames, block_length):
+            last_frame = min(first_frame + block_length, no_of_frames) - 1
+            block = np.asarray(samples[first_frame * hop_length:last_frame * hop_length + n_fft], dtype=np.float32)
+            mel = librosa.feature.melspectrogram(y=block, sr=sample_rate, n_fft=n_fft, hop_length=hop_length,
+                                                 center=False)
+            log_mel_blocks.append(librosa.power_to_db(mel, top_db=None).astype(np.float32))
+
+        if log_mel_blocks:
+            floor = max(log_mel.max() for log_mel in log_mel_blocks) - mfcc_top_db
+            for log_mel in log_mel_blocks:
+                mfccs = librosa.feature.mfcc(S=np.maximum(log_mel, floor), n_mfcc=n_mfcc).T
+                mfcc_blocks.append(mfccs.astype(np.float32))
+
+    return np.concatenate(mfcc_blocks)
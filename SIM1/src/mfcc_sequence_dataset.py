@@ -0,0 +1,130 @@
+import itertools
+import math
+import random
+import numpy as np
+from mfcc_store import load_mfcc_store
+
+
+def sequence_index(store, mfcc_sequence_len, pad_sequences=True):
+    """
+    The aim of this method is to index the MFCC sequences of a store without copying any features. Every snippet is
+    split into consecutive sequences of mfcc_sequence_len frames in store order, like chunks does.
+    :param store: the MFCC store as returned by load_mfcc_store
+    :param mfcc_sequence_len: number of MFCC frames per sequence
+    :param pad_sequences: if True the last incomplete sequence of a snippet is kept and padded with zeros later on,
+    like the ragged last chunk of random_sample_multi_mfcc, otherwise it is dropped
+    :return: tuple of the start row, the number of frames and the character id of every sequence
+    """
+    snippet_ids = np.asarray(store['snippet_ids'])
+    if len(snippet_ids) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    snippet_starts = np.concatenate([[0], np.flatnonzero(np.diff(snippet_ids)) + 1])
+    snippet_lengths = np.diff(np.append(snippet_starts, len(snippet_ids)))
+    if pad_sequences:
+        no_of_sequences = -(-snippet_lengths // mfcc_sequence_len)
+    else:
+        no_of_sequences = snippet_lengths // mfcc_sequence_len
+
+    # position of every sequence within its snippet
+    snippet_of_sequence = np.repeat(np.arange(len(snippet_starts)), no_of_sequences)
+    first_sequence = np.cumsum(no_of_sequences) - no_of_sequences
+    sequence_no = np.arange(len(snippet_of_sequence)) - first_sequence[snippet_of_sequence]
+
+    offsets = sequence_no * mfcc_sequence_len
+    starts = snippet_starts[snippet_of_sequence] + offsets
+    lengths = np.minimum(snippet_lengths[snippet_of_sequence] - offsets, mfcc_sequence_len)
+    char_ids = np.asarray(store['char_ids'])[starts].astype(np.int64)
+    return starts.astype(np.int64), lengths.astype(np.int64), char_ids
+
+
+def balanced_sequence_rows(char_ids, target_character_id, seed=333):
+    """
+    The aim of this method is to sample a class balanced dataset of sequences the same way random_sample_multi_mfcc
+    does, i.e. all sequences of the target character and negatives of every other character according to the data
+    distribution. Only sequence numbers are sampled, so no features are touched.
+    :param char_ids: the character id of every sequence, see sequence_index
+    :param target_character_id: the id of the target character
+    :param seed: seed of the random sampling of the negative samples
+    :return: tuple of the sampled sequence numbers and their binary labels
+    """
+    positives = np.flatnonzero(char_ids == target_character_id)
+    no_rest_samples = len(char_ids) - len(positives)
+    if no_rest_samples == 0:
+        print('[INFO] There are no sequences of other characters than %d, the dataset has no negatives' %
+              target_character_id)
+        return positives.astype(np.int64), np.ones(len(positives), dtype=np.float32)
+
+    # the characters are visited in the order they appear in the store, like the dicts of random_sample_multi_mfcc
+    _, first_rows = np.unique(char_ids, return_index=True)
+    negative_char_ids = [char_id for char_id in char_ids[np.sort(first_rows)] if char_id != target_character_id]
+
+    random.seed(seed)
+    sequences = [positives]
+    for char_id in negative_char_ids:
+        candidates = np.flatnonzero(char_ids == char_id)
+        k = math.ceil((len(candidates) / no_rest_samples) * len(positives))
+        sequences.append(candidates[random.sample(range(len(candidates)), k)])
+
+    labels = np.zeros(sum(len(rows) for rows in sequences), dtype=np.float32)
+    labels[:len(positives)] = 1
+    return np.concatenate(sequences).astype(np.int64), labels
+
+
+def iter_mfcc_sequence_batches(mfcc_store_path, target_character_id, mfcc_sequence_len, batch_size=32,
+                               pad_sequences=True, drop_remainder=False, shuffle=True, seed=333, epoch=0):
+    """
+    The aim of this method is to stream a class balanced MFCC sequence dataset in batches. The sampling only holds
+    sequence numbers, the features of a batch are gathered from the memory-mapped store when it is yielded.
+    :param mfcc_store_path: directory of the MFCC store
+    :param target_character_id: the id of the target character
+    :param mfcc_sequence_len: number of MFCC frames per sequence
+    :param batch_size: number of sequences per batch
+    :param pad_sequences: if True incomplete sequences at the end of a snippet are padded with zeros, so the sampled
+    sequences are the ones of random_sample_multi_mfcc, otherwise they are dropped and the sampling differs
+    :param drop_remainder: if True the last incomplete batch is dropped, so all batches have the same shape
+    :param shuffle: if True the sampled sequences are shuffled with the given seed and epoch
+    :param seed: seed of the sampling and the shuffling
+    :param epoch: number of the epoch, every epoch is shuffled in a different order, the sampling stays the same
+    :return: generator yielding float32 batches of shape (batch_size, mfcc_sequence_len, n_mfcc) and their labels
+    """
+    store = load_mfcc_store(mfcc_store_path)
+    features = store['features']
+    n_mfcc = store['header']['n_mfcc']
+
+    starts, lengths, char_ids = sequence_index(store, mfcc_sequence_len, pad_sequences)
+    sequences, labels = balanced_sequence_rows(char_ids, target_character_id, seed)
+    if shuffle:
+        order = np.random.RandomState([seed, epoch]).permutation(len(sequences))
+        sequences, labels = sequences[order], labels[order]
+
+    no_of_batches = len(sequences) // batch_size if drop_remainder else -(-len(sequences) // batch_size)
+    for batch_no in range(0, no_of_batches):
+        batch_sequences = sequences[batch_no * batch_size:(batch_no + 1) * batch_size]
+        batch = np.zeros((len(batch_sequences), mfcc_sequence_len, n_mfcc), dtype=np.float32)
+        for i, sequence in enumerate(batch_sequences):
+            batch[i, :lengths[sequence]] = features[starts[sequence]:starts[sequence] + lengths[sequence]]
+
+        yield batch, labels[batch_no * batch_size:(batch_no + 1) * batch_size]
+
+
+def mfcc_sequence_tf_dataset(mfcc_store_path, target_character_id, mfcc_sequence_len, batch_size=32,
+                             pad_sequences=True, drop_remainder=False, shuffle=True, seed=333, prefetch=None):
+    """
+    The aim of this method is to wrap iter_mfcc_sequence_batches into a tf.data pipeline that prefetches batches
+    while the model trains on the current one. Every epoch iterates the generator again with the next epoch number,
+    so every epoch is shuffled in a different order.
+    :param prefetch: number of prefetched batches, None lets tensorflow tune it
+    :return: a tf.data.Dataset yielding (batch, labels) tuples, see iter_mfcc_sequence_batches for the parameters
+    """
+    import tensorflow as tf
+
+    n_mfcc = load_mfcc_store(mfcc_store_path)['header']['n_mfcc']
+    batch_dim = batch_size if drop_remainder else None
+    epochs = itertools.count()
+    dataset = tf.data.Dataset.from_generator(
+        lambda: iter_mfcc_sequence_batches(mfcc_store_path, target_character_id, mfcc_sequence_len, batch_size,
+                                           pad_sequences, drop_remainder, shuffle, seed, next(epochs)),
+        output_signature=(tf.TensorSpec(shape=(batch_dim, mfcc_sequence_len, n_mfcc), dtype=tf.float32),
+                          tf.TensorSpec(shape=(batch_dim,), dtype=tf.float32)))
+    return dataset.prefetch(prefetch or tf.data.experimental.AUTOTUNE)
@@ -0,0 +1,82 @@
+import json
+import numpy as np
+from pathlib import Path
+from profiling import stage
+
+header_filename = 'header.json'
+column_filenames = {'features': 'features.npy',
+                    'file_ids': 'file_ids.npy',
+                    'char_ids': 'char_ids.npy',
+                    'snippet_ids': 'snippet_ids.npy'}
+column_dtypes = {'features': np.float32,
+                 'file_ids': np.int16,
+                 'char_ids': np.int16,
+                 'snippet_ids': np.int32}
+
+
+def write_mfcc_store(store_path, features, file_ids, char_ids, snippet_ids, n_mfcc, frame_length_ms, hop_length_ms,
+                     sample_rate):
+    """
+    The aim of this method is to write MFCC frames to a columnar binary store. The store is a directory holding
+    a float32 feature matrix, one int column per id and a small json header describing the features.
+    :param store_path: directory of the store
+    :param features: matrix of shape (no_of_frames, n_mfcc) holding one MFCC frame per row
+    :param file_ids: video file id per MFCC frame
+    :param char_ids: character id per MFCC frame
+    :param snippet_ids: id of the audio snippet per MFCC frame, frames of a snippet are stored consecutively
+    :param n_mfcc: number of MFCC features
+    :param frame_length_ms: window size of the MFCC frames in milliseconds
+    :param hop_length_ms: hop length of the MFCC frames in milliseconds
+    :param sample_rate: sample rate of the audio the features were extracted from
+    """
+    Path(store_path).mkdir(parents=True, exist_ok=True)
+
+    columns = {'features': np.asarray(features).reshape(-1, n_mfcc),
+               'file_ids': file_ids,
+               'char_ids': char_ids,
+               'snippet_ids': snippet_ids}
+    with stage('write_mfcc_store', items=len(columns['features'])) as counters:
+        for name, values in columns.items():
+            values = np.ascontiguousarray(values, dtype=column_dtypes[name])
+            np.save(str(Path(store_path) / column_filenames[name]), values)
+            counters['bytes_written'] += values.nbytes
+
+    header = {'n_mfcc': n_mfcc,
+              'frame_length_ms': frame_length_ms,
+              'hop_length_ms': hop_length_ms,
+              'sample_rate': sample_rate,
+              'no_of_frames': len(columns['features'])}
+    with open(str(Path(store_path) / header_filename), 'w') as f:
+        json.dump(header, f, indent=2)
+
+
+def load_mfcc_store(store_path, mmap_mode='r'):
+    """
+    The aim of this method is to load a MFCC store written by write_mfcc_store. By default the columns are
+    memory-mapped, so nothing is copied until it is actually accessed.
+    :param store_path: directory of the store
+    :param mmap_mode: mmap_mode passed to np.load, None reads the columns into memory
+    :return: dict holding the header and one array per column
+    """
+    with open(str(Path(store_path) / header_filename), 'r') as f:
+        store = {'header': json.load(f)}
+
+    for name, filename in column_filenames.items():
+        store[name] = np.load(str(Path(store_path) / filename), mmap_mode=mmap_mode)
+
+    return store
+
+
+def group_rows(store, char_id):
+    """
+    The aim of this method is to group the row indices of a character by file id. Files are ordered by their first
+    occurrence in the store, rows keep their order in the store.
+    :param store: a store loaded by load_mfcc_store
+    :param char_id: the character id
+    :return: dict mapping file ids to arrays of row indices
+    """
+    rows = np.flatnonzero(np.asarray(store['char_ids']) == char_id)
+    file_ids = np.asarray(store['file_ids'])[rows]
+    unique_file_ids, first_indices = np.unique(file_ids, return_index=True)
+
+    return {int(file_id): rows[file_ids == file_id] for file_id in unique_file_ids[np.argsort(first_indices)]}
@@ -0,0 +1,150 @@
+import os
+import random
+import threading
+import cv2
+import numpy as np
+from dataset_generator import dataset_image_filename
+from inference import load_tensorflow, pig_class_id, pig_model_path, preprocess_frame
+from label_store import parse_dataset_labels_txt
+from profiling import stage
+
+pig_dataset_path = '../../ground_truth/pig/'
+quantization_modes = ['dynamic', 'int8']
+
+
+def tflite_model_filename(saved_model_path, quantization):
+    return saved_model_path.rstrip('/') + '-%s.tflite' % quantization
+
+
+def load_dataset_images(dataset_path, image_size, class_id=pig_class_id, max_images=None, seed=333):
+    """
+    The aim of this method is to load a random sample of the images of an image dataset as model input, e.g. as
+    calibration set of the int8 quantization or to measure the accuracy of an exported model. Samples whose image is
+    missing are skipped.
+    :param dataset_path: directory of the dataset holding labels.txt and the jpeg images
+    :param image_size: (height, width) of the model input
+    :param class_id: id of the positive class of the dataset
+    :param max_images: maximum number of loaded images, None loads all images
+    :param seed: seed of the random sampling
+    :return: tuple of the float32 images of shape (no_of_images, height, width, 3) and the bool targets
+    """
+    frame_ids, labels, file_ids = parse_dataset_labels_txt(dataset_path + 'labels.txt')
+    order = list(range(len(frame_ids)))
+    random.Random(seed).shuffle(order)
+
+    images, targets = [], []
+    with stage('load_dataset_images') as counters:
+        for i in order:
+            if max_images is not None and len(images) == max_images:
+                break
+            for label in np.flatnonzero(labels[i]):
+                frame = cv2.imread(dataset_path + dataset_image_filename(file_ids[i], frame_ids[i], label))
+                if frame is not None:
+                    images.append(preprocess_frame(frame, image_size))
+                    targets.append(bool(labels[i, class_id]))
+                    break
+        counters['items'] = len(images)
+
+    if len(images) < min(len(order), max_images or len(order)):
+        print('[INFO] Only %d images of the %d samples of %s exist' % (len(images), len(order), dataset_path))
+    return np.asarray(images, dtype=np.float32).reshape((-1,) + tuple(image_size) + (3,)), \
+        np.asarray(targets, dtype=bool)
+
+
+def export_tflite(saved_model_path=pig_model_path, quantization='dynamic', output_file=None,
+                  calibration_path=pig_dataset_path, no_of_calibration_images=200, seed=333):
+    """
+    The aim of this method is to convert a keras SavedModel to a quantized TFLite model for the cpu. The dynamic range
+    quantization stores the weights as int8, the int8 quantization additionally computes the activations in int8,
+    their ranges are calibrated on images of the dataset. Inputs and outputs stay float32 in both modes.
+    :param saved_model_path: path of the SavedModel
+    :param quantization: 'dynamic' or 'int8'
+    :param output_file: path of the TFLite model, defaults to <saved model>-<quantization>.tflite
+    :param calibration_path: directory of the image dataset the calibration images are drawn from
+    :param no_of_calibration_images: number of calibration images of the int8 quantization
+    :param seed: seed of the random sampling of the calibration images
+    :return: path of the TFLite model
+    """
+    if quantization not in quantization_modes:
+        raise ValueError('Unknown quantization %r, use one of %s' % (quantization, quantization_modes))
+    output_file = output_file or tflite_model_filename(saved_model_path, quantization)
+    tf = load_tensorflow(os.cpu_count())
+
+    converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_path)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'int8':
+        image_size = tf.keras.models.load_model(saved_model_path).input_shape[1:3]
+        images, _ = load_dataset_images(calibration_path, image_size, max_images=no_of_calibration_images, seed=seed)
+        if len(images) == 0:
+            raise IOError('No calibration images found in %r.' % calibration_path)
+        converter.representative_dataset = lambda: ([image[np.newaxis]] for image in images)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    with stage('export_tflite', items=1) as counters:
+        model = converter.convert()
+        with open(output_file + '.tmp', 'wb') as f:
+            f.write(model)
+        os.replace(output_file + '.tmp', output_file)
+        counters['bytes_written'] = len(model)
+
+    print('[INFO] Wrote %s quantized model of %.1f MB to %s' % (quantization, len(model) / 2 ** 20, output_file))
+    return output_file
+
+
+def quantize(values, details):
+    scale, zero_point = details['quantization']
+    if details['dtype'] not in (np.int8, np.uint8) or scale == 0:
+        return values.astype(details['dtype'])
+    limits = np.iinfo(details['dtype'])
+    return np.clip(np.rint(values / scale + zero_point), limits.min, limits.max).astype(details['dtype'])
+
+
+def dequantize(values, details):
+    scale, zero_point = details['quantization']
+    if details['dtype'] not in (np.int8, np.uint8) or scale == 0:
+        return values.astype(np.float32)
+    return ((values.astype(np.float32) - zero_point) * scale).astype(np.float32)
+
+
+class TFLiteModel:
+    """
+    TFLite interpreter with the interface of a keras model used by inference, i.e. input_shape and
+    predict_on_batch, so an exported model replaces the SavedModel. Quantized inputs and outputs are converted.
+    """
+
+    def __init__(self, model_file, n_threads=4):
+        """
+        :param model_file: path of the TFLite model
+        :param n_threads: number of threads of the interpreter
+        """
+        import tensorflow as tf
+
+        self.interpreter = tf.lite.Interpreter(model_path=model_file, num_threads=n_threads)
+        self.input_details = self.interpreter.get_input_details()[0]
+        self.input_shape = (None,) + tuple(int(size) for size in self.input_details['shape'][1:])
+        self.batch_size = None
+        # the interpreter is not thread safe
+        self.lock = threading.Lock()
+
+    def predict_on_batch(self, images):
+        """
+        :param images: float32 array of shape (batch, height, width, 3)
+        :return: float32 model output of the batch
+        """
+        images = np.asarray(images, dtype=np.float32)
+        with self.lock:
+            if len(images) != self.batch_size:
+                # the tensors are only reallocated if the batch size changes
+                self.interpreter.resize_tensor_input(self.input_details['index'], [len(images)] +
+                                                     list(self.input_shape[1:]))
+                self.interpreter.allocate_tensors()
+                self.batch_size = len(images)
+            self.interpreter.set_tensor(self.input_details['index'], quantize(images, self.input_details))
+            self.interpreter.invoke()
+            output_details = self.interpreter.get_output_details()[0]
+            return dequantize(self.interpreter.get_tensor(output_details['index']), output_details)
+
+
+if __name__ == '__main__':
+    for mode in quantization_modes:
+        export_tflite(pig_model_path, mode)
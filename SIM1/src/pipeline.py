@@ -0,0 +1,331 @@
+import glob
+import hashlib
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from profiling import stage as profile_stage
+
+pipeline_state_path = '../../pipeline/'
+pipeline_state_filename = 'state.json'
+
+
+class File:
+    """
+    A single file a stage reads or writes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def paths(self):
+        return [self.path] if os.path.isfile(self.path) else []
+
+    def exists(self):
+        return len(self.paths()) > 0
+
+    def fingerprint(self):
+        """
+        :return: list of (path, size, modification time) of the files, see feature_cache.file_fingerprint
+        """
+        fingerprint = []
+        for path in self.paths():
+            stat = os.stat(path)
+            fingerprint.append([path, stat.st_size, stat.st_mtime_ns])
+        return fingerprint
+
+    def key(self):
+        return type(self).__name__, self.path
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.path)
+
+
+class Files(File):
+    """
+    All files matching a glob pattern, e.g. the audio snippets.
+    """
+
+    def paths(self):
+        return sorted(glob.glob(self.path))
+
+
+class Directory(File):
+    """
+    All files below a directory.
+    """
+
+    def paths(self):
+        return sorted(str(path) for path in Path(self.path).rglob('*') if path.is_file())
+
+
+class Result:
+    """
+    Placeholder for the return value of another stage in the arguments of a stage.
+    """
+
+    def __init__(self, stage_name):
+        self.stage_name = stage_name
+
+    def __repr__(self):
+        return 'Result(%r)' % self.stage_name
+
+
+class Stage:
+    """
+    A step of the pipeline. The function is called as function(*args, **kwargs) once all stages it depends on are
+    completed, Result placeholders in the arguments are replaced by the return values of the referenced stages.
+    """
+
+    def __init__(self, name, function, args=(), kwargs=None, inputs=(), outputs=(), after=(), workers=1,
+                 workers_argument=None, returns_path=False):
+        """
+        :param name: unique name of the stage
+        :param function: the function of the stage
+        :param args: positional arguments of the function
+        :param kwargs: keyword arguments of the function
+        :param inputs: File, Files or Directory artifacts the stage reads, a stage writing one of them as output
+        runs first
+        :param outputs: File, Files or Directory artifacts the stage writes
+        :param after: names of further stages that have to complete first
+        :param workers: number of workers the stage can use
+        :param workers_argument: name of the keyword argument the granted number of workers is passed as, e.g.
+        'max_workers', it is not part of the memoization key
+        :param returns_path: if True the function returns the path of a file or directory, e.g. a cache entry, that
+        is checked like an output
+        """
+        self.name = name
+        self.function = function
+        self.args = tuple(args)
+        self.kwargs = dict(kwargs or {})
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.after = list(after)
+        self.workers = workers
+        self.workers_argument = workers_argument
+        self.returns_path = returns_path
+
+    def result_dependencies(self):
+        return [value.stage_name for value in list(self.args) + list(self.kwargs.values()) if isinstance(value, Result)]
+
+    def output_artifacts(self, result):
+        if self.returns_path and isinstance(result, str):
+            return self.outputs + [Directory(result) if os.path.isdir(result) else File(result)]
+        return self.outputs
+
+
+def resolve(value, results):
+    return results[value.stage_name] if isinstance(value, Result) else value
+
+
+def json_default(value):
+    # parameters that are not json serializable, e.g. tuples of numpy values, are described by their repr
+    return repr(value)
+
+
+class Pipeline:
+    """
+    Runner of a DAG of stages. A stage is skipped if its function, arguments and input files did not change since
+    its last completion and its outputs are unchanged. Stages whose dependencies are completed run concurrently as
+    long as their workers fit into the shared worker budget. The state is saved after every completed stage, so a
+    pipeline that failed or was interrupted resumes after the last completed stage.
+    """
+
+    def __init__(self, stages, state_path=pipeline_state_path, max_workers=1):
+        """
+        :param stages: list of stages
+        :param state_path: directory of the pipeline state
+        :param max_workers: shared worker budget of the concurrently running stages
+        """
+        self.stages = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError('Duplicate stage %r' % stage.name)
+            self.stages[stage.name] = stage
+        self.state_file = state_path + pipeline_state_filename
+        self.max_workers = max(1, max_workers)
+        self.dependencies = self.resolve_dependencies()
+
+    def resolve_dependencies(self):
+        """
+        :return: dict mapping the stage names to the set of stages they depend on
+        """
+        output_stages = {}
+        for stage in self.stages.values():
+            for artifact in stage.outputs:
+                output_stages[artifact.key()] = stage.name
+
+        dependencies = {}
+        for stage in self.stages.values():
+            names = set(stage.after) | set(stage.result_dependencies())
+            names |= set(output_stages[artifact.key()] for artifact in stage.inputs if artifact.key() in output_stages)
+            names.discard(stage.name)
+            unknown = names - set(self.stages)
+            if unknown:
+                raise ValueError('Stage %r depends on unknown stages %s' % (stage.name, sorted(unknown)))
+            dependencies[stage.name] = names
+
+        # every stage has to be reachable by removing completed stages, otherwise there is a cycle
+        remaining = dict((name, set(names)) for name, names in dependencies.items())
+        while remaining:
+            ready = [name for name, names in remaining.items() if not names]
+            if not ready:
+                raise ValueError('Cyclic dependencies between the stages %s' % sorted(remaining))
+            for name in ready:
+                del remaining[name]
+            for names in remaining.values():
+                names.difference_update(ready)
+
+        return dependencies
+
+    def load_state(self):
+        try:
+            with open(self.state_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_state(self, state):
+        Path(self.state_file).parent.mkdir(parents=True, exist_ok=True)
+        with open(self.state_file + '.tmp', 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(self.state_file + '.tmp', self.state_file)
+
+    def stage_key(self, stage, args, kwargs, state):
+        """
+        :return: hex digest of the function, the arguments, the input files and the outputs of the stages a stage
+        depends on, so a stage runs again if one of them produced new outputs
+        """
+        kwargs = dict((name, value) for name, value in kwargs.items() if name != stage.workers_argument)
+        description = {'function': '%s.%s' % (stage.function.__module__, stage.function.__qualname__),
+                       'args': args,
+                       'kwargs': kwargs,
+                       'inputs': [[repr(artifact), artifact.fingerprint()] for artifact in stage.inputs],
+                       'dependencies': [[name, state[name]['outputs']]
+                                        for name in sorted(self.dependencies[stage.name])]}
+        return hashlib.sha1(json.dumps(description, sort_keys=True, default=json_default).encode()).hexdigest()
+
+    def is_unchanged(self, stage, key, stage_state):
+        if stage_state is None or stage_state.get('key') != key or not stage_state.get('memoized', False):
+            return False
+        artifacts = stage.output_artifacts(stage_state['result'])
+        return all(artifact.exists() for artifact in artifacts) and \
+            [artifact.fingerprint() for artifact in artifacts] == stage_state['outputs']
+
+    def run(self, force=()):
+        """
+        The aim of this method is to run all stages that are not up to date.
+        :param force: names of stages that run even if they are unchanged
+        :return: dict mapping the stage names to their return values
+        """
+        state = self.load_state()
+        results = {}
+        completed = set()
+        running = {}
+        running_names = set()
+        used_workers = 0
+        failure = None
+
+        with ThreadPoolExecutor(max_workers=len(self.stages) or 1) as executor:
+            while len(completed) < len(self.stages):
+                scheduled = True
+                while scheduled and failure is None:
+                    scheduled = False
+                    for stage in self.stages.values():
+                        if stage.name in completed or stage.name in running_names or \
+                                not self.dependencies[stage.name] <= completed:
+                            continue
+
+                        args = [resolve(value, results) for value in stage.args]
+                        kwargs = dict((name, resolve(value, results)) for name, value in stage.kwargs.items())
+                        key = self.stage_key(stage, args, kwargs, state)
+                        if stage.name not in force and self.is_unchanged(stage, key, state.get(stage.name)):
+                            print('[INFO] Skip unchanged stage %s' % stage.name)
+                            results[stage.name] = state[stage.name]['result']
+                            completed.add(stage.name)
+                            scheduled = True
+                            continue
+
+                        workers = min(stage.workers, self.max_workers - used_workers)
+                        if workers < 1:
+                            continue
+                        if stage.workers_argument is not None:
+                            kwargs[stage.workers_argument] = workers
+
+                        print('[INFO] Run stage %s with %d workers' % (stage.name, workers))
+                        running[executor.submit(self.run_stage, stage, args, kwargs)] = (stage.name, key, workers)
+                        running_names.add(stage.name)
+                        used_workers += workers
+                        scheduled = True
+
+                if not running:
+                    break
+
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name, key, workers = running.pop(future)
+                    running_names.discard(name)
+                    used_workers -= workers
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print('[INFO] Stage %s failed: %s' % (name, e))
+                        failure = failure or e
+                        continue
+
+                    results[name] = result
+                    completed.add(name)
+                    state[name] = self.completed_state(self.stages[name], key, result)
+                    self.save_state(state)
+
+        if failure is not None:
+            raise failure
+        return results
+
+    def run_stage(self, stage, args, kwargs):
+        with profile_stage('pipeline_' + stage.name, items=1):
+            return stage.function(*args, **kwargs)
+
+    def completed_state(self, stage, key, result):
+        try:
+            json.dumps(result)
+            memoized = True
+        except TypeError:
+            # a result that can not be stored has to be computed again by every run
+            print('[INFO] Result of stage %s can not be stored, it runs again next time' % stage.name)
+            result, memoized = None, False
+
+        return {'key': key, 'memoized': memoized, 'result': result,
+                'outputs': [artifact.fingerprint() for artifact in stage.output_artifacts(result)]}
+
+
+def default_pipeline(max_workers=1, frame_length_ms=20, n_mfcc=20, state_path=pipeline_state_path):
+    """
+    The aim of this method is to declare the extraction pipeline: the audio snippets and the MFCC store of the audio
+    branch and the character image datasets of the image branch, which run concurrently. The paths are read from
+    the configuration of audio_extractor and dataset_generator when the pipeline is declared.
+    :param max_workers: shared worker budget of the stages
+    :param frame_length_ms: window size of the MFCC frames in milliseconds
+    :param n_mfcc: number of MFCC features
+    :param state_path: directory of the pipeline state
+    :return: the Pipeline
+    """
+    import audio_extractor
+    import dataset_generator
+
+    videos = [File(path) for path in audio_extractor.video_paths]
+    ground_truth = [File(path) for path in audio_extractor.ground_truth_textfiles]
+    snippets = Files(audio_extractor.audio_snippet_base_path + '*.wav')
+    datasets = [dataset_generator.ground_truth_files_base_path + sub_path
+                for sub_path in dataset_generator.character_dataset_paths.values()]
+
+    stages = [Stage('audio_snippets', audio_extractor.extract_audio_snippets, inputs=videos + ground_truth,
+                    outputs=[snippets], workers=len(videos), workers_argument='max_workers'),
+              Stage('mfcc_store', dataset_generator.get_mfcc_feature_store, args=(frame_length_ms, n_mfcc),
+                    inputs=[snippets], workers=max_workers, workers_argument='max_workers', returns_path=True),
+              Stage('image_datasets', dataset_generator.build_character_image_datasets,
+                    kwargs={'character_ids': sorted(dataset_generator.character_dataset_paths)},
+                    inputs=videos + ground_truth,
+                    outputs=[File(path + filename) for path in datasets for filename in ['labels.txt', 'frames.json']],
+                    workers=len(videos), workers_argument='max_workers')]
+    return Pipeline(stages, state_path, max_workers)
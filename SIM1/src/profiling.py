@@ -0,0 +1,174 @@
+import cProfile
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+
+profile_report_path = '../../profiling/'
+stage_counters = ['items', 'bytes_read', 'bytes_written']
+
+stats_lock = threading.Lock()
+stage_stats = {}
+run_start = time.perf_counter()
+
+
+def peak_rss_bytes():
+    """
+    :return: the peak resident set size of this process and of its terminated child processes in bytes
+    """
+    # ru_maxrss is given in kilobytes on linux
+    return 1024 * max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                      resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def empty_stage_stats():
+    return {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'items': 0, 'bytes_read': 0, 'bytes_written': 0,
+            'peak_rss_bytes': 0}
+
+
+def record_stage(name, stats):
+    """
+    The aim of this method is to add the stats of one or several calls to the totals of a stage.
+    :param name: name of the stage
+    :param stats: dict holding any of the keys of empty_stage_stats
+    """
+    with stats_lock:
+        totals = stage_stats.setdefault(name, empty_stage_stats())
+        for key, value in stats.items():
+            if key == 'peak_rss_bytes':
+                totals[key] = max(totals[key], value)
+            else:
+                totals[key] += value
+
+
+def merge_stage_stats(stats):
+    """
+    The aim of this method is to add the stage stats of a worker process, see call_profiled.
+    :param stats: dict mapping stage names to their stats
+    """
+    for name, totals in stats.items():
+        record_stage(name, totals)
+
+
+def reset():
+    global run_start
+    with stats_lock:
+        stage_stats.clear()
+    run_start = time.perf_counter()
+
+
+@contextmanager
+def stage(name, items=0, bytes_read=0, bytes_written=0):
+    """
+    The aim of this method is to measure a stage of the pipeline. The wall time, the cpu time of the process and
+    the peak RSS are measured, the caller adds the number of processed items and bytes to the yielded counters.
+    Stages can be nested and run in several threads, the cpu time then covers all threads of the process.
+    :param name: name of the stage, calls of the same name are summed up
+    :param items: initial number of processed items
+    :param bytes_read: initial number of bytes read
+    :param bytes_written: initial number of bytes written
+    :return: context manager yielding a dict holding the counters items, bytes_read and bytes_written
+    """
+    counters = {'items': items, 'bytes_read': bytes_read, 'bytes_written': bytes_written}
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield counters
+    finally:
+        stats = {'calls': 1, 'wall_s': time.perf_counter() - wall_start, 'cpu_s': time.process_time() - cpu_start,
+                 'peak_rss_bytes': peak_rss_bytes()}
+        stats.update((key, counters[key]) for key in stage_counters)
+        record_stage(name, stats)
+
+
+def profiled(name=None):
+    """
+    Decorator measuring every call of a function as stage, see stage.
+    :param name: name of the stage, defaults to the name of the function
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name or function.__name__):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def call_profiled(function, *args):
+    """
+    The aim of this method is to run a function in a worker process and return the stages it measured along with
+    its result, so the parent process can merge them with merge_stage_stats. Workers run one task at a time, so the
+    stats of the worker are reset before every call.
+    :param function: the function called as function(*args)
+    :return: tuple of the result and the dict of stage stats
+    """
+    reset()
+    result = function(*args)
+    with stats_lock:
+        stats = {name: dict(totals) for name, totals in stage_stats.items()}
+    return result, stats
+
+
+def file_size(filename):
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
+
+
+def report():
+    """
+    :return: dict holding the runtime, the peak RSS and the stats of every stage measured since the last reset,
+    including the throughput in items and megabytes per second of wall time. Stages of parallel workers are summed,
+    so their wall time can exceed the runtime.
+    """
+    with stats_lock:
+        stages = {name: dict(totals) for name, totals in stage_stats.items()}
+
+    for totals in stages.values():
+        wall_s = totals['wall_s'] or float('nan')
+        totals['items_per_s'] = totals['items'] / wall_s if totals['items'] else 0.0
+        totals['mb_per_s'] = (totals['bytes_read'] + totals['bytes_written']) / 1e6 / wall_s \
+            if totals['bytes_read'] + totals['bytes_written'] else 0.0
+
+    return {'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'wall_s': time.perf_counter() - run_start,
+            'peak_rss_bytes': peak_rss_bytes(),
+            'stages': stages}
+
+
+def write_report(report_file):
+    Path(report_file).parent.mkdir(parents=True, exist_ok=True)
+    with open(report_file, 'w') as f:
+        json.dump(report(), f, indent=2)
+
+
+@contextmanager
+def profile_run(name, report_path=profile_report_path, cprofile=False):
+    """
+    The aim of this method is to profile a whole run. The stage stats are reset at the start and written as json
+    report <name>_<timestamp>.json to the report directory at the end, also if the run fails.
+    :param name: name of the run
+    :param report_path: directory of the reports
+    :param cprofile: if True the run is additionally profiled with cProfile and dumped as <name>_<timestamp>.prof,
+    which can be inspected with pstats or snakeviz
+    """
+    reset()
+    run_file = report_path + '%s_%s' % (name, time.strftime('%Y%m%d-%H%M%S'))
+    profiler = cProfile.Profile() if cprofile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            Path(report_path).mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(run_file + '.prof')
+        write_report(run_file + '.json')
+        print('[INFO] Wrote profiling report %s.json' % run_file)
@@ -0,0 +1,141 @@
+import numpy as np
+from label_store import character_map, load_ground_truth
+
+empty_frame_ids = np.empty(0, dtype=np.int64)
+
+
+class ScreenTimeIndex:
+    """
+    Interval index over the screen time of every class of a single video. An interval starts at the first labeled
+    frame of a class and ends at the first following labeled frame without the class, the end is exclusive.
+    Intervals that are still open at the end of the ground truth are closed one labeling step after the last frame.
+    Intervals start at the first line of the ground truth, see label_store.parse_ground_truth_textfile.
+    """
+
+    def __init__(self, frame_ids, labels):
+        self.frame_ids = frame_ids
+        self.labels = labels
+        self.starts = {}
+        self.ends = {}
+
+        if len(frame_ids) > 1:
+            last_frame_end = frame_ids[-1] + (frame_ids[-1] - frame_ids[-2])
+        else:
+            last_frame_end = frame_ids[-1] + 1 if len(frame_ids) > 0 else 0
+        frame_ends = np.append(frame_ids, last_frame_end)
+
+        for class_id in range(0, labels.shape[1]):
+            changes = np.diff(np.concatenate([[0], labels[:, class_id].astype(np.int8), [0]]))
+            self.starts[class_id] = frame_ends[np.flatnonzero(changes == 1)]
+            self.ends[class_id] = frame_ends[np.flatnonzero(changes == -1)]
+
+    @classmethod
+    def from_file(cls, ground_truth_file):
+        """
+        :param ground_truth_file: path of a ground truth text file or of its binary .npz label file
+        :return: the ScreenTimeIndex of the ground truth
+        """
+        return cls(*load_ground_truth(ground_truth_file))
+
+    def intervals(self, class_id):
+        """
+        :param class_id: the class id
+        :return: list of (start frame id, exclusive end frame id) tuples sorted by start
+        """
+        return list(zip(self.starts[class_id].tolist(), self.ends[class_id].tolist()))
+
+    def frame_ids_of(self, class_id):
+        """
+        :param class_id: the class id
+        :return: sorted array of the labeled frame ids of the class
+        """
+        return self.frame_ids[self.labels[:, class_id]]
+
+    def contains(self, class_id, frame_ids):
+        """
+        The aim of this method is to answer point queries, i.e. whether frames lie within the screen time of a class.
+        :param class_id: the class id
+        :param frame_ids: a frame id or an array of frame ids
+        :return: bool or bool array
+        """
+        idx = np.searchsorted(self.starts[class_id], frame_ids, side='right') - 1
+        ends = np.append(self.ends[class_id], -1)
+        return (idx >= 0) & (np.asarray(frame_ids) < ends[idx])
+
+    def classes_at(self, frame_id):
+        """
+        :param frame_id: the frame id
+        :return: list of the class ids whose screen time contains the frame
+        """
+        return [class_id for class_id in self.starts if self.contains(class_id, frame_id)]
+
+    def overlapping(self, class_id, start, end):
+        """
+        The aim of this method is to answer range queries, i.e. which intervals of a class overlap [start, end).
+        :param class_id: the class id
+        :param start: first frame id of the range
+        :param end: exclusive last frame id of the range
+        :return: list of the overlapping (start, end) tuples
+        """
+        first = np.searchsorted(self.ends[class_id], start, side='right')
+        last = np.searchsorted(self.starts[class_id], end, side='left')
+        return list(zip(self.starts[class_id][first:last].tolist(), self.ends[class_id][first:last].tolist()))
+
+    def screen_time(self, class_id):
+        """
+        :param class_id: the class id
+        :return: total number of frames covered by the intervals of the class
+        """
+        return int(np.sum(self.ends[class_id] - self.starts[class_id]))
+
+
+def load_screentime_indices(ground_truth_files):
+    """
+    The aim of this method is to build the screen time index of every ground truth file.
+    :param ground_truth_files: list of ground truth text file or binary label file paths
+    :return: dict mapping the ground truth filenames to their ScreenTimeIndex
+    """
+    return {filename.split('/')[-1]: ScreenTimeIndex.from_file(filename) for filename in ground_truth_files}
+
+
+def ground_truth_locations_from_indices(screentime_indices):
+    """
+    The aim of this method is to extract the ground truth locations from screen time indices.
+    :param screentime_indices: dict holding the screen time index per ground truth file
+    :return: a dictionary representing the ground truth locations as sorted frame id arrays per class
+    """
+    parsed_ground_truth = {}
+    for key, index in screentime_indices.items():
+        gt = {}
+        for i in range(0, len(character_map)):
+            frame_ids = index.frame_ids_of(i)
+            if len(frame_ids) > 0:
+                gt[i] = frame_ids
+        parsed_ground_truth[key] = gt
+
+    return parsed_ground_truth
+
+
+def print_ground_truth_statistics(data_locations_dict, screentime_indices=None):
+    """
+    The aim of this method is to print statistics of the ground truth.
+    :param data_locations_dict: dict holding the ground truth location data
+    :param screentime_indices: optional dict holding the screen time index per ground truth file, if given the
+    total screen time per character is printed as well
+    """
+    character_location_map = {}
+    total_samples = 0
+    print('Number of samples per character in ground truth:')
+    for i in range(0, len(character_map)):
+        no_of_samples = 0
+        for key, data_locations in data_locations_dict.items():
+            character_location_map[key] = data_locations.get(i, empty_frame_ids)
+            no_of_samples += len(character_location_map[key])
+        total_samples += no_of_samples
+        print('%s: %d' % (character_map[i], no_of_samples))
+    print('total_samples: %d' % total_samples)
+
+    if screentime_indices is not None:
+        print('Screen time per character in ground truth (frames):')
+        for i in range(0, len(character_map)):
+            print('%s: %d' % (character_map[i], sum(index.screen_time(i) for index in screentime_indices.values())))
@@ -0,0 +1,231 @@
+import json
+import os
+import cv2
+import numpy as np
+from feature_cache import get_cached
+from frame_extractor import iter_frames
+from profiling import stage
+from timebase import read_video_properties
+
+shot_index_cache_path = '../../ground_truth/shot_index/'
+shot_index_filename = 'shot_index.npz'
+# thumbnails are 36x32, i.e. 4x4 pixel blocks of the 9x8 grid of the difference hash
+thumbnail_size = (36, 32)
+default_shot_params = {'frame_stride': 1, 'histogram_bins': 32, 'histogram_threshold': 0.35, 'hash_threshold': 22,
+                       'duplicate_threshold': 8}
+
+
+def frame_thumbnail(frame):
+    return cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), thumbnail_size, interpolation=cv2.INTER_AREA)
+
+
+def difference_hashes(thumbnails):
+    """
+    The aim of this method is to compute the 64 bit difference hash of every thumbnail, i.e. whether the brightness
+    of a cell of a 9x8 grid increases towards its right neighbour.
+    :param thumbnails: uint8 array of shape (no_of_frames, 32, 36)
+    :return: uint64 array of the hashes
+    """
+    cells = thumbnails.reshape(len(thumbnails), 8, 4, 9, 4).mean(axis=(2, 4))
+    bits = cells[:, :, 1:] > cells[:, :, :-1]
+    return np.packbits(bits.reshape(len(thumbnails), 64), axis=1).view('>u8').reshape(-1).astype(np.uint64)
+
+
+def grey_histograms(thumbnails, bins=32):
+    """
+    :param thumbnails: uint8 array of shape (no_of_frames, height, width)
+    :param bins: number of histogram bins
+    :return: float32 array of shape (no_of_frames, bins) holding the normalized histogram of every thumbnail
+    """
+    pixels = thumbnails.reshape(len(thumbnails), -1)
+    bin_ids = (pixels.astype(np.int64) * bins >> 8) + np.arange(len(thumbnails))[:, None] * bins
+    counts = np.bincount(bin_ids.reshape(-1), minlength=len(thumbnails) * bins).reshape(len(thumbnails), bins)
+    return (counts / pixels.shape[1]).astype(np.float32)
+
+
+def hamming_distances(hashes, other_hashes):
+    """
+    :return: number of differing bits of the elementwise pairs of the two uint64 hash arrays
+    """
+    differences = np.bitwise_xor(np.asarray(hashes, dtype=np.uint64), np.asarray(other_hashes, dtype=np.uint64))
+    return np.unpackbits(differences.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def frame_signatures(video_path, frame_stride=1, histogram_bins=32, block_size=1024):
+    """
+    The aim of this method is to decode a video once and describe every frame_stride-th frame by the difference
+    hash and the grey histogram of its thumbnail. The thumbnails are collected in blocks, so the signatures are
+    computed vectorized.
+    :param video_path: path of the video
+    :param frame_stride: step size between the described frames
+    :param histogram_bins: number of histogram bins
+    :param block_size: number of thumbnails per block
+    :return: tuple of the frame ids, the uint64 hashes and the float32 histograms
+    """
+    _, no_of_frames = read_video_properties(video_path)
+    frame_ids, hashes, histograms, thumbnails = [], [], [], []
+
+    def add_block():
+        block = np.stack(thumbnails)
+        hashes.append(difference_hashes(block))
+        histograms.append(grey_histograms(block, histogram_bins))
+        thumbnails.clear()
+
+    with stage('shot_signatures') as counters:
+        try:
+            for frame_id, frame in iter_frames(video_path, range(0, no_of_frames, frame_stride)):
+                frame_ids.append(frame_id)
+                thumbnails.append(frame_thumbnail(frame))
+                if len(thumbnails) == block_size:
+                    add_block()
+        except IOError as e:
+            # the frame count of a container is only an estimate, the index ends at the last decodable frame
+            print('[INFO] %s, the index ends at frame %d' % (e, frame_ids[-1] if frame_ids else -1))
+        if thumbnails:
+            add_block()
+        counters['items'] = len(frame_ids)
+
+    return np.asarray(frame_ids, dtype=np.int64), np.concatenate(hashes + [np.empty(0, dtype=np.uint64)]), \
+        np.concatenate(histograms + [np.empty((0, histogram_bins), dtype=np.float32)])
+
+
+def detect_shots(hashes, histograms, histogram_threshold=0.35, hash_threshold=22):
+    """
+    The aim of this method is to find the shot boundaries, i.e. the frames whose histogram or difference hash
+    changes strongly compared to the previous frame.
+    :param hashes: uint64 difference hash per frame
+    :param histograms: normalized histogram per frame
+    :param histogram_threshold: minimum histogram change (half of the L1 distance, between 0 and 1) of a boundary
+    :param hash_threshold: minimum number of differing hash bits of a boundary
+    :return: int array of the positions of the first frame of every shot
+    """
+    if len(hashes) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    histogram_deltas = 0.5 * np.abs(np.diff(histograms, axis=0)).sum(axis=1)
+    hash_deltas = hamming_distances(hashes[1:], hashes[:-1])
+    boundaries = np.flatnonzero((histogram_deltas > histogram_threshold) | (hash_deltas > hash_threshold)) + 1
+    return np.concatenate([[0], boundaries]).astype(np.int64)
+
+
+def near_duplicate_segments(hashes, shot_starts, duplicate_threshold=8, chunk_size=256):
+    """
+    The aim of this method is to split the shots into segments of near duplicate frames. A segment ends before the
+    first frame whose hash differs from the first frame of the segment in more than duplicate_threshold bits, so
+    slow motion within a shot starts new segments as well. The middle frame of a segment represents it.
+    :param hashes: uint64 difference hash per frame
+    :param shot_starts: positions of the first frame of every shot
+    :param duplicate_threshold: maximum number of differing hash bits of near duplicate frames
+    :param chunk_size: number of frames compared against the first frame of a segment at once
+    :return: tuple of the positions of the first frame and of the representative frame of every segment
+    """
+    shot_ends = np.append(shot_starts[1:], len(hashes))
+    segment_starts = []
+    for shot_start, shot_end in zip(shot_starts, shot_ends):
+        segment_start = shot_start
+        while segment_start < shot_end:
+            segment_starts.append(segment_start)
+            position = segment_start + 1
+            while position < shot_end:
+                chunk_end = min(position + chunk_size, shot_end)
+                changes = np.flatnonzero(hamming_distances(hashes[position:chunk_end],
+                                                           np.full(chunk_end - position, hashes[segment_start],
+                                                                   dtype=np.uint64)) > duplicate_threshold)
+                if len(changes) > 0:
+                    position += changes[0]
+                    break
+                position = chunk_end
+            segment_start = position
+
+    segment_starts = np.asarray(segment_starts, dtype=np.int64)
+    segment_ends = np.append(segment_starts[1:], len(hashes))
+    return segment_starts, (segment_starts + segment_ends - 1) // 2
+
+
+def build_shot_index(video_path, output_path, frame_stride=1, histogram_bins=32, histogram_threshold=0.35,
+                     hash_threshold=22, duplicate_threshold=8):
+    """
+    The aim of this method is to write the shot index of a video, see ShotIndex for its content.
+    """
+    frame_ids, hashes, histograms = frame_signatures(video_path, frame_stride, histogram_bins)
+    shot_starts = detect_shots(hashes, histograms, histogram_threshold, hash_threshold)
+    segment_starts, representatives = near_duplicate_segments(hashes, shot_starts, duplicate_threshold)
+
+    np.savez(output_path + shot_index_filename, frame_ids=frame_ids, hashes=hashes, shot_starts=shot_starts,
+             segment_starts=segment_starts, representatives=representatives)
+    with open(output_path + 'header.json', 'w') as f:
+        json.dump({'video': os.path.basename(video_path), 'no_of_frames': len(frame_ids), 'no_of_shots':
+                   len(shot_starts), 'no_of_segments': len(segment_starts)}, f, indent=2)
+    print('[INFO] Found %d shots and %d segments of near duplicate frames in %d frames of %s' %
+          (len(shot_starts), len(segment_starts), len(frame_ids), video_path))
+
+
+class ShotIndex:
+    """
+    Shots and segments of near duplicate frames of a video. Positions refer to the rows of the indexed frames,
+    frame ids to the frames of the video. Frames between indexed frames (frame_stride > 1) belong to the segment
+    of the preceding indexed frame.
+    """
+
+    def __init__(self, frame_ids, hashes, shot_starts, segment_starts, representatives):
+        self.frame_ids = frame_ids
+        self.hashes = hashes
+        self.shot_starts = shot_starts
+        self.segment_starts = segment_starts
+        self.representatives = representatives
+
+    @classmethod
+    def from_video(cls, video_path, params=None, cache_path=None):
+        """
+        The aim of this method is to return the shot index of a video, which is built once and cached by the video
+        and the parameters.
+        :param video_path: path of the video
+        :param params: optional dict overriding default_shot_params
+        :param cache_path: directory of the cache, defaults to shot_index_cache_path
+        :return: the ShotIndex of the video
+        """
+        params = dict(default_shot_params, **(params or {}))
+        entry_path = get_cached('shot_index', [video_path], params,
+                                lambda path: build_shot_index(video_path, path, **params),
+                                cache_path=cache_path or shot_index_cache_path)
+        with np.load(entry_path + shot_index_filename) as data:
+            return cls(data['frame_ids'], data['hashes'], data['shot_starts'], data['segment_starts'],
+                       data['representatives'])
+
+    def covers(self, frame_ids):
+        """
+        :param frame_ids: array of frame ids
+        :return: boolean array, True for the frames that lie within the indexed part of the video
+        """
+        frame_ids = np.asarray(frame_ids, dtype=np.int64)
+        if len(self.frame_ids) == 0:
+            return np.zeros(len(frame_ids), dtype=bool)
+        frame_stride = self.frame_ids[1] - self.frame_ids[0] if len(self.frame_ids) > 1 else 1
+        return (frame_ids >= self.frame_ids[0]) & (frame_ids < self.frame_ids[-1] + frame_stride)
+
+    def segments_of(self, frame_ids):
+        """
+        :param frame_ids: array of frame ids
+        :return: segment number of every frame
+        """
+        positions = np.searchsorted(self.frame_ids, np.asarray(frame_ids, dtype=np.int64), side='right') - 1
+        return np.maximum(np.searchsorted(self.segment_starts, np.maximum(positions, 0), side='right') - 1, 0)
+
+    def shots_of(self, frame_ids):
+        """
+        :param frame_ids: array of frame ids
+        :return: shot number of every frame
+        """
+        positions = np.searchsorted(self.frame_ids, np.asarray(frame_ids, dtype=np.int64), side='right') - 1
+        return np.maximum(np.searchsorted(self.shot_starts, np.maximum(positions, 0), side='right') - 1, 0)
+
+    def representative_frames(self, frame_ids):
+        """
+        The aim of this method is to reduce frames to the representatives of their segments, so only one frame per
+        segment has to be decoded or predicted.
+        :param frame_ids: array of frame ids, see covers
+        :return: tuple of the sorted unique representative frame ids and the position of the representative of
+        every given frame in them
+        """
+        representative_frame_ids = self.frame_ids[self.representatives[self.segments_of(frame_ids)]]
+        return np.unique(representative_frame_ids, return_inverse=True)
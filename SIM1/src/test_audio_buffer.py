@@ -0,0 +1,51 @@
+import os
+import sys
+import threading
+import numpy as np
+import pytest
+import audio_buffer
+
+fake_ffmpeg = '''import sys
+# more warnings than a pipe buffer holds, written before the samples like ffmpeg does for damaged streams
+sys.stderr.write('warning: damaged frame\\n' * 20000)
+sys.stderr.flush()
+sys.stdout.buffer.write(b'\\0' * 4 * 22050)
+exit(int('damaged.avi' in sys.argv))
+'''
+
+
+@pytest.fixture
+def ffmpeg(tmp_path, monkeypatch):
+    script = tmp_path / 'ffmpeg'
+    script.write_text('#!%s\n%s' % (sys.executable, fake_ffmpeg))
+    os.chmod(str(script), 0o755)
+    monkeypatch.setattr(audio_buffer, 'ffmpeg_binary', lambda: str(script))
+
+
+def decode_with_timeout(*args, timeout=30):
+    result = {}
+
+    def decode():
+        try:
+            result['no_of_samples'] = audio_buffer.decode_audio_track(*args)
+        except IOError as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=decode, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'decoding blocked'
+    return result
+
+
+def test_many_warnings_do_not_block_the_decoding(tmp_path, ffmpeg):
+    result = decode_with_timeout('video.avi', str(tmp_path / 'samples.f32'))
+
+    assert result['no_of_samples'] == 22050
+    assert np.fromfile(str(tmp_path / 'samples.f32'), dtype=np.float32).shape == (22050,)
+
+
+def test_a_failed_decoding_reports_the_ffmpeg_errors(tmp_path, ffmpeg):
+    result = decode_with_timeout('damaged.avi', str(tmp_path / 'samples.f32'))
+
+    assert 'damaged frame' in str(result['error'])
@@ -0,0 +1,75 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+import audio_buffer
+import cli
+import label_store
+
+source_path = Path(__file__).resolve().parent
+labels_csv = '../../labels.csv'
+# modules the help and the text subcommands of the command line interface must not import
+heavy_modules = ['cv2', 'librosa', 'moviepy', 'tensorflow', 'skimage', 'matplotlib']
+subcommands = ['extract-audio', 'build-images', 'build-mfcc', 'stats', 'convert-labels', 'infer', 'pipeline',
+               'export-model', 'serve']
+
+
+def run_cli(argv):
+    """
+    The aim of this method is to run the command line interface in a fresh interpreter from SIM1/src.
+    :param argv: list of command line arguments
+    :return: the heavy modules imported by the command
+    """
+    code = ('import json, sys\n'
+            'import cli\n'
+            'try:\n'
+            '    cli.main(sys.argv[1:])\n'
+            'finally:\n'
+            '    print(json.dumps(sorted(set(m.split(".")[0] for m in sys.modules) & set(%r))))' % heavy_modules)
+    result = subprocess.run([sys.executable, '-c', code] + list(argv), cwd=str(source_path),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize('argv', [['--help']] + [[command, '--help'] for command in subcommands])
+def test_help_imports_no_heavy_modules(argv):
+    assert run_cli(argv) == []
+
+
+def test_stats_imports_no_heavy_modules(tmp_path):
+    assert run_cli(['--cache-path', str(tmp_path), 'stats']) == []
+    assert (tmp_path / 'labels').is_dir()
+
+
+@pytest.mark.parametrize('output_filename', ['labels.txt', 'labels.npz'])
+def test_convert_labels_imports_no_heavy_modules(tmp_path, output_filename):
+    assert run_cli(['convert-labels', labels_csv, str(tmp_path / output_filename)]) == []
+    assert (tmp_path / output_filename).is_file()
+
+
+def test_configure_paths_normalizes_directories(tmp_path, monkeypatch):
+    monkeypatch.setattr(label_store, 'label_cache_path', label_store.label_cache_path)
+    monkeypatch.setattr(audio_buffer, 'audio_cache_path', audio_buffer.audio_cache_path)
+    cache_path = str(tmp_path / 'cache')
+
+    cli.configure_paths(cli.argument_parser().parse_args(['--cache-path', cache_path, 'stats']))
+
+    assert label_store.label_cache_path == os.path.join(cache_path, 'labels', '')
+    assert audio_buffer.audio_cache_path == os.path.join(cache_path, 'audio', '')
+
+
+def test_configure_paths_numbers_further_episodes(monkeypatch):
+    dataset_generator = pytest.importorskip('dataset_generator')
+    monkeypatch.setattr(dataset_generator, 'ground_truth_txt_files', dataset_generator.ground_truth_txt_files)
+    monkeypatch.setattr(dataset_generator, 'file_map', dataset_generator.file_map)
+    ground_truth_files = dataset_generator.ground_truth_txt_files + ['../../ground_truth/Muppets-04-01-01.txt']
+    args = cli.argument_parser().parse_args(['stats'])
+    args.ground_truth_files = ground_truth_files
+
+    cli.configure_paths(args)
+
+    assert dataset_generator.file_map == {'Muppets-02-01-01.txt': 1, 'Muppets-02-04-04.txt': 2,
+                                          'Muppets-03-04-03.txt': 3, 'Muppets-04-01-01.txt': 4}
@@ -0,0 +1,27 @@
+import numpy as np
+from dataset_generator import sample_dataset_frames
+
+episode_keys = ['Muppets-02-01-01.txt', 'Muppets-02-04-04.txt', 'Muppets-03-04-03.txt']
+
+
+def episode_locations(seed, no_of_frames=3000):
+    # every labeled frame gets one of the 5 classes, the pig (2) is rare like in the ground truth
+    classes = np.random.RandomState(seed).choice(5, no_of_frames, p=[0.3, 0.1, 0.05, 0.15, 0.4])
+    frame_ids = np.arange(1, no_of_frames * 12, 12)
+    return {class_id: frame_ids[classes == class_id] for class_id in range(5)}
+
+
+def test_adding_an_episode_keeps_the_samples_of_unchanged_episodes():
+    locations = {key: episode_locations(i) for i, key in enumerate(episode_keys)}
+    _, samples = sample_dataset_frames(2, locations)
+    locations['Muppets-04-01-01.txt'] = episode_locations(3)
+    _, new_samples = sample_dataset_frames(2, locations)
+
+    no_of_changed_counts = 0
+    for class_id in samples:
+        for key in episode_keys:
+            old, new = set(samples[class_id][key].tolist()), set(new_samples[class_id][key].tolist())
+            no_of_changed_counts += len(old) != len(new)
+            # the smaller sample is part of the larger one, so an incremental build only extracts the difference
+            assert old <= new or new <= old
+    assert no_of_changed_counts > 0
@@ -0,0 +1,65 @@
+import cv2
+import numpy as np
+import feature_extractor
+from feature_extractor import extract_image_features
+
+feature_types = ('color_hist', 'raw_pixels')
+params = {'raw_pixels': {'size': (16, 16)}, 'color_hist': {'bins': (4, 4, 4)}}
+
+
+def write_images(path, seeds):
+    filenames = []
+    for seed in seeds:
+        filename = str(path / ('%d.png' % seed))
+        cv2.imwrite(filename, np.random.RandomState(seed).randint(0, 256, (24, 32, 3)).astype(np.uint8))
+        filenames.append(filename)
+    return filenames
+
+
+def count_extracted_images(monkeypatch):
+    extracted = []
+    extract_file_features = feature_extractor.extract_file_features
+
+    def counting_extract_file_features(filenames, *args):
+        extracted.extend(filenames)
+        return extract_file_features(filenames, *args)
+
+    monkeypatch.setattr(feature_extractor, 'extract_file_features', counting_extract_file_features)
+    return extracted
+
+
+def test_cached_features_equal_extracted_features(tmp_path):
+    filenames = write_images(tmp_path, range(5))
+    expected = extract_image_features(filenames, feature_types, params, max_workers=1, cache_path=None)
+
+    for _ in range(2):
+        features = extract_image_features(filenames, feature_types, params, max_workers=1,
+                                          cache_path=str(tmp_path / 'cache') + '/')
+        for feature_type in feature_types:
+            np.testing.assert_array_equal(features[feature_type], expected[feature_type])
+
+
+def test_only_new_images_are_extracted(tmp_path, monkeypatch):
+    cache_path = str(tmp_path / 'cache') + '/'
+    filenames = write_images(tmp_path, range(5))
+    extract_image_features(filenames, feature_types, params, max_workers=1, cache_path=cache_path)
+    extracted = count_extracted_images(monkeypatch)
+
+    new_filenames = write_images(tmp_path, [5])
+    features = extract_image_features(filenames[1:] + new_filenames, feature_types, params, max_workers=1,
+                                      cache_path=cache_path)
+
+    assert extracted == new_filenames
+    assert features['raw_pixels'].shape == (5, 16 * 16 * 3)
+
+
+def test_identical_images_are_extracted_once(tmp_path, monkeypatch):
+    extracted = count_extracted_images(monkeypatch)
+    filenames = write_images(tmp_path, [7])
+    (tmp_path / 'copy.png').write_bytes((tmp_path / '7.png').read_bytes())
+
+    features = extract_image_features(filenames + [str(tmp_path / 'copy.png')], feature_types, params,
+                                      max_workers=1, cache_path=str(tmp_path / 'cache') + '/')
+
+    assert len(extracted) == 1
+    np.testing.assert_array_equal(features['color_hist'][0], features['color_hist'][1])
@@ -0,0 +1,47 @@
+import numpy as np
+from frame_index import FrameIndex
+
+
+def random_index(no_of_rows=3000, dim=32, chunk_size=500):
+    descriptors = np.random.RandomState(333).rand(no_of_rows, dim).astype(np.float32)
+    descriptors /= np.linalg.norm(descriptors, axis=1, keepdims=True)
+    index = FrameIndex(descriptors, np.ones(no_of_rows), np.arange(no_of_rows), chunk_size=chunk_size)
+    index.build_ivf(nlist=20)
+    return index
+
+
+def test_approximate_search_of_all_clusters_equals_exact_search():
+    index = random_index()
+    queries = index.dense(np.arange(0, 3000, 7))
+    mask = np.random.RandomState(1).rand(len(index)) < 0.5
+
+    rows, similarities = index.approximate_search(queries, 10, nprobe=20, mask=mask)
+    exact_rows, exact_similarities = index.exact_search(queries, 10, np.flatnonzero(mask))
+
+    np.testing.assert_array_equal(rows, exact_rows)
+    np.testing.assert_allclose(similarities, exact_similarities, rtol=1e-6)
+
+
+def test_approximate_search_only_searches_the_probed_clusters():
+    index = random_index()
+    queries = index.dense(np.arange(0, 3000, 11))
+
+    rows, _ = index.approximate_search(queries, 10, nprobe=2)
+
+    probes = np.argsort(-(queries @ index.centroids.T), axis=1)[:, :2]
+    list_ids = np.empty(len(index), dtype=np.int64)
+    for list_id in range(len(index.centroids)):
+        list_ids[index.list_rows[index.list_offsets[list_id]:index.list_offsets[list_id + 1]]] = list_id
+    assert all(np.isin(list_ids[query_rows[query_rows >= 0]], query_probes).all()
+               for query_rows, query_probes in zip(rows, probes))
+
+
+def test_missing_neighbours_have_row_minus_one():
+    index = random_index()
+    mask = np.zeros(len(index), dtype=bool)
+    mask[[5, 17, 2000]] = True
+
+    rows, similarities = index.approximate_search(index.dense([5]), 5, nprobe=20, mask=mask)
+
+    assert sorted(rows[0, :3].tolist()) == [5, 17, 2000] and rows[0, 0] == 5
+    assert rows[0, 3:].tolist() == [-1, -1] and np.isinf(similarities[0, 3:]).all()
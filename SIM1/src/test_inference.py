@@ -0,0 +1,50 @@
+import numpy as np
+import inference
+from shot_index import ShotIndex
+
+
+class MeanModel:
+    """
+    Stands in for the pig model, the probability of a frame is its mean pixel value.
+    """
+    input_shape = (None, 8, 8, 3)
+
+    def __init__(self):
+        self.no_of_images = 0
+
+    def predict_on_batch(self, images):
+        self.no_of_images += len(images)
+        return images.mean(axis=(1, 2, 3)).reshape(-1, 1)
+
+
+def fake_iter_frames(no_of_decodable_frames):
+    def iter_frames(video_path, frame_ids):
+        for frame_id in frame_ids:
+            if frame_id >= no_of_decodable_frames:
+                raise IOError('Failed to read frame %d of video %r.' % (frame_id, video_path))
+            yield frame_id, np.full((16, 16, 3), frame_id, dtype=np.uint8)
+    return iter_frames
+
+
+def test_prediction_ends_at_the_last_decodable_frame(monkeypatch):
+    monkeypatch.setattr(inference, 'iter_frames', fake_iter_frames(50))
+
+    frame_ids, probabilities = inference.predict_video_frames(MeanModel(), 'v.avi', range(1, 100, 12), batch_size=2)
+
+    assert frame_ids.tolist() == [1, 13, 25, 37, 49]
+    np.testing.assert_allclose(probabilities, frame_ids / 255.0, rtol=1e-5)
+
+
+def test_frames_of_undecodable_representatives_are_not_predicted(monkeypatch):
+    # segments of 10 frames represented by their middle frame, the representatives 65, 75, ... are not decodable
+    shot_index = ShotIndex(np.arange(100), np.zeros(100, dtype=np.uint64), np.array([0]), np.arange(0, 100, 10),
+                           np.arange(5, 100, 10))
+    monkeypatch.setattr(inference, 'iter_frames', fake_iter_frames(60))
+    model = MeanModel()
+
+    frame_ids, probabilities, no_of_predictions = inference.predict_representative_frames(
+        model, 'v.avi', np.arange(1, 100, 6), shot_index)
+
+    assert frame_ids.tolist() == [1, 7, 13, 19, 25, 31, 37, 43, 49, 55]
+    np.testing.assert_allclose(probabilities, (frame_ids // 10 * 10 + 5) / 255.0, rtol=1e-5)
+    assert no_of_predictions == model.no_of_images == 6
@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+from mfcc_extractor import buffer_mfccs
+from timebase import mfcc_window
+
+librosa = pytest.importorskip('librosa')
+
+
+@pytest.mark.parametrize('block_length', [7, 100, 10 ** 6])
+def test_buffer_mfccs_equal_a_single_computation(block_length):
+    # a loud, an almost silent and a quiet second, so the top_db clipping of the log-mel spectrogram applies
+    rng = np.random.RandomState(333)
+    samples = (rng.randn(3 * 22050) * np.repeat([1.0, 1e-6, 0.3], 22050)).astype(np.float32)
+    n_fft, hop_length = mfcc_window(20, 22050)
+    expected = librosa.feature.mfcc(y=samples, sr=22050, n_mfcc=20, n_fft=n_fft, hop_length=hop_length,
+                                    center=False).T
+
+    mfccs = buffer_mfccs(samples, 22050, 20, 20, block_length=block_length)
+
+    assert mfccs.shape == expected.shape
+    np.testing.assert_allclose(mfccs, expected, rtol=1e-4, atol=1e-3)
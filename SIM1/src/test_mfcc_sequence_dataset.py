@@ -0,0 +1,27 @@
+import numpy as np
+from mfcc_sequence_dataset import iter_mfcc_sequence_batches
+from mfcc_store import write_mfcc_store
+
+
+def write_store(store_path):
+    # 12 snippets of 10 frames, the frame values identify the rows
+    char_ids = np.repeat([2, 0, 3, 2, 4, 0, 2, 3, 4, 2, 0, 1], 10)
+    features = np.repeat(np.arange(len(char_ids), dtype=np.float32)[:, None], 4, axis=1)
+    write_mfcc_store(store_path, features, np.ones(len(char_ids), dtype=np.int64), char_ids,
+                     np.repeat(np.arange(12), 10), 4, 20, 10, 22050)
+
+
+def epoch_rows(store_path, epoch):
+    return np.concatenate([batch[:, 0, 0] for batch, _ in
+                           iter_mfcc_sequence_batches(store_path, 2, 5, batch_size=4, epoch=epoch)])
+
+
+def test_every_epoch_is_shuffled_differently(tmp_path):
+    store_path = str(tmp_path / 'store') + '/'
+    write_store(store_path)
+
+    first_epoch, second_epoch = epoch_rows(store_path, 0), epoch_rows(store_path, 1)
+
+    np.testing.assert_array_equal(epoch_rows(store_path, 0), first_epoch)
+    assert not np.array_equal(first_epoch, second_epoch)
+    np.testing.assert_array_equal(np.sort(first_epoch), np.sort(second_epoch))
@@ -0,0 +1,28 @@
+import pytest
+import label_store
+from label_store import parse_ground_truth_textfile
+from screentime import ScreenTimeIndex
+
+ground_truth = '1, 4\n13, 0\n25, 0, 2\n37, 4\n'
+
+
+@pytest.mark.parametrize('header', ['', 'frame_id, labels\n'])
+def test_first_line_is_a_labeled_frame(tmp_path, header):
+    ground_truth_file = tmp_path / 'Muppets-02-01-01.txt'
+    ground_truth_file.write_text(header + ground_truth)
+
+    frame_ids, labels = parse_ground_truth_textfile(str(ground_truth_file))
+    index = ScreenTimeIndex(frame_ids, labels)
+
+    assert frame_ids.tolist() == [1, 13, 25, 37]
+    assert index.intervals(4) == [(1, 13), (37, 49)]
+    assert index.intervals(0) == [(13, 37)]
+    assert index.intervals(2) == [(25, 37)]
+
+
+def test_from_file_keeps_the_first_line(tmp_path, monkeypatch):
+    monkeypatch.setattr(label_store, 'label_cache_path', str(tmp_path / 'cache') + '/')
+    ground_truth_file = tmp_path / 'Muppets-02-01-01.txt'
+    ground_truth_file.write_text(ground_truth)
+
+    assert ScreenTimeIndex.from_file(str(ground_truth_file)).intervals(4) == [(1, 13), (37, 49)]
@@ -0,0 +1,134 @@
+import math
+import cv2
+import numpy as np
+from fractions import Fraction
+
+# used if a container does not report its frame rate
+default_video_fps = 25
+
+
+def mfcc_window(frame_length_ms, sample_rate):
+    """
+    The aim of this method is to calculate the fft window and hop length in samples for the given frame length.
+    The hop length is half of the frame length.
+    :param frame_length_ms: window size of the MFCC frames in milliseconds
+    :param sample_rate: sample rate of the audio
+    :return: tuple of n_fft and hop length in samples
+    """
+    mfcc_n_fft_factor = frame_length_ms / 1000  # window factor
+    mfcc_hop_length_factor = mfcc_n_fft_factor * 0.5  # sliding window factor
+    return int(mfcc_n_fft_factor * sample_rate), int(mfcc_hop_length_factor * sample_rate)
+
+
+def read_video_properties(video_path):
+    """
+    :param video_path: path of the video
+    :return: tuple of the frame rate as exact fraction, e.g. 30000/1001 for NTSC, and the number of frames
+    """
+    cap = cv2.VideoCapture(video_path)
+    video_fps = cap.get(cv2.CAP_PROP_FPS)
+    no_of_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    if not video_fps or math.isnan(video_fps) or video_fps <= 0:
+        print('[INFO] Video %s reports no frame rate, assume %d fps' % (video_path, default_video_fps))
+        video_fps = default_video_fps
+    return Fraction(video_fps).limit_denominator(1001), no_of_frames
+
+
+class TimeBase:
+    """
+    Time alignment of a video and its audio. Video frame ids, audio sample indices and MFCC frame indices (rows of
+    a MFCC matrix) are converted with integer arithmetic on arrays, the frame rate is kept as exact fraction. A video
+    frame starts at the first audio sample at or after its start time, MFCC row r starts at sample r * hop_length.
+    """
+
+    def __init__(self, video_fps, sample_rate, frame_length_ms=None, no_of_frames=None):
+        """
+        :param video_fps: frame rate of the video, a number or a Fraction
+        :param sample_rate: sample rate of the audio
+        :param frame_length_ms: window size of the MFCC frames in milliseconds, only needed for MFCC conversions
+        :param no_of_frames: number of frames of the video, if known
+        """
+        self.video_fps = Fraction(video_fps).limit_denominator(1001)
+        self.sample_rate = int(sample_rate)
+        self.frame_length_ms = frame_length_ms
+        self.n_fft, self.hop_length = mfcc_window(frame_length_ms, sample_rate) if frame_length_ms else (None, None)
+        self.no_of_frames = no_of_frames
+
+    @classmethod
+    def from_video(cls, video_path, sample_rate, frame_length_ms=None):
+        """
+        :param video_path: path of the video the frame rate and number of frames are read from
+        :return: the TimeBase of the video, see __init__ for the other parameters
+        """
+        video_fps, no_of_frames = read_video_properties(video_path)
+        return cls(video_fps, sample_rate, frame_length_ms, no_of_frames)
+
+    def frames_to_samples(self, frame_ids):
+        """
+        :param frame_ids: a frame id or an array of frame ids
+        :return: index of the first audio sample of every frame
+        """
+        frame_ids = np.asarray(frame_ids, dtype=np.int64)
+        return -(-frame_ids * self.sample_rate * self.video_fps.denominator // self.video_fps.numerator)
+
+    def samples_to_frames(self, samples):
+        """
+        :param samples: a sample index or an array of sample indices
+        :return: id of the frame every sample lies in
+        """
+        samples = np.asarray(samples, dtype=np.int64)
+        return samples * self.video_fps.numerator // (self.sample_rate * self.video_fps.denominator)
+
+    def frames_to_mfcc_rows(self, frame_ids):
+        """
+        :param frame_ids: a frame id or an array of frame ids
+        :return: index of the MFCC row the first sample of every frame lies in
+        """
+        return self.frames_to_samples(frame_ids) // self.hop_length
+
+    def mfcc_rows_to_frames(self, rows):
+        """
+        :param rows: a MFCC row index or an array of row indices
+        :return: id of the frame the first sample of every MFCC row lies in
+        """
+        return self.samples_to_frames(np.asarray(rows, dtype=np.int64) * self.hop_length)
+
+    def frames_to_seconds(self, frame_ids):
+        return np.asarray(frame_ids, dtype=np.int64) * self.video_fps.denominator / self.video_fps.numerator
+
+    def interval_mfcc_rows(self, intervals, no_of_rows):
+        """
+        The aim of this method is to convert intervals of video frames to the rows of a MFCC matrix computed without
+        centering (see mfcc_extractor.buffer_mfccs) whose windows lie completely inside the intervals.
+        :param intervals: list of (start frame id, end frame id) tuples, the end frame is exclusive
+        :param no_of_rows: number of rows of the MFCC matrix
+        :return: int array of shape (no_of_intervals, 2) holding the start and exclusive end row per interval
+        """
+        samples = self.frames_to_samples(np.asarray(intervals, dtype=np.int64).reshape(-1, 2))
+
+        start_rows = -(-samples[:, 0] // self.hop_length)
+        end_rows = (samples[:, 1] - self.n_fft) // self.hop_length + 1
+        rows = np.clip(np.stack([start_rows, end_rows], axis=1), 0, no_of_rows)
+        rows[:, 1] = np.maximum(rows[:, 0], rows[:, 1])
+        return rows
+
+    def check_audio_length(self, no_of_samples, tolerance_s=1.0):
+        """
+        The aim of this method is to check that the audio covers the video, e.g. that the frame rate and the sample
+        rate of the containers agree with the decoded streams. Mismatches are reported, not raised.
+        :param no_of_samples: number of decoded audio samples
+        :param tolerance_s: allowed difference of the durations in seconds
+        :return: True if the durations agree or the number of frames is unknown
+        """
+        if self.no_of_frames is None:
+            return True
+
+        video_seconds = float(self.frames_to_seconds(self.no_of_frames))
+        audio_seconds = no_of_samples / self.sample_rate
+        if abs(video_seconds - audio_seconds) > tolerance_s:
+            print('[INFO] Audio (%.2f s) and video (%.2f s at %s fps) durations differ' %
+                  (audio_seconds, video_seconds, self.video_fps))
+            return False
+        return True
@@ -1,36 +1,13 @@
-import ast
+import os
+import sys
 from pathlib import Path
 
-conversion_map = {'k': 0,
-                  'w': 1,
-                  'p': 2,
-                  's': 3,
-                  'n': 4}
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'SIM1', 'src'))
+from label_store import parse_labels_csv, write_ground_truth_textfile
 
 
 def csv_to_txt(csv_filename, output_filename, step):
-    # read mapping from csv format
-    label_mapping = {}
-    with open(csv_filename, 'r') as f:
-        for i, line in enumerate(f):
-            if i == 0:
-                continue
-
-            id = int(line.split("\"")[0].split(',')[0])
-            if id == 0:
-                id = 1
-            elif id == 1:
-                id = id + step
-            else:
-                id = step * id + 1
-
-            label_mapping[id] = ast.literal_eval(line.split('\"')[1])
-
-    # write mapping in txt format
-    with open(output_filename, 'w') as f:
-        for key, value in label_mapping.items():
-            labels = ''.join([''.join(str(conversion_map[k]) + ', ') for k, val in value.items() if val == 1])
-            f.write('%d, %s\n' % (key, labels[:-2]))
+    write_ground_truth_textfile(output_filename, *parse_labels_csv(csv_filename, step))
 
 
 if __name__ == '__main__':